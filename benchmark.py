@@ -0,0 +1,271 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import library.migrationlogger as m_logger
+import library.stubserver as stubserver
+import library.clients.ratelimiter as ratelimiter
+import library.clients.entityclient as ec
+import library.clients.httpclient as httpclient
+import library.clients.alertsclient as ac
+import library.clients.monitorsclient as monitorsclient
+import fetchmonitors
+import migratemonitors as mm
+import migratepolicies as mp
+import migrateconditions as mc
+import migrate_dashboards as md
+import migratetags as mt
+
+# Offline benchmark of the migration scripts, no New Relic account needed
+# Starts library/stubserver.py with a generated source account and runs fetchmonitors, migratemonitors,
+# migratepolicies, migrateconditions, migrate_dashboards and migratetags against it one after the other.
+# Each migrator runs in its own process, in a work directory holding its db/, output/ and logs/, and is reported with
+# the objects it migrated, the requests it made per second, p50/p99 time per object and its peak RSS
+# The client side rate limits still apply, set ENV_RATE_LIMIT_<FAMILY> to change them
+# e.g. python3 benchmark.py --policies 50 --monitors 100 --latency 0.05 --rateLimit 25 --workers 10
+
+SOURCE_ACCOUNT = '1000001'
+SOURCE_API_KEY = 'NRAK-BENCHMARKSOURCEKEY00001'
+TARGET_ACCOUNT = '2000002'
+TARGET_API_KEY = 'NRAK-BENCHMARKTARGETKEY00002'
+REGION = 'us'
+MONITORS_FILE = 'benchmark_monitors.csv'
+POLICIES_FILE = 'benchmark_policies.csv'
+DASHBOARDS_FILE = 'benchmark_dashboards.csv'
+APPS_FILE = 'benchmark_apps.csv'
+# loaded from the working directory by library/monitortypes.py
+CONFIG_FILES = ['private_location_mapping.json', 'public_location_mapping.json', 'synthetic_period_mapping.json']
+
+logger = m_logger.get_logger(os.path.basename(__file__))
+
+
+def configure_parser():
+    parser = argparse.ArgumentParser(description='Benchmark the migration scripts against a local API stub server')
+    parser.add_argument('--policies', type=int, nargs=1, required=False, default=[20], help='Alert policies to '
+                                                                                              'generate (default 20)')
+    parser.add_argument('--conditions', type=int, nargs=1, required=False, default=[2],
+                        help='Conditions of each type per policy (default 2)')
+    parser.add_argument('--monitors', type=int, nargs=1, required=False, default=[20], help='Monitors to generate '
+                                                                                              '(default 20)')
+    parser.add_argument('--dashboards', type=int, nargs=1, required=False, default=[10],
+                        help='Dashboards to generate (default 10)')
+    parser.add_argument('--apps', type=int, nargs=1, required=False, default=[10],
+                        help='APM applications to generate (default 10)')
+    parser.add_argument('--latency', type=float, nargs=1, required=False, default=[0.0],
+                        help='Seconds the stub server waits before each response (default 0)')
+    parser.add_argument('--rateLimit', type=float, nargs=1, required=False,
+                        help='Requests per second the stub server allows for each API key and endpoint family')
+    parser.add_argument('--workers', type=int, nargs=1, required=False, default=[1],
+                        help='Workers passed to the migrators that take them (default 1)')
+    parser.add_argument('--workDir', type=str, nargs=1, required=False,
+                        help='Directory to run in and keep, by default a temporary directory that is removed')
+    parser.add_argument('--toFile', type=str, nargs=1, required=False, help='File to save the results to as JSON')
+    parser.add_argument('--debug', dest='debug', required=False, action='store_true', help='Log the migrators at '
+                                                                                           'INFO level')
+    # internal, runs one migrator in the current process
+    parser.add_argument('--run', type=str, nargs=1, required=False, help=argparse.SUPPRESS)
+    parser.add_argument('--params', type=str, nargs=1, required=False, help=argparse.SUPPRESS)
+    return parser
+
+
+# Migrator, the function called once per object it migrates and the name of that object
+def run_fetchmonitors(params):
+    timestamp = fetchmonitors.fetch_monitors(SOURCE_API_KEY, SOURCE_ACCOUNT, MONITORS_FILE, SOURCE_API_KEY, REGION,
+                                             params['workers'])
+    return {'timestamp': timestamp}
+
+
+def run_migratemonitors(params):
+    mm.migrate_monitors(os.path.join('output', MONITORS_FILE), SOURCE_ACCOUNT, REGION, SOURCE_API_KEY,
+                        params['timestamp'], TARGET_ACCOUNT, REGION, TARGET_API_KEY)
+
+
+def run_migratepolicies(params):
+    mp.migrate(POLICIES_FILE, None, SOURCE_ACCOUNT, REGION, TARGET_ACCOUNT, REGION, SOURCE_API_KEY, TARGET_API_KEY)
+
+
+def run_migrateconditions(params):
+    mc.migrate(POLICIES_FILE, None, SOURCE_ACCOUNT, REGION, TARGET_ACCOUNT, REGION, SOURCE_API_KEY, TARGET_API_KEY,
+               mc.ALL_CONDITIONS, workers=params['workers'])
+
+
+def run_migrate_dashboards(params):
+    md.migrate_dashboards(DASHBOARDS_FILE, SOURCE_ACCOUNT, SOURCE_API_KEY, REGION, TARGET_ACCOUNT, TARGET_API_KEY,
+                          REGION, workers=params['workers'])
+
+
+def run_migratetags(params):
+    mt.migrate_tags(APPS_FILE, SOURCE_ACCOUNT, REGION, SOURCE_API_KEY, TARGET_ACCOUNT, REGION, TARGET_API_KEY,
+                    [ec.APM_APP])
+
+
+MIGRATORS = {
+    'fetchmonitors': (run_fetchmonitors, fetchmonitors, 'fetch_monitor', 'monitor'),
+    'migratemonitors': (run_migratemonitors, monitorsclient.MonitorsClient, 'post_monitor_definition', 'monitor'),
+    'migratepolicies': (run_migratepolicies, ac, 'create_alert_policy', 'policy'),
+    'migrateconditions': (run_migrateconditions, mc, 'migrate_policy_conditions', 'policy'),
+    'migrate_dashboards': (run_migrate_dashboards, md, 'migrate_dashboard', 'dashboard'),
+    'migratetags': (run_migratetags, ec, 'gql_mutate_add_tags_batch', 'tag batch')
+}
+
+
+# Replaces owner.attribute with a function that adds the seconds each call took to samples
+def time_calls(owner, attribute, samples):
+    function = getattr(owner, attribute)
+
+    def timed(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            samples.append(time.perf_counter() - started)
+    setattr(owner, attribute, staticmethod(timed) if isinstance(owner, type) else timed)
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+# Runs in the child process started by run_process
+def run_migrator(name, params_file):
+    with open(params_file) as params_in:
+        params = json.load(params_in)
+    m_logger.set_log_level(m_logger.LOG_LEVEL if params['debug'] else 'WARNING')
+    run, owner, attribute, _ = MIGRATORS[name]
+    request_samples = []
+    object_samples = []
+    time_calls(httpclient, 'request', request_samples)
+    time_calls(owner, attribute, object_samples)
+    started = time.perf_counter()
+    state = run(params) or {}
+    elapsed = time.perf_counter() - started
+    with open(params['result_file'], 'w') as result_out:
+        json.dump({'elapsed': elapsed, 'state': state, 'objects': len(object_samples),
+                   'object_p50': percentile(object_samples, 0.5), 'object_p99': percentile(object_samples, 0.99),
+                   'client_requests': len(request_samples), 'request_p50': percentile(request_samples, 0.5),
+                   'request_p99': percentile(request_samples, 0.99)}, result_out)
+
+
+# peak RSS in MB from the rusage of a child process, ru_maxrss is in bytes on macOS and in KB elsewhere
+def peak_rss(rusage):
+    return rusage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def run_process(name, params, work_dir, base_url):
+    params_file = os.path.join(work_dir, 'benchmark_params.json')
+    params['result_file'] = os.path.join(work_dir, 'benchmark_' + name + '.json')
+    with open(params_file, 'w') as params_out:
+        json.dump(params, params_out)
+    env = dict(os.environ, ENV_NEW_RELIC_BASE_URL=base_url)
+    command = [sys.executable, os.path.abspath(__file__), '--run', name, '--params', params_file]
+    process = subprocess.Popen(command, cwd=work_dir, env=env)
+    rss = None
+    if hasattr(os, 'wait4'):
+        _, status, rusage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        rss = peak_rss(rusage)
+    else:
+        process.wait()
+    if process.returncode != 0:
+        logger.error('%s exited with %d' % (name, process.returncode))
+        return None
+    with open(params['result_file']) as result_in:
+        result = json.load(result_in)
+    result['peak_rss_mb'] = rss
+    return result
+
+
+def write_names(work_dir, file_name, names):
+    with open(os.path.join(work_dir, file_name), 'w') as names_out:
+        names_out.write('\n'.join(names) + '\n')
+
+
+def prepare_work_dir(work_dir, args):
+    for config_file in CONFIG_FILES:
+        shutil.copy(os.path.join(os.path.dirname(os.path.abspath(__file__)), config_file), work_dir)
+    write_names(work_dir, POLICIES_FILE, ['Benchmark Policy %d' % index for index in range(args.policies[0])])
+    write_names(work_dir, DASHBOARDS_FILE, ['Benchmark Dashboard %d' % index for index in range(args.dashboards[0])])
+    write_names(work_dir, APPS_FILE, ['Benchmark App %d' % index for index in range(args.apps[0])])
+
+
+def ms(seconds):
+    return '%8.1f' % (seconds * 1000) if seconds is not None else '%8s' % '-'
+
+
+def log_results(results):
+    logger.info('%-20s %8s %-10s %8s %9s %8s %9s %9s %8s %8s %8s' % (
+        'migrator', 'objects', 'object', 'seconds', 'objects/s', 'requests', 'requests/s', 'throttled', 'p50 ms',
+        'p99 ms', 'RSS MB'))
+    for name, result in results.items():
+        if result is None:
+            logger.info('%-20s failed' % name)
+            continue
+        elapsed = result['elapsed']
+        logger.info('%-20s %8d %-10s %8.2f %9.1f %8d %9.1f %9d %s %s %8s' % (
+            name, result['objects'], result['object'], elapsed, result['objects'] / elapsed if elapsed else 0,
+            result['requests'], result['requests'] / elapsed if elapsed else 0, result['throttled'],
+            ms(result['object_p50']), ms(result['object_p99']),
+            '%.1f' % result['peak_rss_mb'] if result['peak_rss_mb'] is not None else '-'))
+
+
+def benchmark(args):
+    rate_limits = {family: args.rateLimit[0] for family in ratelimiter.FAMILIES} if args.rateLimit else None
+    server = stubserver.StubServer(latency=args.latency[0], rate_limits=rate_limits)
+    server.generate(SOURCE_ACCOUNT, SOURCE_API_KEY, TARGET_ACCOUNT, TARGET_API_KEY, policies=args.policies[0],
+                    conditions_per_policy=args.conditions[0], monitors=args.monitors[0],
+                    dashboards=args.dashboards[0], applications=args.apps[0])
+    base_url = server.start()
+    work_dir = args.workDir[0] if args.workDir else tempfile.mkdtemp(prefix='nr-migration-benchmark-')
+    os.makedirs(work_dir, exist_ok=True)
+    logger.info('Running migrators in ' + work_dir)
+    prepare_work_dir(work_dir, args)
+    params = {'workers': args.workers[0], 'debug': args.debug}
+    results = {}
+    try:
+        for name in MIGRATORS:
+            logger.info('Running ' + name)
+            before = server.stats()
+            result = run_process(name, params, work_dir, base_url)
+            after = server.stats()
+            if result is not None:
+                params.update(result.pop('state'))
+                result['object'] = MIGRATORS[name][3]
+                result['requests'] = sum(after['requests'].values()) - sum(before['requests'].values())
+                result['throttled'] = sum(after['throttled'].values()) - sum(before['throttled'].values())
+            results[name] = result
+    finally:
+        server.stop()
+        if not args.workDir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    unhandled = server.stats()['unhandled']
+    if unhandled:
+        logger.warning('Requests the stub server does not handle : ' + str(sorted(set(unhandled))))
+    log_results(results)
+    if args.toFile:
+        with open(args.toFile[0], 'w') as results_out:
+            json.dump({'arguments': {key: value for key, value in vars(args).items()
+                                     if key not in ['run', 'params']},
+                       'results': results}, results_out, indent=2)
+    return results
+
+
+def main():
+    parser = configure_parser()
+    args = parser.parse_args()
+    if args.run:
+        run_migrator(args.run[0], args.params[0])
+        return
+    start_time = time.time()
+    benchmark(args)
+    logger.info('Time taken : ' + str(time.time() - start_time) + ' seconds')
+
+
+if __name__ == '__main__':
+    main()
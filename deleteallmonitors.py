@@ -4,6 +4,7 @@ import os
 import requests
 import time
 import library.localstore as localstore
+import library.monitorstore as monitorstore
 import library.migrationlogger as migrationlogger
 import library.clients.monitorsclient as monitorsclient
 import library.utils as utils
@@ -42,16 +43,18 @@ def delete(monitors, target_acct, tgt_api_key, region):
 
 
 def delete_all_monitors(api_key, target_acct, region):
-    all_monitors_def_json = monitorsclient.MonitorsClient.fetch_all_monitors(api_key, target_acct, region)
     timestamp = time.strftime("%Y-%m%d-%H%M%S") + "-bakup"
     storage_dir = localstore.create_storage_dirs(target_acct, timestamp)
     monitor_names_file = localstore.create_output_file("monitors-" + timestamp + ".csv")
-    with monitor_names_file.open('a') as monitor_names_out:
-        for monitor_def_json in all_monitors_def_json:
+    # backed up as the listing is read, deleted once the whole listing is read so deletes do not shift its pages
+    all_monitors_def_json = []
+    with monitor_names_file.open('a') as monitor_names_out, monitorstore.create(storage_dir) as monitors:
+        for monitor_def_json in monitorsclient.MonitorsClient.iter_monitors(api_key, target_acct, region):
+            all_monitors_def_json.append(monitor_def_json)
             monitor_json = {'definition': monitor_def_json}
             monitor_name = localstore.sanitize(monitor_def_json['name'])
             monitor_names_out.write(monitor_name + "\n")
-            localstore.save_monitor_to_file(monitor_name, storage_dir, monitor_json)
+            monitors.save(monitor_name, monitor_json)
     logger.info("Backed up %d monitors in %s before deleting", len(all_monitors_def_json), storage_dir)
     del_response = delete(all_monitors_def_json, target_acct, api_key, region)
     logger.debug(del_response)
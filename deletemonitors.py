@@ -4,6 +4,7 @@ import os
 import requests
 import time
 import library.localstore as store
+import library.monitorstore as monitorstore
 import library.migrationlogger as m_logger
 import library.utils as utils
 import library.clients.monitorsclient as monitorsclient
@@ -46,7 +47,7 @@ def delete(monitor_definitions, target_account, tgt_api_key, region):
 
 def delete_monitors(from_file, tgt_account, time_stamp, tgt_api_key, region):
     monitor_names = store.load_names(from_file)
-    monitor_definitions = store.load_monitors(tgt_account, time_stamp, monitor_names)
+    monitor_definitions = monitorstore.load_monitors(tgt_account, time_stamp, monitor_names)
     del_response = delete(monitor_definitions, tgt_account, tgt_api_key, region)
     logger.debug(del_response)
 
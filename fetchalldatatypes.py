@@ -63,6 +63,13 @@ def configure_parser(is_standalone: bool = True):
         help='NR Region us | eu (default : us)',
         dest='region'
     )
+    parser.add_argument(
+        '--faceted',
+        required=False,
+        action='store_true',
+        help='Query each event type once for all hosts, faceted by entityName, instead of once per host',
+        dest='faceted'
+    )
     return parser
 
 
@@ -104,9 +111,50 @@ def fetch_metrics(host_name: str, query_key: str, acct_id: int, region: str):
         return response['json']['results'][0]['members']
 
 
-def fetch_data_types(host_file_path: str, acct_id: int, api_key: str, query_key: str, region='us'):
+# Event counts by host, one query per event type for each chunk of hosts
+def fetch_event_type_counts_by_host(host_names: list, event_type: str, query_key: str, acct_id: int, region: str):
+    event_count_query_template = "FROM %(eventType)s SELECT COUNT(*) WHERE entityName IN (%(hosts)s) " \
+                                 "FACET entityName SINCE 1 WEEK AGO LIMIT %(limit)d"
+    counts = {}
+    for hosts in insightsclient.chunk_values(host_names):
+        event_count_query = event_count_query_template % {'eventType': event_type,
+                                                          'hosts': insightsclient.in_list(hosts), 'limit': len(hosts)}
+        response = insightsclient.execute(query_key, acct_id, event_count_query, region)
+        if 'error' in response:
+            logger.error('Error executing query ' + event_count_query)
+            logger.error(response['error'])
+            continue
+        for host_name, results in insightsclient.results_by_facet(response['json']).items():
+            counts[host_name] = results[0]['count']
+    return counts
+
+
+# Metric names by host, one query for each chunk of hosts
+def fetch_metrics_by_host(host_names: list, query_key: str, acct_id: int, region: str):
+    fetch_metrics_query_template = "FROM Metric SELECT uniques(metricName) " \
+                                   "WHERE entityName IN (%(hosts)s) FACET entityName " \
+                                   "SINCE 1 week ago LIMIT %(limit)d"
+    metrics = {}
+    for hosts in insightsclient.chunk_values(host_names):
+        logger.info("fetching metrics for %d hosts", len(hosts))
+        fetch_metrics_query = fetch_metrics_query_template % {'hosts': insightsclient.in_list(hosts),
+                                                              'limit': len(hosts)}
+        response = insightsclient.execute(query_key, acct_id, fetch_metrics_query, region)
+        if 'error' in response:
+            logger.error('Could not fetch metrics for %d hosts', len(hosts))
+            logger.error(response['error'])
+            continue
+        for host_name, results in insightsclient.results_by_facet(response['json']).items():
+            metrics[host_name] = results[0]['members']
+    return metrics
+
+
+def fetch_data_types(host_file_path: str, acct_id: int, api_key: str, query_key: str, region='us', faceted=False):
     host_names = store.load_names(host_file_path)
     all_event_types = fetch_all_event_types(query_key, acct_id, region)
+    if faceted:
+        fetch_data_types_faceted(host_names, all_event_types, acct_id, query_key, region)
+        return
     for host_name in host_names:
         host_data = [['entityName', 'dataType', 'metricOrEventName']]
         logger.info('fetching data types for ' + host_name)
@@ -126,6 +174,31 @@ def fetch_data_types(host_file_path: str, acct_id: int, api_key: str, query_key:
             logger.info('No metrics or events found for ' + host_name)
 
 
+# Same CSVs as fetch_data_types, built from one query per event type (and one for metrics)
+# for each chunk of hosts instead of one query per host and event type
+def fetch_data_types_faceted(host_names: list, all_event_types: list, acct_id: int, query_key: str, region='us'):
+    metrics_by_host = fetch_metrics_by_host(host_names, query_key, acct_id, region)
+    event_types_by_host = {}
+    for event_type in all_event_types:
+        if event_type != 'Metric':
+            logger.info('fetching %s counts for %d hosts', event_type, len(host_names))
+            counts = fetch_event_type_counts_by_host(host_names, event_type, query_key, acct_id, region)
+            for host_name, event_count in counts.items():
+                if event_count > 0:
+                    event_types_by_host.setdefault(host_name, []).append(event_type)
+    for host_name in host_names:
+        host_data = [['entityName', 'dataType', 'metricOrEventName']]
+        for dim_metric in metrics_by_host.get(host_name, []):
+            host_data.append([host_name, 'Metric', dim_metric])
+        for event_type in event_types_by_host.get(host_name, []):
+            host_data.append([host_name, 'Event', event_type])
+        logger.info("Total event and metrics found %d for %s", len(host_data) - 1, host_name)
+        if len(host_data) > 1:
+            store.save_host_data_csv(host_name, host_data)
+        else:
+            logger.info('No metrics or events found for ' + host_name)
+
+
 def main():
     parser = configure_parser()
     args = parser.parse_args()
@@ -140,7 +213,7 @@ def main():
     if not hosts_file:
         logger.error('host file must be specified.')
         sys.exit()
-    fetch_data_types(hosts_file, args.source_account_id[0], api_key, insights_query_key, region)
+    fetch_data_types(hosts_file, args.source_account_id[0], api_key, insights_query_key, region, args.faceted)
 
 
 if __name__ == '__main__':
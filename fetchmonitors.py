@@ -1,8 +1,14 @@
 import argparse
 import os
+import queue
 import sys
+import threading
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import library.localstore as store
+import library.monitorstore as monitorstore
+import library.clients.httpclient as httpclient
 import library.monitortypes as monitortypes
 import library.clients.monitorsclient as mc
 import library.migrationlogger as m_logger
@@ -15,6 +21,8 @@ import library.utils as utils
 # toFile : file name only for the output file
 # the toFile will be written to output sub-directory
 # If file exists then it will be overwritten
+# since : timestamp of an earlier fetch of the same account, only new or changed monitors get their
+#         script, steps and secure credentials fetched again, the others are taken from that fetch
 
 
 logger = m_logger.get_logger(os.path.basename(__file__))
@@ -36,6 +44,10 @@ def configure_parser():
     parser.add_argument('--region', type=str, nargs=1, required=False, default='us', help='region us(default) or eu')
     parser.add_argument('--toFile', nargs=1, required=True, help='File to populate monitor names. '
                                                                  'This will be created in output directory')
+    parser.add_argument('--workers', type=int, nargs=1, required=False, default=[1],
+                        help='Number of monitors to fetch scripts, steps and secure credentials for in parallel')
+    parser.add_argument('--since', nargs=1, type=str, required=False,
+                        help='Timestamp of an earlier fetch to reuse unchanged monitors from')
     return parser
 
 
@@ -53,6 +65,9 @@ def print_params(args, src_api_key, region):
     else:
         logger.info("Will skip fetching secure credentials as insightsQueryKey is not provided")
     logger.info("Using toFile : " + args.toFile[0])
+    logger.info("Using workers : " + str(args.workers[0]))
+    if args.since:
+        logger.info("Fetching only new or changed monitors since : " + args.since[0])
 
 
 def setup_headers(args):
@@ -75,40 +90,152 @@ def validate_keys():
         sys.exit()
 
 
-def populate_secure_credentials(monitor_json, src_account, insights_key, region):
-    if insights_key:
+def populate_secure_credentials(monitor_json, src_account, insights_key, region, credentials_by_name=None):
+    if credentials_by_name is not None:
+        monitor_json.update(credentials_by_name[monitor_json['definition']['name']])
+    elif insights_key:
         sec_credentials_checks = securecredentials.from_insights(
             insights_key, src_account, monitor_json['definition']['name'], region)
         monitor_json.update(sec_credentials_checks)
 
 
-def fetch_monitors(api_key, account_id, output_file, insights_key, region):
+def enrich_monitor(api_key, account_id, monitor_def_json, insights_key, region, credentials_by_name=None):
+    monitor_json = {'definition': monitor_def_json}
+    if monitortypes.is_scripted(monitor_json['definition']):
+        populate_secure_credentials(monitor_json, account_id, insights_key, region, credentials_by_name)
+        mc.MonitorsClient.populate_script(api_key, account_id, monitor_json, monitor_json['definition']['guid'], region)
+    if monitortypes.is_step_monitor(monitor_json['definition']):
+        mc.MonitorsClient.populate_steps(api_key, account_id, monitor_json, monitor_json['definition']['guid'], region)
+    return monitor_json
+
+
+# The monitor saved by the previous fetch when its definition has not changed, with its secure credentials
+# refreshed. Returns (monitor, name in the previous fetch, unchanged) or None when it has to be enriched again
+def reuse_monitor(monitor_def_json, previous, credentials_by_name):
+    manifest_entry = previous['manifest'].get(monitor_def_json['guid'])
+    if manifest_entry is None or manifest_entry['hash'] != monitorstore.definition_hash(monitor_def_json):
+        return None
+    with previous['lock']:
+        previous_json = previous['monitors'].load(manifest_entry['name'])
+    # monitors whose names sanitize to the same file name overwrite each other, only reuse the same monitor
+    if previous_json is None or previous_json.get('definition', {}).get('guid') != monitor_def_json['guid']:
+        return None
+    monitor_json = dict(previous_json)
+    if monitortypes.is_scripted(monitor_def_json):
+        populate_secure_credentials(monitor_json, None, None, None, credentials_by_name)
+    return monitor_json, manifest_entry['name'], monitor_json == previous_json
+
+
+# Secure credentials of the scripted monitors in a page of the listing, one faceted query per chunk of names
+# instead of one query per monitor
+def fetch_credentials(insights_key, account_id, monitors_def_json, region):
+    if not insights_key:
+        return None
+    scripted_names = [monitor_def_json['name'] for monitor_def_json in monitors_def_json
+                      if monitortypes.is_scripted(monitor_def_json)]
+    return securecredentials.from_insights_bulk(insights_key, account_id, scripted_names, region)
+
+
+# Returns (monitor, name in the previous fetch or None, whether the previous copy can be linked as is)
+def fetch_monitor(api_key, account_id, monitor_def_json, insights_key, region, credentials_by_name, previous):
+    if previous is not None:
+        reused = reuse_monitor(monitor_def_json, previous, credentials_by_name)
+        if reused is not None:
+            return reused
+    return enrich_monitor(api_key, account_id, monitor_def_json, insights_key, region, credentials_by_name), None, False
+
+
+def load_previous(account_id, since):
+    previous_monitors = monitorstore.open_store(account_id, since)
+    manifest = monitorstore.load_manifest(monitorstore.monitors_dir(account_id, since), previous_monitors)
+    logger.info("Previous fetch %s has %d monitors", since, len(manifest))
+    return {'monitors': previous_monitors, 'manifest': manifest, 'lock': threading.Lock()}
+
+
+# Writes the enriched monitors taken from monitors_queue until it gets None
+# A single writer keeps the monitors saved in fetch order, so duplicate names overwrite as before
+def write_monitors(monitors_queue, monitors, errors, previous_monitors=None):
+    while True:
+        item = monitors_queue.get()
+        if item is None:
+            return
+        monitor_name, monitor_json, previous_name, unchanged = item
+        try:
+            if unchanged and previous_name == monitor_name:
+                monitors.copy_from(previous_monitors, monitor_name, monitor_json)
+            else:
+                monitors.save(monitor_name, monitor_json)
+        except Exception as e:
+            logger.error('Error saving monitor ' + monitor_name)
+            logger.error(e)
+            errors.append(e)
+
+
+# The script, steps and secure credentials of up to workers monitors are fetched in parallel while the
+# monitors already enriched are handed, in fetch order, to the writer thread
+# With since, monitors whose guid and definition match the manifest of that fetch are not fetched again
+def fetch_monitors(api_key, account_id, output_file, insights_key, region, workers=1, since=None):
     timestamp = time.strftime("%Y-%m%d-%H%M%S")
     storage_dir = store.create_storage_dirs(account_id, timestamp)
     monitor_names_file = store.create_output_file(output_file)
-    all_monitors_def_json = mc.MonitorsClient.fetch_all_monitors(api_key, account_id, region)
-    
-    monitors_count = len(all_monitors_def_json)
+    previous = load_previous(account_id, since) if since else None
+    if workers > 1:
+        httpclient.configure(pool_maxsize=max(workers, httpclient.POOL_MAXSIZE))
+    monitors_queue = queue.Queue(maxsize=workers * 2)
+    write_errors = []
+    monitors = monitorstore.create(storage_dir)
+    previous_monitors = previous['monitors'] if previous else None
+    writer = threading.Thread(target=write_monitors, args=(monitors_queue, monitors, write_errors, previous_monitors))
+    writer.start()
+    manifest = {}
+    monitors_count = 0
+    reused_count = 0
+    try:
+        with monitor_names_file.open('a') as monitor_names_out, ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            # monitors are enriched as each page of the listing arrives
+            for monitors_def_json in mc.MonitorsClient.iter_monitor_pages(api_key, account_id, region):
+                monitors_count += len(monitors_def_json)
+                credentials_by_name = fetch_credentials(insights_key, account_id, monitors_def_json, region)
+                for monitor_def_json in monitors_def_json:
+                    pending.append(executor.submit(fetch_monitor, api_key, account_id, monitor_def_json,
+                                                   insights_key, region, credentials_by_name, previous))
+                    # keep a bounded number of monitors in flight
+                    if len(pending) >= workers * 2:
+                        reused_count += save_monitor(pending.popleft().result(), monitor_names_out, monitors_queue,
+                                                     manifest)
+            while pending:
+                reused_count += save_monitor(pending.popleft().result(), monitor_names_out, monitors_queue, manifest)
+    finally:
+        monitors_queue.put(None)
+        writer.join()
+        monitors.close()
+        if previous_monitors is not None:
+            previous_monitors.close()
+    if write_errors:
+        raise write_errors[0]
+    monitorstore.save_manifest(storage_dir, manifest)
     if monitors_count <= 0:
         logger.warn("No monitors found in account " + account_id)
         return timestamp
-    else:
-        logger.info("Monitors returned %d", monitors_count)
-    with monitor_names_file.open('a') as monitor_names_out:
-        for monitor_def_json in all_monitors_def_json:
-            monitor_json = {'definition': monitor_def_json}
-            monitor_name = store.sanitize(monitor_def_json['name'])
-            monitor_names_out.write(monitor_name + "\n")
-            if monitortypes.is_scripted(monitor_json['definition']):
-                populate_secure_credentials(monitor_json, account_id, insights_key, region)
-                mc.MonitorsClient.populate_script(api_key, account_id, monitor_json, monitor_json['definition']['guid'], region)
-            if monitortypes.is_step_monitor(monitor_json['definition']):
-                mc.MonitorsClient.populate_steps(api_key, account_id, monitor_json, monitor_json['definition']['guid'], region)
-            store.save_monitor_to_file(monitor_name, storage_dir, monitor_json)
-    logger.info("Fetched %d monitors in %s", len(all_monitors_def_json), storage_dir)
+    if previous:
+        logger.info("Reused %d unchanged monitors from %s, fetched %d new or changed monitors", reused_count, since,
+                    monitors_count - reused_count)
+    logger.info("Fetched %d monitors in %s", monitors_count, storage_dir)
     return timestamp
 
 
+# Returns 1 when the monitor was reused from the previous fetch
+def save_monitor(fetched, monitor_names_out, monitors_queue, manifest):
+    monitor_json, previous_name, unchanged = fetched
+    monitor_name = store.sanitize(monitor_json['definition']['name'])
+    monitor_names_out.write(monitor_name + "\n")
+    manifest[monitor_json['definition']['guid']] = {
+        'name': monitor_name, 'hash': monitorstore.definition_hash(monitor_json['definition'])}
+    monitors_queue.put((monitor_name, monitor_json, previous_name, unchanged))
+    return 1 if previous_name is not None else 0
+
+
 def main():
     start_time = time.time()
     parser = configure_parser()
@@ -119,7 +246,9 @@ def main():
         args_insights_key = args.insightsQueryKey[0]
     region = utils.ensure_region(args)
     print_params(args, args.sourceApiKey[0], region)
-    fetch_monitors(source_api_key, str(args.sourceAccount[0]), args.toFile[0], args_insights_key, region)
+    since = args.since[0] if args.since else None
+    fetch_monitors(source_api_key, str(args.sourceAccount[0]), args.toFile[0], args_insights_key, region,
+                   args.workers[0], since)
     logger.info("Time taken : " + str(time.time() - start_time) + "seconds")
 
 
@@ -1,23 +1,70 @@
+import os
+import threading
+import library.migrationlogger as m_logger
 import library.clients.monitorsclient as mc
+from library.clients.endpoints import Endpoints
 
+logger = m_logger.get_logger(os.path.basename(__file__))
 
-# loads up monitors from an account and caches them
-# main purpose is to get monitor_id by monitor_name
+
+# loads up monitors from an account once and caches them
+# monitors are read with the entitySearch pagination of MonitorsClient.iter_monitors and indexed by
+# monitorId, guid and name, so synthetic and location failure conditions find their monitors without
+# a REST lookup or an entity search per condition
 class AccountMonitors:
-    account_monitors = {}
 
-    def __init__(self, account_id, api_key):
-        self.account_id = account_id
+    def __init__(self, account_id, api_key, region=Endpoints.REGION_US):
+        self.account_id = str(account_id)
         self.api_key = api_key
+        self.region = region
+        self.loaded = False
+        self.by_monitor_id = {}
+        self.by_guid = {}
+        self.by_name = {}
+        self.lock = threading.Lock()
 
     def load(self):
-        all_monitors_def_json = mc.fetch_all_monitors(self.api_key)
-        for monitor_def_json in all_monitors_def_json:
-            self.account_monitors[monitor_def_json['name']] = monitor_def_json
+        with self.lock:
+            if self.loaded:
+                return
+            for monitor_def_json in mc.MonitorsClient.iter_monitors(self.api_key, self.account_id, self.region):
+                self.by_monitor_id[monitor_def_json['monitorId']] = monitor_def_json
+                self.by_guid[monitor_def_json['guid']] = monitor_def_json
+                # the first monitor of a name wins, as with the entity search
+                self.by_name.setdefault(monitor_def_json['name'], monitor_def_json)
+            logger.info('Loaded %d monitors for account %s' % (len(self.by_guid), self.account_id))
+            self.loaded = True
 
     def get(self, monitor_name):
-        if not self.account_monitors:
-            self.load_monitors()
-        if monitor_name in self.account_monitors:
-            return self.account_monitors[monitor_name]
-        return None
+        self.load()
+        return self.by_name.get(monitor_name)
+
+    def get_by_monitor_id(self, monitor_id):
+        self.load()
+        return self.by_monitor_id.get(str(monitor_id))
+
+    def get_by_guid(self, guid):
+        self.load()
+        return self.by_guid.get(guid)
+
+    # source monitor name for a condition, falls back to the REST lookup for a monitor not in the account listing
+    def monitor_name(self, monitor_id):
+        monitor = self.get_by_monitor_id(monitor_id)
+        if monitor is not None:
+            return monitor['name']
+        logger.warn('Monitor %s not in account %s listing, fetching it' % (monitor_id, self.account_id))
+        result = mc.MonitorsClient.get_monitor(self.api_key, monitor_id, self.region)
+        return result['monitor']['name'] if 'monitor' in result else None
+
+
+_account_monitors = {}
+_account_monitors_lock = threading.Lock()
+
+
+# Returns the AccountMonitors for account_id and region, created on first use and shared by all policies
+def account_monitors(api_key, account_id, region=Endpoints.REGION_US):
+    key = (str(account_id), region.lower())
+    with _account_monitors_lock:
+        if key not in _account_monitors:
+            _account_monitors[key] = AccountMonitors(account_id, api_key, region)
+        return _account_monitors[key]
@@ -0,0 +1,88 @@
+import json
+import os
+import threading
+import time
+from pathlib import Path
+import library.migrationlogger as m_logger
+
+# Journal of the objects completed by a migrate_account run, used to resume the run after a failure
+# Appended to db/<source_account>/runs/<run_id>.jsonl, one JSON line per completed object:
+# {"kind": "policy", "key": "<source name or id>", "target": <target id>, "time": ...}
+# Scripts run on their own use the default no-op checkpoint, which records nothing and never skips
+
+RUNS_DIR = 'runs'
+POLICY = 'policy'
+CONDITIONS = 'conditions'
+DESTINATION = 'destination'
+CHANNEL = 'channel'
+WORKFLOW = 'workflow'
+DASHBOARD = 'dashboard'
+TAGS = 'tags'
+STEP = 'step'
+
+logger = m_logger.get_logger(os.path.basename(__file__))
+
+
+class Checkpoint:
+
+    def __init__(self, path=None, run_id=None):
+        self.path = path
+        self.run_id = run_id
+        self.completed = {}
+        self.lock = threading.Lock()
+        if path is not None and path.exists():
+            self.load()
+
+    def load(self):
+        text = self.path.read_text()
+        if text and not text.endswith('\n'):
+            # terminate the incomplete line so new entries start on a line of their own
+            with self.path.open('a') as journal:
+                journal.write('\n')
+        for line in text.splitlines():
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # the last line can be incomplete if the run was killed while writing it
+                logger.warning('Ignoring incomplete checkpoint entry ' + line.strip())
+                continue
+            self.completed[(entry['kind'], entry['key'])] = entry
+        logger.info('Loaded %d completed objects from %s' % (len(self.completed), str(self.path)))
+
+    def done(self, kind, key):
+        return (kind, str(key)) in self.completed
+
+    def target(self, kind, key):
+        entry = self.completed.get((kind, str(key)))
+        return entry['target'] if entry else None
+
+    def record(self, kind, key, target=None):
+        if self.path is None:
+            return
+        entry = {'kind': kind, 'key': str(key), 'target': target, 'time': int(time.time())}
+        with self.lock:
+            with self.path.open('a') as journal:
+                journal.write(json.dumps(entry) + '\n')
+            self.completed[(kind, str(key))] = entry
+
+
+_checkpoint = Checkpoint()
+
+
+# Starts recording to db/<src_account>/runs/<run_id>.jsonl, pass the run_id of an earlier run to resume it
+def start(src_account, run_id=None):
+    global _checkpoint
+    if not run_id:
+        run_id = time.strftime('%Y-%m-%d-%H%M%S')
+    runs_dir = Path('db') / str(src_account) / RUNS_DIR
+    runs_dir.mkdir(mode=0o777, parents=True, exist_ok=True)
+    _checkpoint = Checkpoint(runs_dir / (run_id + '.jsonl'), run_id)
+    logger.info('Recording completed objects in %s, pass --resume %s to resume this run' %
+                (str(_checkpoint.path), run_id))
+    return _checkpoint
+
+
+def current():
+    return _checkpoint
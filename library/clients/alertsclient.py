@@ -1,13 +1,17 @@
-import requests
+import library.clients.httpclient as httpclient
 import os
 import json
+import hashlib
+import time
 import library.migrationlogger as migrationlogger
 import library.utils as utils
 import library.localstore as store
 import re
+import threading
 import library.clients.entityclient as ec
 from library.clients.endpoints import Endpoints
 import library.clients.gql as nerdGraph
+from concurrent.futures import ThreadPoolExecutor
 
 logger = migrationlogger.get_logger(os.path.basename(__file__))
 
@@ -31,6 +35,8 @@ ENTITY_CONDITIONS = 'entity_conditions'
 MONITOR_ID = 'monitor_id'
 SOURCE_POLICY_ID = 'source_policy_id'
 POLICY_NAME = 'policy_name'
+# seconds a cached policy to entity map is reused while the policy list is unchanged
+POLICY_ENTITY_MAP_CACHE_TTL = int(os.environ.get('ENV_POLICY_ENTITY_MAP_CACHE_TTL', 3600))
 
 
 def setup_headers(api_key):
@@ -48,7 +54,7 @@ def get_all_alert_policies(api_key, region=Endpoints.REGION_US):
 def get_policy(api_key, name, region=Endpoints.REGION_US):
     filter_params = {'filter[name]': name, 'filter[exact_match]': True}
     result = {'policyFound': False}
-    response = requests.get(Endpoints.of(region).ALERT_POLICIES_URL, headers=setup_headers(api_key), params=filter_params)
+    response = httpclient.get(Endpoints.of(region).ALERT_POLICIES_URL, headers=setup_headers(api_key), params=filter_params)
     result['status'] = response.status_code
     if response.status_code in [200, 304]:
         policies = response.json()['policies']
@@ -62,6 +68,97 @@ def get_policy(api_key, name, region=Endpoints.REGION_US):
     return result
 
 
+# Name and id lookups over every alert policy of an account, built from a single paged fetch
+# Names missed by an incomplete index (a failed fetch) are looked up with get_policy
+class PolicyIndex:
+
+    def __init__(self, api_key, account_id, region, policies, complete=True, local=False):
+        self.api_key = api_key
+        self.account_id = str(account_id)
+        self.region = region
+        self.complete = complete
+        # names are looked up one at a time in the local store instead of loading every policy
+        self.local = local
+        self.by_name = {}
+        self.by_id = {}
+        self.lock = threading.Lock()
+        for policy in policies:
+            self.index(policy)
+
+    def index(self, policy):
+        # the REST API only matches exact names, keep the first policy when names are duplicated
+        self.by_name.setdefault(policy['name'], policy)
+        self.by_id[policy['id']] = policy
+
+    def add(self, policy):
+        with self.lock:
+            self.index(policy)
+
+    def policies(self):
+        with self.lock:
+            return list(self.by_id.values())
+
+    def get(self, name):
+        policy = self.by_name.get(name)
+        if policy:
+            return {'policyFound': True, 'status': 200, 'policy': policy}
+        if self.local:
+            policy = store.load_alert_policy(self.account_id, name)
+            if policy:
+                self.add(policy)
+                return {'policyFound': True, 'status': 200, 'policy': policy}
+        if self.complete:
+            return {'policyFound': False, 'status': 200}
+        result = get_policy(self.api_key, name, self.region)
+        if result['policyFound']:
+            self.add(result['policy'])
+        return result
+
+    def get_by_id(self, policy_id):
+        return self.by_id.get(int(policy_id))
+
+    def save(self):
+        policies = self.policies()
+        store.save_alert_policies(self.account_id, {'response_count': len(policies), POLICIES: policies})
+
+
+_policy_indexes = {}
+_policy_indexes_lock = threading.Lock()
+
+
+# Returns the PolicyIndex for account_id and region, fetching all policies only the first time
+# use_local builds the index from db/<account_id>/alert_policies saved by store_policies.py instead,
+# with the sqlite store each name is looked up when it is needed
+def policy_index(api_key, account_id, region=Endpoints.REGION_US, use_local=False):
+    key = (str(account_id), region.lower())
+    with _policy_indexes_lock:
+        if key in _policy_indexes:
+            return _policy_indexes[key]
+        if use_local and store.STORE_BACKEND == store.SQLITE:
+            logger.info('Looking up alert policies for account %s in local store' % str(account_id))
+            complete = store.has_alert_policies(account_id)
+            if not complete:
+                logger.error('No complete list of alert policies for account %s in local store, '
+                             'missing names will be fetched one at a time' % str(account_id))
+            _policy_indexes[key] = PolicyIndex(api_key, account_id, region, [], complete, local=True)
+            return _policy_indexes[key]
+        if use_local:
+            logger.info('Loading alert policies for account %s from local store' % str(account_id))
+            result = store.load_alert_policies(account_id)
+        else:
+            logger.info('Fetching all alert policies for account %s' % str(account_id))
+            result = get_all_alert_policies(api_key, region)
+        complete = POLICIES in result and 'error' not in result
+        if not complete:
+            logger.error('Could not load all alert policies for account %s, '
+                         'missing names will be fetched one at a time' % str(account_id))
+        index = PolicyIndex(api_key, account_id, region, result.get(POLICIES, []), complete)
+        if complete and not use_local:
+            index.save()
+        _policy_indexes[key] = index
+        return index
+
+
 def get_channels(api_key, region=Endpoints.REGION_US):
     return utils.get_paginated_entities(api_key, Endpoints.of(region).ALERTS_CHANNEL_URL, CHANNELS)
 
@@ -159,7 +256,7 @@ def create_channel(api_key, channel, region=Endpoints.REGION_US):
         target_channel['channel']['configuration'] = channel['configuration']
     prepare_channel(target_channel['channel'])
     result = {}
-    response = requests.post(Endpoints.of(region).ALERTS_CHANNEL_URL, headers=setup_headers(api_key),
+    response = httpclient.post(Endpoints.of(region).ALERTS_CHANNEL_URL, headers=setup_headers(api_key),
                              data=json.dumps(target_channel, indent=2))
     result['status'] = response.status_code
     if response.status_code != 201:
@@ -195,7 +292,7 @@ def put_channel_ids(api_key, policy_id, channel_ids, region=Endpoints.REGION_US)
     param_channels = ','.join(str(e) for e in channel_ids)
     params = {'policy_id': policy_id, 'channel_ids': param_channels}
     result = {}
-    response = requests.put(Endpoints.of(region).ALERT_POLICY_CHANNELS_URL, headers=setup_headers(api_key),
+    response = httpclient.put(Endpoints.of(region).ALERT_POLICY_CHANNELS_URL, headers=setup_headers(api_key),
                             params=params)
     result['status'] = response.status_code
     if response.status_code == 200:
@@ -213,7 +310,7 @@ def create_alert_policy(api_key, source_policy, region=Endpoints.REGION_US):
     alert_policy = {'policy': {'incident_preference': source_policy['incident_preference'], 'name': policy_name}}
     result = {'entityCreated': False}
     logger.info('Using endpoint ' + Endpoints.of(region).ALERT_POLICIES_URL)
-    response = requests.post(Endpoints.of(region).ALERT_POLICIES_URL, headers=setup_headers(api_key),
+    response = httpclient.post(Endpoints.of(region).ALERT_POLICIES_URL, headers=setup_headers(api_key),
                              data=json.dumps(alert_policy))
     result['status'] = response.status_code
     if response.status_code != 201:
@@ -230,14 +327,14 @@ def create_alert_policy(api_key, source_policy, region=Endpoints.REGION_US):
 
 def delete_policy(api_key, policy_id, region=Endpoints.REGION_US):
     delete_url = Endpoints.of(region).DEL_ALERTS_URL + str(policy_id) + '.json'
-    result = requests.delete(delete_url, headers=setup_headers(api_key))
+    result = httpclient.delete(delete_url, headers=setup_headers(api_key))
     logger.info(result.url)
     return result
 
 
 def delete_channel(api_key, channel_id, region=Endpoints.REGION_US):
     delete_url = Endpoints.of(region).DEL_CHANNELS_URL + str(channel_id) + '.json'
-    result = requests.delete(delete_url, headers=setup_headers(api_key))
+    result = httpclient.delete(delete_url, headers=setup_headers(api_key))
     logger.info(result.url)
     return result
 
@@ -265,7 +362,7 @@ def delete_all_channels(api_key, account_id, region=Endpoints.REGION_US):
 def create_synthetic_condition(api_key, alert_policy, synth_condition, monitor_name, region=Endpoints.REGION_US):
     create_condition_url = Endpoints.of(region).CREATE_SYNTHETICS_CONDITION_URL + str(alert_policy['id']) + '.json'
     payload = {SYNTH_CONDITION: synth_condition}
-    response = requests.post(create_condition_url, headers=setup_headers(api_key),
+    response = httpclient.post(create_condition_url, headers=setup_headers(api_key),
                              data=json.dumps(payload))
     result = {'status': response.status_code}
     if response.status_code != 201:
@@ -279,7 +376,7 @@ def create_synthetic_condition(api_key, alert_policy, synth_condition, monitor_n
 def create_loc_failure_condition(api_key, alert_policy, loc_failure_condition, region=Endpoints.REGION_US):
     create_condition_url = Endpoints.of(region).LOC_FAILURE_CONDITIONS_URL + str(alert_policy['id']) + '.json'
     payload = {LOCATION_FAILURE_CONDITION: loc_failure_condition}
-    response = requests.post(create_condition_url, headers=setup_headers(api_key),
+    response = httpclient.post(create_condition_url, headers=setup_headers(api_key),
                              data=json.dumps(payload))
     result = {'status': response.status_code}
     if response.status_code != 201:
@@ -298,7 +395,7 @@ def create_alert_condition(api_key, create_url, cond_key, alert_policy, conditio
     create_condition_url = create_url + str(alert_policy['id']) + '.json'
     payload = {cond_key: condition}
     result = {}
-    response = requests.post(create_condition_url, headers=setup_headers(api_key),
+    response = httpclient.post(create_condition_url, headers=setup_headers(api_key),
                              data=json.dumps(payload))
     result['status'] = response.status_code
     if response.status_code != 201:
@@ -316,7 +413,7 @@ def create_extsvc_condition(api_key, alert_policy, condition, region=Endpoints.R
 def create_infra_condition(api_key, alert_policy, condition, region=Endpoints.REGION_US):
     payload = {INFRA_CONDITION: condition}
     result = {}
-    response = requests.post(Endpoints.of(region).CREATE_INFRA_CONDITION_URL, headers=setup_headers(api_key),
+    response = httpclient.post(Endpoints.of(region).CREATE_INFRA_CONDITION_URL, headers=setup_headers(api_key),
                              data=json.dumps(payload))
     result['status'] = response.status_code
     if response.status_code != 201:
@@ -329,7 +426,7 @@ def create_infra_condition(api_key, alert_policy, condition, region=Endpoints.RE
 
 def delete_condition(api_key, alert_policy, app_condition, region=Endpoints.REGION_US):
     delete_url = Endpoints.of(region).APP_CONDITIONS_URL + str(app_condition['id']) + '.json'
-    result = requests.delete(delete_url, headers=setup_headers(api_key))
+    result = httpclient.delete(delete_url, headers=setup_headers(api_key))
     logger.info('Delete status for ' + alert_policy['name'] + ':' + app_condition['name'] + str(result.status_code))
 
 
@@ -385,51 +482,119 @@ def get_alert_status_file_name(fromFile, fromFileEntities, src_account_id, tgt_a
     return status_file_name + str(tgt_account_id) + suffix + '.csv'
 
 
-def get_policy_entity_map(api_key, alert_policies, region=Endpoints.REGION_US):
+# App entity ids targeted by the app conditions of one policy
+def get_policy_entities(api_key, policy, region=Endpoints.REGION_US):
+    policy_id = policy['id']
+    logger.info('Loading app entity conditions for policy ID %d...' % policy_id)
+    conditions = get_app_conditions(api_key, policy_id, region)
+    result = {'entities': set()}
+    if 'error' in conditions:
+        result['error'] = conditions['error']
+    if not 'response_count' in conditions or conditions['response_count'] == 0:
+        logger.info('No app entity conditions found for policy ID %d' % policy_id)
+        return result
+    logger.info('%d app entity conditions found for policy ID %d. Mapping to app entities.' % (conditions['response_count'], policy_id))
+    for condition in conditions['conditions']:
+        result['entities'].update(condition['entities'])
+    return result
+
+
+# Maps policy names to app entity ids and entity ids to policy names, with sets for both
+# Policies are fetched on workers threads. When a previous map is passed, policies whose updated_at
+# has not changed since it was built reuse its entities instead of fetching their conditions again
+def get_policy_entity_map(api_key, alert_policies, region=Endpoints.REGION_US, workers=1, previous=None):
     entities_by_policy = {}
-    policies_by_entity = {}
+    updated_at_by_policy = {}
+    previous_entities = (previous or {}).get('entities_by_policy', {})
+    previous_updated_at = (previous or {}).get('updated_at_by_policy', {})
+    to_fetch = []
     for policy in alert_policies:
-        policy_id = policy['id']
         policy_name = policy['name']
-        apps = []
-        logger.info('Loading app entity conditions for policy ID %d...' % policy_id)
-        conditions = get_app_conditions(api_key, policy_id, region)
-        if not 'response_count' in conditions or conditions['response_count'] == 0:
-            logger.info('No app entity conditions found for policy ID %d' % policy_id)
-            entities_by_policy[policy_name] = []
-            continue
-        
-        logger.info('%d app entity conditions found for policy ID %d. Mapping to app entities.' % (conditions['response_count'], policy_id))
-
-        for condition in conditions['conditions']:
-            entities = condition['entities']
-            for entity_id in entities:
-                if not entity_id in apps:
-                    apps.append(entity_id)
+        entities_by_policy.setdefault(policy_name, set())
+        updated_at = policy.get('updated_at')
+        if updated_at is not None and previous_updated_at.get(policy_name) == updated_at \
+                and policy_name in previous_entities:
+            entities_by_policy[policy_name].update(previous_entities[policy_name])
+            updated_at_by_policy[policy_name] = updated_at
+        else:
+            to_fetch.append(policy)
+    if previous is not None:
+        logger.info('%d of %d policies changed since the last map was built' % (len(to_fetch), len(alert_policies)))
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(lambda policy: get_policy_entities(api_key, policy, region), to_fetch))
+    else:
+        results = [get_policy_entities(api_key, policy, region) for policy in to_fetch]
+    for policy, result in zip(to_fetch, results):
+        entities_by_policy[policy['name']].update(result['entities'])
+        # a policy that failed to load is fetched again by the next incremental refresh
+        if 'error' not in result and policy.get('updated_at') is not None:
+            updated_at_by_policy[policy['name']] = policy['updated_at']
 
-                if not entity_id in policies_by_entity:
-                    policies_by_entity[entity_id] = []
+    policies_by_entity = {}
+    for policy_name, entities in entities_by_policy.items():
+        for entity_id in entities:
+            policies_by_entity.setdefault(str(entity_id), set()).add(policy_name)
 
-                if not policy_name in policies_by_entity[entity_id]:
-                    policies_by_entity[entity_id].append(policy_name)
+    return {
+        'entities_by_policy': entities_by_policy,
+        'policies_by_entity': policies_by_entity,
+        'updated_at_by_policy': updated_at_by_policy
+    }
 
-        entities_by_policy[policy_name] = apps 
 
+# The saved shape of get_policy_entity_map, sorted lists in place of sets
+def policy_entity_map_json(policy_entity_map):
     return {
-        'entities_by_policy': entities_by_policy,
-        'policies_by_entity': policies_by_entity
+        'entities_by_policy': {policy_name: sorted(entities)
+                               for policy_name, entities in policy_entity_map['entities_by_policy'].items()},
+        'policies_by_entity': {entity_id: sorted(policy_names)
+                               for entity_id, policy_names in policy_entity_map['policies_by_entity'].items()},
+        'updated_at_by_policy': policy_entity_map.get('updated_at_by_policy', {})
     }
 
 
+# Changes whenever a policy is added, removed, renamed or updated
+def policies_fingerprint(alert_policies):
+    policies = sorted([policy['id'], policy['name'], policy.get('updated_at')] for policy in alert_policies)
+    return hashlib.sha1(json.dumps(policies).encode('utf-8')).hexdigest()
+
+
+# Policy to entity map for account_id and region, cached in db/<account_id>/alert_policies
+# The cache is used as is while the policy list is unchanged and younger than POLICY_ENTITY_MAP_CACHE_TTL,
+# when policies changed only their conditions are fetched again. An expired cache is rebuilt in full
+def cached_policy_entity_map(api_key, account_id, region=Endpoints.REGION_US):
+    alert_policies = get_all_alert_policies(api_key, region)
+    fingerprint = policies_fingerprint(alert_policies['policies'])
+    cache = store.load_alert_policy_entity_map_cache(account_id, region)
+    fresh = 'map' in cache and time.time() - cache['cached_at'] < POLICY_ENTITY_MAP_CACHE_TTL
+    if fresh and cache['fingerprint'] == fingerprint:
+        logger.info('Using cached policy entity map for account %s' % str(account_id))
+        return cache['map']
+    policy_entity_map = get_policy_entity_map(api_key, alert_policies['policies'], region,
+                                              previous=cache['map'] if fresh else None)
+    alert_policy_entity_map = policy_entity_map_json(policy_entity_map)
+    if 'error' not in alert_policies:
+        store.save_alert_policy_entity_map_cache(account_id, region, {'cached_at': time.time(),
+                                                                      'fingerprint': fingerprint,
+                                                                      'map': alert_policy_entity_map})
+    return alert_policy_entity_map
+
+
 def get_policy_names_by_entities(entity_names, account_id, api_key, use_local, region=Endpoints.REGION_US):
     names = []
-    if use_local:
-        alert_policy_entity_map = store.load_alert_policy_entity_map(account_id)
+    if use_local and store.STORE_BACKEND == store.SQLITE:
+        # one indexed lookup per entity with the sqlite store
+        policies_of = lambda entity_id: store.load_policy_names_by_entity(account_id, entity_id)
     else:
-        alert_policies = get_all_alert_policies(api_key, region)
-        alert_policy_entity_map = get_policy_entity_map(api_key, alert_policies['policies'])
-    
-    policies_by_entity = alert_policy_entity_map['policies_by_entity']
+        if use_local:
+            # the json map is read once, not once per entity
+            policies_by_entity = store.load_alert_policy_entity_map(account_id).get('policies_by_entity', {})
+        else:
+            policies_by_entity = cached_policy_entity_map(api_key, account_id, region)['policies_by_entity']
+        policies_of = lambda entity_id: sorted(policies_by_entity.get(entity_id, []))
+    # names are resolved from one entity search per entity type
+    entities_resolver = ec.entity_resolver(api_key, account_id, region)
 
     for entity_name in entity_names:
         entity_id = None
@@ -441,7 +606,7 @@ def get_policy_names_by_entities(entity_names, account_id, api_key, use_local, r
             if match:
                 entity_type = match.group(1)
                 entity_name = match.group(2)
-            result = ec.get_entity_by_name(api_key, account_id, entity_type, entity_name, region)
+            result = entities_resolver.match_by_name(entity_type, entity_name)
             if not result['entityFound']:
                 continue
             entity = result['entity']
@@ -451,7 +616,6 @@ def get_policy_names_by_entities(entity_names, account_id, api_key, use_local, r
             else:
                 entity_id = str(entity['applicationId'])
         
-        if entity_id in policies_by_entity and len(policies_by_entity[entity_id]) > 0:
-            names.extend(policies_by_entity[entity_id])
+        names.extend(policies_of(entity_id))
 
     return names
@@ -0,0 +1,185 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import library.migrationlogger as m_logger
+import library.clients.httpclient as httpclient
+import library.clients.ratelimiter as ratelimiter
+from library.clients.endpoints import Endpoints
+
+# asyncio NerdGraph client, for running many queries at once from a single thread
+# post() returns the same result as gql.GraphQl.post ({'status', 'error' or 'response'}) and
+# gql() the same as entityclient.gql ({'error', 'status', 'data'})
+# Each API key has at most ENV_NERDGRAPH_CONCURRENCY requests in flight (default 50), requests are still
+# paced by the httpclient rate limiter. Identical queries already in flight are sent only once and
+# every caller gets the same result, mutations are always sent
+# aiohttp is optional. When it is installed the requests are sent from the event loop's thread. Without it,
+# or while httpclient has a cassette so that the requests are recorded or replayed, each request runs
+# httpclient.post on asyncio's default thread pool, so at most min(32, cpus + 4) are in flight at a time
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+CONCURRENCY = int(os.environ.get('ENV_NERDGRAPH_CONCURRENCY', 50))
+
+logger = m_logger.get_logger(os.path.basename(__file__))
+
+
+def headers(api_key):
+    return {'api-key': api_key, 'Content-Type': 'application/json'}
+
+
+def payload_hash(payload):
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def is_mutation(payload):
+    return payload.get('query', '').lstrip().startswith('mutation')
+
+
+# Just enough of a requests.Response for httpclient.is_throttled and httpclient.retry_after
+class AsyncResponse:
+
+    def __init__(self, status_code, text, response_headers):
+        self.status_code = status_code
+        self.text = text
+        self.content = text.encode('utf-8')
+        self.headers = response_headers
+
+    def json(self):
+        return json.loads(self.text)
+
+
+def graphql_result(response):
+    result = {'status': response.status_code}
+    if response.status_code != 200:
+        logger.error('HTTP error %d : %s' % (response.status_code, response.text))
+        result['error'] = 'HTTP error %d: %s' % (response.status_code, response.text)
+        return result
+    if response.text:
+        try:
+            response_json = response.json()
+        except ValueError:
+            logger.error('Error : ' + response.text)
+            result['error'] = response.text
+            return result
+        if 'errors' in response_json:
+            logger.error('Error : ' + response.text)
+            result['error'] = response_json['errors']
+        else:
+            logger.debug('Success : ' + response.text)
+            result['response'] = response_json
+    return result
+
+
+class AsyncNerdGraph:
+
+    def __init__(self, concurrency=CONCURRENCY):
+        self.concurrency = concurrency
+        self.semaphores = {}
+        self.in_flight = {}
+        self.session = None
+        self.coalesced = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def semaphore(self, api_key):
+        if api_key not in self.semaphores:
+            self.semaphores[api_key] = asyncio.Semaphore(self.concurrency)
+        return self.semaphores[api_key]
+
+    async def post(self, api_key, payload, region=Endpoints.REGION_US):
+        if is_mutation(payload):
+            return await self.send(api_key, payload, region)
+        key = (api_key, region, payload_hash(payload))
+        task = self.in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self.send(api_key, payload, region))
+            self.in_flight[key] = task
+            task.add_done_callback(lambda done: self.in_flight.pop(key, None))
+        else:
+            self.coalesced += 1
+        # shield so a cancelled caller does not cancel the request shared with the others
+        return dict(await asyncio.shield(task))
+
+    async def gql(self, api_key, payload, region=Endpoints.REGION_US):
+        result = await self.post(api_key, payload, region)
+        if 'error' in result:
+            return {'error': result['error'], 'status': result['status'], 'data': None}
+        if 'response' not in result:
+            return {'error': None, 'status': result['status'], 'data': None}
+        return {'error': None, 'status': result['status'], 'data': result['response'].get('data')}
+
+    async def send(self, api_key, payload, region):
+        async with self.semaphore(api_key):
+            if aiohttp is None or httpclient.has_cassette():
+                response = await asyncio.to_thread(httpclient.post, Endpoints.of(region).GRAPHQL_URL, region,
+                                                   headers=headers(api_key), data=json.dumps(payload))
+            else:
+                response = await self.aiohttp_post(api_key, payload, region)
+        return graphql_result(response)
+
+    # Same pacing and retries as httpclient.request, without blocking the event loop
+    async def aiohttp_post(self, api_key, payload, region):
+        if self.session is None:
+            self.session = aiohttp.ClientSession()
+        url = Endpoints.of(region).GRAPHQL_URL
+        bucket = httpclient.bucket(url, api_key)
+        attempt = 0
+        while True:
+            wait = bucket.reserve()
+            while wait > 0:
+                await asyncio.sleep(wait)
+                wait = bucket.reserve()
+            async with self.session.post(url, headers=headers(api_key), data=json.dumps(payload)) as response:
+                text = await response.text()
+                response = AsyncResponse(response.status, text, response.headers)
+            if not httpclient.is_throttled(response, ratelimiter.NERDGRAPH):
+                bucket.succeeded()
+                return response
+            if attempt >= httpclient.MAX_RETRIES:
+                logger.error('Giving up after %d throttled attempts POST %s' % (attempt + 1, url))
+                return response
+            delay = httpclient.retry_after(response)
+            if delay is None:
+                delay = httpclient.backoff(attempt)
+            bucket.throttled(delay)
+            attempt += 1
+
+
+# Runs the payloads concurrently and returns their entityclient.gql results in the same order
+# Blocking, for callers that are not themselves async. Safe to call from worker threads
+def gql_all(api_key, payloads, region=Endpoints.REGION_US, concurrency=CONCURRENCY):
+    async def run():
+        async with AsyncNerdGraph(concurrency) as client:
+            return await asyncio.gather(*[client.gql(api_key, payload, region) for payload in payloads])
+    if not payloads:
+        return []
+    if in_event_loop():
+        # asyncio.run can not be nested, run on a thread of its own
+        results = []
+        thread = threading.Thread(target=lambda: results.extend(asyncio.run(run())))
+        thread.start()
+        thread.join()
+        return results
+    return asyncio.run(run())
+
+
+def in_event_loop():
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
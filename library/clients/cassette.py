@@ -0,0 +1,202 @@
+import atexit
+import collections
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+import zlib
+from urllib.parse import urlencode
+import requests
+from requests.structures import CaseInsensitiveDict
+import library.migrationlogger as m_logger
+import library.clients.ratelimiter as ratelimiter
+from library.clients.endpoints import Endpoints
+
+# Records the requests made through httpclient, and their responses, to a gzipped JSON Lines cassette
+# and serves them back without a network, so a migration recorded once can be replayed offline to compare
+# the calls made and the time taken by a code change
+# Set ENV_HTTP_CASSETTE to the cassette file and ENV_HTTP_CASSETTE_MODE to record or replay
+# Recording appends to the cassette, one line per HTTP exchange including throttled ones:
+# {"method", "url", "params", "body", "key", "status", "headers", "content", "elapsed"}
+# Each line is written and flushed as a gzip member of its own, so a recording that is killed keeps the
+# requests made until then. A member cut short at the end of the cassette is ignored on replay
+# Request bodies are kept as a sha256, API keys only as ratelimiter.mask(api_key) and keys found in a
+# response are masked the same way. URLs sent to ENV_NEW_RELIC_BASE_URL are recorded as the New Relic URL
+# Replay matches on method, url, params, body and masked key. Identical requests get the recorded responses
+# in the order they were recorded, then the last one again. A request that was not recorded raises a
+# requests ConnectionError, as it would offline. Each response waits for its recorded time multiplied by
+# ENV_HTTP_CASSETTE_LATENCY_SCALE (default 1, 0 to answer at once)
+
+RECORD = 'record'
+REPLAY = 'replay'
+MODES = [RECORD, REPLAY]
+RESPONSE_HEADERS = ['Content-Type', 'Link', 'Retry-After']
+
+logger = m_logger.get_logger(os.path.basename(__file__))
+
+
+class CassetteMiss(requests.exceptions.ConnectionError):
+    pass
+
+
+# The New Relic URLs of urls rewritten by Endpoints.rebase, so recordings made against a stub server match
+def original_url(url):
+    if Endpoints.base_url:
+        return url.replace(Endpoints.base_url.rstrip('/') + '/', 'https://')
+    return url
+
+
+def body_of(kwargs):
+    body = kwargs.get('data')
+    if body is None and kwargs.get('json') is not None:
+        body = json.dumps(kwargs['json'])
+    if body is None:
+        return None
+    if isinstance(body, dict):
+        body = urlencode(sorted(body.items()))
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    return hashlib.sha256(body).hexdigest()
+
+
+def params_of(kwargs):
+    params = kwargs.get('params')
+    if not params:
+        return None
+    if isinstance(params, dict):
+        params = sorted(params.items())
+    return urlencode(params, doseq=True)
+
+
+def redact(text, api_key):
+    if api_key and text:
+        return text.replace(api_key, ratelimiter.mask(api_key))
+    return text
+
+
+def as_response(entry, url):
+    response = requests.Response()
+    response.status_code = entry['status']
+    response.headers = CaseInsensitiveDict(entry['headers'])
+    response._content = entry['content'].encode('utf-8')
+    response.encoding = 'utf-8'
+    response.url = url
+    return response
+
+
+class Cassette:
+
+    def __init__(self, path, mode, latency_scale=1.0):
+        if mode not in MODES:
+            raise ValueError('Cassette mode must be one of ' + str(MODES) + ', not ' + str(mode))
+        self.path = path
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self.lock = threading.Lock()
+        self.file = None
+        self.entries = None
+        self.last = {}
+        self.recorded = 0
+        self.replayed = 0
+        self.repeated = 0
+        self.missed = 0
+        self.recorded_time = 0.0
+
+    @staticmethod
+    def key(method, url, api_key, kwargs):
+        return method.upper(), original_url(url), params_of(kwargs), body_of(kwargs), ratelimiter.mask(api_key)
+
+    def request(self, session, method, url, api_key, **kwargs):
+        if self.mode == REPLAY:
+            return self.replay(method, url, api_key, kwargs)
+        started = time.monotonic()
+        response = session.request(method, url, **kwargs)
+        self.record(method, url, api_key, kwargs, response, time.monotonic() - started)
+        return response
+
+    def record(self, method, url, api_key, kwargs, response, elapsed):
+        method, url, params, body, key = self.key(method, url, api_key, kwargs)
+        headers = {name: response.headers[name] for name in RESPONSE_HEADERS if name in response.headers}
+        if 'Link' in headers:
+            headers['Link'] = original_url(headers['Link'])
+        line = json.dumps({'method': method, 'url': url, 'params': params, 'body': body, 'key': key,
+                           'status': response.status_code, 'headers': headers,
+                           'content': redact(response.content.decode('utf-8', 'replace'), api_key),
+                           'elapsed': round(elapsed, 6)}, separators=(',', ':'))
+        member = gzip.compress((line + '\n').encode('utf-8'))
+        with self.lock:
+            if self.file is None:
+                logger.info('Recording HTTP requests to ' + self.path)
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                self.file = open(self.path, 'ab')
+            self.file.write(member)
+            self.file.flush()
+            self.recorded += 1
+            self.recorded_time += elapsed
+
+    def load(self):
+        logger.info('Replaying HTTP requests from ' + self.path)
+        self.entries = collections.defaultdict(collections.deque)
+        with gzip.open(self.path, 'rt', encoding='utf-8') as cassette_file:
+            try:
+                for line in cassette_file:
+                    if not line.endswith('\n'):
+                        raise EOFError('Incomplete last line')
+                    entry = json.loads(line)
+                    key = (entry['method'], entry['url'], entry['params'], entry['body'], entry['key'])
+                    self.entries[key].append(entry)
+            except (EOFError, gzip.BadGzipFile, zlib.error) as e:
+                logger.warning('Ignoring the incomplete end of ' + self.path + ' : ' + str(e))
+
+    def replay(self, method, url, api_key, kwargs):
+        key = self.key(method, url, api_key, kwargs)
+        with self.lock:
+            if self.entries is None:
+                self.load()
+            if self.entries[key]:
+                entry = self.last[key] = self.entries[key].popleft()
+                self.replayed += 1
+            elif key in self.last:
+                entry = self.last[key]
+                self.repeated += 1
+            else:
+                self.missed += 1
+                entry = None
+            if entry is not None:
+                self.recorded_time += entry['elapsed']
+        if entry is None:
+            raise CassetteMiss('No recorded response for %s %s in %s' % (method, url, self.path))
+        if self.latency_scale > 0:
+            time.sleep(entry['elapsed'] * self.latency_scale)
+        return as_response(entry, url)
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    def report(self):
+        if self.mode == RECORD and self.recorded:
+            logger.info('Recorded %d requests taking %.1fs to %s' % (self.recorded, self.recorded_time, self.path))
+        elif self.mode == REPLAY and self.entries is not None:
+            logger.info('Replayed %d requests, %d repeated, %d not recorded, recorded time %.1fs scaled by %s' %
+                        (self.replayed, self.repeated, self.missed, self.recorded_time, self.latency_scale))
+
+
+# The cassette set by ENV_HTTP_CASSETTE and ENV_HTTP_CASSETTE_MODE, None when there is none
+def from_env():
+    path = os.environ.get('ENV_HTTP_CASSETTE')
+    if not path:
+        return None
+    return open_cassette(path, os.environ.get('ENV_HTTP_CASSETTE_MODE', REPLAY),
+                         float(os.environ.get('ENV_HTTP_CASSETTE_LATENCY_SCALE', 1.0)))
+
+
+def open_cassette(path, mode, latency_scale=1.0):
+    cassette = Cassette(path, mode.lower(), latency_scale)
+    atexit.register(cassette.report)
+    atexit.register(cassette.close)
+    return cassette
@@ -6,15 +6,40 @@ class Endpoints:
     logger = m_logger.get_logger(os.path.basename(__file__))
     REGION_US = "us"
     REGION_EU = "eu"
+    # Sends every request to another server, e.g. the stub server used by benchmark.py
+    # Set with ENV_NEW_RELIC_BASE_URL=http://127.0.0.1:8080 or use_base_url(). The host of each endpoint becomes
+    # the first path segment: https://api.newrelic.com/graphql -> http://127.0.0.1:8080/api.newrelic.com/graphql
+    base_url = os.environ.get('ENV_NEW_RELIC_BASE_URL')
 
     @classmethod
     def of(cls, region=REGION_US):
         if region.lower() == cls.REGION_US:
-            return USEndpoints()
+            endpoints = USEndpoints()
         elif region.lower() == cls.REGION_EU:
-            return EUEndpoints()
+            endpoints = EUEndpoints()
         else:
             cls.logger.error("Incorrect region specified. Region can be either us or eu")
+            return None
+        if cls.base_url:
+            rebase(endpoints, cls.base_url)
+        return endpoints
+
+    @classmethod
+    def use_base_url(cls, base_url):
+        cls.base_url = base_url.rstrip('/') if base_url else None
+
+    @classmethod
+    def region_of(cls, url):
+        if '.eu.newrelic.com' in url:
+            return cls.REGION_EU
+        return cls.REGION_US
+
+
+def rebase(endpoints, base_url):
+    for name in dir(endpoints):
+        url = getattr(endpoints, name)
+        if name.isupper() and isinstance(url, str) and url.startswith('https://'):
+            setattr(endpoints, name, base_url.rstrip('/') + '/' + url[len('https://'):])
 
 
 class USEndpoints:
@@ -1,10 +1,14 @@
-import requests
+import library.clients.httpclient as httpclient
+import library.clients.asyncgql as asyncgql
 import json
 import os
 import library.migrationlogger as m_logger
 import collections
 import logging
+import threading
+import library.localstore as store
 from library.clients.endpoints import Endpoints
+from concurrent.futures import ThreadPoolExecutor
 
 # Fix for deprecation of collections.Sequence in Python 3.7 and subsequent removal in 3.10
 collections.Sequence = collections.abc.Sequence
@@ -258,7 +262,7 @@ def matched_entity_name(entity_type, entity, tgt_account_id, name):
 def get_matching_kt(tgt_api_key, kt_name, region):
     filter_params = {'filter[name]': kt_name}
     result = {'entityFound': False}
-    response = requests.get(Endpoints.of(region).GET_APM_KT_URL, headers=rest_api_headers(tgt_api_key),
+    response = httpclient.get(Endpoints.of(region).GET_APM_KT_URL, headers=rest_api_headers(tgt_api_key),
                             params=filter_params)
     result['status'] = response.status_code
     if response.text:
@@ -279,7 +283,7 @@ def gql_get_matching_entity(api_key, entity_type, src_entity, tgt_account_id, re
     logger.info('looking for matching entity ' + src_entity['name'] + ' in account ' + tgt_account_id)
     payload = search_query_payload(entity_type, src_entity['name'], tgt_account_id)
     result = {'entityFound': False}
-    response = requests.post(Endpoints.of(region).GRAPHQL_URL, headers=gql_headers(api_key), data=json.dumps(payload))
+    response = httpclient.post(Endpoints.of(region).GRAPHQL_URL, headers=gql_headers(api_key), data=json.dumps(payload))
     result['status'] = response.status_code
     if response.text:
         response_json = response.json()
@@ -318,7 +322,7 @@ def gql_get_matching_entity_by_name(api_key, entity_type, name, tgt_acct_id, reg
     logger.info('Searching matching entity for type:' + entity_type + ', name:' + name + ', acct:' + str(tgt_acct_id))
     payload = search_query_payload(entity_type, name, tgt_acct_id)
     result = {'entityFound': False}
-    response = requests.post(Endpoints.of(region).GRAPHQL_URL, headers=gql_headers(api_key), data=json.dumps(payload))
+    response = httpclient.post(Endpoints.of(region).GRAPHQL_URL, headers=gql_headers(api_key), data=json.dumps(payload))
     result['status'] = response.status_code
     if response.text:
         response_json = response.json()
@@ -400,7 +404,7 @@ def gql_get_entities_by_type(api_key, entity_type, acct_id=None, tag_name=None,
 
     while not done:
         payload = get_entities_payload(entity_type, acct_id, nextCursor, tag_name, tag_value)
-        response = requests.post(Endpoints.of(region).GRAPHQL_URL, headers=gql_headers(api_key), data=json.dumps(payload))
+        response = httpclient.post(Endpoints.of(region).GRAPHQL_URL, headers=gql_headers(api_key), data=json.dumps(payload))
         if response.status_code != 200:
             done = True
             if response.text:
@@ -442,11 +446,137 @@ def gql_get_entities_by_type(api_key, entity_type, acct_id=None, tag_name=None,
     return result
 
 
+# In memory lookups over every entity of an account, prefetched with gql_get_entities_by_type
+# Each entity type is fetched the first time it is needed and then indexed by (type, name), applicationId,
+# monitorId and guid. match / match_by_name return the same results as gql_get_matching_entity and
+# gql_get_matching_entity_by_name, falling back to those searches when a type could not be prefetched.
+# With use_local the entities are loaded from the db/<account_id>/entities snapshot written by an earlier run
+class EntityResolver:
+
+    def __init__(self, api_key, account_id, region=DEFAULT_REGION, use_local=False):
+        self.api_key = api_key
+        self.account_id = str(account_id)
+        self.region = region
+        self.use_local = use_local
+        self.loaded = {}
+        self.by_name = {}
+        self.by_application_id = {}
+        self.by_monitor_id = {}
+        self.by_guid = {}
+        self.kts = {}
+        self.lock = threading.Lock()
+        self.type_locks = {}
+
+    # types load independently of each other, so several of them can be fetched at once
+    def type_lock(self, entity_type):
+        with self.lock:
+            return self.type_locks.setdefault(entity_type, threading.Lock())
+
+    def load(self, entity_type):
+        with self.type_lock(entity_type):
+            if entity_type in self.loaded:
+                return self.loaded[entity_type]
+            entities = None
+            if self.use_local:
+                snapshot = store.load_entities(self.account_id, entity_type)
+                if 'entities' in snapshot:
+                    logger.info('Loaded %d %s entities for account %s from local store' %
+                                (len(snapshot['entities']), entity_type, self.account_id))
+                    entities = snapshot['entities']
+            if entities is None:
+                result = gql_get_entities_by_type(self.api_key, entity_type, self.account_id, region=self.region)
+                if 'error' in result:
+                    logger.error('Could not prefetch %s entities for account %s, searching them one at a time' %
+                                 (entity_type, self.account_id))
+                    self.loaded[entity_type] = False
+                    return False
+                entities = result['entities']
+                store.save_entities(self.account_id, entity_type, {'count': len(entities), 'entities': entities})
+            with self.lock:
+                for entity in entities:
+                    self.index(entity_type, entity)
+            self.loaded[entity_type] = True
+            return True
+
+    def index(self, entity_type, entity):
+        self.by_name.setdefault((entity_type, entity['name']), []).append(entity)
+        self.by_guid[entity['guid']] = entity
+        if 'applicationId' in entity:
+            # browser apps injected by an APM agent share the APM applicationId
+            self.by_application_id[(entity_type, str(entity['applicationId']))] = entity
+        if 'monitorId' in entity:
+            self.by_monitor_id[str(entity['monitorId'])] = entity
+
+    def entities_named(self, entity_type, name):
+        return self.by_name.get((entity_type, name), [])
+
+    def match(self, entity_type, src_entity):
+        if not self.load(entity_type):
+            return gql_get_matching_entity(self.api_key, entity_type, src_entity, self.account_id, self.region)
+        entities = self.entities_named(entity_type, src_entity['name'])
+        result = {'entityFound': False, 'status': 200, 'count': len(entities), 'entities': entities}
+        set_matched_entity(entities, entity_type, result, src_entity, self.account_id)
+        return result
+
+    def match_by_name(self, entity_type, name):
+        if entity_type == APM_KT:
+            return self.match_kt(name)
+        if not self.load(entity_type):
+            return gql_get_matching_entity_by_name(self.api_key, entity_type, name, self.account_id, self.region)
+        entities = self.entities_named(entity_type, name)
+        result = {'entityFound': False, 'status': 200, 'count': len(entities), 'entities': entities}
+        set_matched_entity_by_name(self.account_id, entity_type, name, result)
+        return result
+
+    # key transactions are not entity search results, only repeated REST lookups are saved
+    def match_kt(self, name):
+        with self.lock:
+            if name in self.kts:
+                return self.kts[name]
+        result = get_matching_kt(self.api_key, name, self.region)
+        with self.lock:
+            self.kts[name] = result
+        return result
+
+    def get_by_application_id(self, entity_type, application_id):
+        self.load(entity_type)
+        return self.by_application_id.get((entity_type, str(application_id)))
+
+    def get_by_monitor_id(self, monitor_id):
+        self.load(SYNTH_MONITOR)
+        return self.by_monitor_id.get(str(monitor_id))
+
+    def get_by_guid(self, guid):
+        return self.by_guid.get(guid)
+
+
+# Loads every entity type into each resolver at once instead of on first use
+def prefetch_entities(resolvers, entity_types):
+    jobs = [(resolver, entity_type) for resolver in resolvers for entity_type in entity_types]
+    if not jobs:
+        return
+    with ThreadPoolExecutor(max_workers=len(jobs)) as executor:
+        list(executor.map(lambda job: job[0].load(job[1]), jobs))
+
+
+_entity_resolvers = {}
+_entity_resolvers_lock = threading.Lock()
+
+
+# Returns the EntityResolver for account_id and region, created on first use
+def entity_resolver(api_key, account_id, region=DEFAULT_REGION, use_local=False):
+    key = (str(account_id), region.lower())
+    with _entity_resolvers_lock:
+        if key not in _entity_resolvers:
+            _entity_resolvers[key] = EntityResolver(api_key, account_id, region, use_local)
+        return _entity_resolvers[key]
+
+
 def gql(api_key, payload, region=DEFAULT_REGION):
     if logger.isEnabledFor(logging.DEBUG):
         logger.debug(json.dumps(payload, indent=2))
         
-    response = requests.post(Endpoints.of(region).GRAPHQL_URL, headers=gql_headers(api_key), data=json.dumps(payload))
+    response = httpclient.post(Endpoints.of(region).GRAPHQL_URL, headers=gql_headers(api_key), data=json.dumps(payload))
     if response.status_code != 200:
         logger.error('HTTP error fetching entities: %d: %s' % (
             response.status_code, response.text()
@@ -513,7 +643,7 @@ def show_url_for_app(entity_type, app_id, region=Endpoints.REGION_US):
 def get_app_entity(api_key, entity_type, app_id, region=Endpoints.REGION_US):
     result = {'entityFound': False}
     get_url = show_url_for_app(entity_type, app_id, region)
-    response = requests.get(get_url, headers=rest_api_headers(api_key))
+    response = httpclient.get(get_url, headers=rest_api_headers(api_key))
     result['status'] = response.status_code
     if response.status_code != 200:
         if response.text:
@@ -528,7 +658,7 @@ def get_app_entity(api_key, entity_type, app_id, region=Endpoints.REGION_US):
 def get_apm_entity_by_name(api_key, app_name, region=Endpoints.REGION_US):
     params = {'filter[name]': app_name}
     result = {'entityFound': False}
-    response = requests.get(Endpoints.of(region).GET_APM_APP_URL, headers=rest_api_headers(api_key), params=params)
+    response = httpclient.get(Endpoints.of(region).GET_APM_APP_URL, headers=rest_api_headers(api_key), params=params)
     result['status'] = response.status_code
     if response.status_code != 200:
         if response.text:
@@ -549,7 +679,7 @@ def get_browser_entity(api_key, app_id, region=Endpoints.REGION_US):
     params = {'filter[ids]': [app_id]}
     result = {'entityFound': False}
     get_url = Endpoints.of(region).GET_BROWSER_APP_URL
-    response = requests.get(get_url, headers=rest_api_headers(api_key), params=params)
+    response = httpclient.get(get_url, headers=rest_api_headers(api_key), params=params)
     logger.info(response.url)
     result['status'] = response.status_code
     if response.status_code != 200:
@@ -572,7 +702,7 @@ def get_browser_entity(api_key, app_id, region=Endpoints.REGION_US):
 def get_apm_kt(api_key, kt_id, region=Endpoints.REGION_US):
     result = {'entityFound': False}
     get_url = Endpoints.of(region).SHOW_APM_KT_URL + kt_id + '.json'
-    response = requests.get(get_url, headers=rest_api_headers(api_key))
+    response = httpclient.get(get_url, headers=rest_api_headers(api_key))
     result['status'] = response.status_code
     if response.status_code != 200:
         if response.text:
@@ -609,7 +739,7 @@ def get_entity_by_name(api_key, acct_id, entity_type, entity_name, region=Endpoi
 def put_apm_label(api_key, category, name, applications, region=Endpoints.REGION_US):
     label_payload = {'label': {'category': category, 'name': name, 'links': {'applications': applications}}}
     result = {}
-    response = requests.put(Endpoints.of(region).PUT_LABEL_URL, headers=rest_api_headers(api_key),
+    response = httpclient.put(Endpoints.of(region).PUT_LABEL_URL, headers=rest_api_headers(api_key),
                             data=json.dumps(label_payload))
     result['status'] = response.status_code
     if response.status_code in [200, 204] and response.text:
@@ -632,7 +762,7 @@ def put_apm_settings(api_key, app_id, app_settings, region=Endpoints.REGION_US):
         }
     result = {}
     update_app_url = Endpoints.of(region).SHOW_APM_APP_URL + str(app_id) + '.json'
-    response = requests.put(update_app_url, headers=rest_api_headers(api_key), data=json.dumps(updated_settings))
+    response = httpclient.put(update_app_url, headers=rest_api_headers(api_key), data=json.dumps(updated_settings))
     result['status'] = response.status_code
     if response.status_code in [200, 204] and response.text:
         result['application'] = response.json()['application']
@@ -645,17 +775,14 @@ def put_apm_settings(api_key, app_id, app_settings, region=Endpoints.REGION_US):
 # Output: array of tags that need to be applied on target entity
 def tags_diff(src_tags, tgt_tags):
     tags_arr = []
+    tgt_keys = {tgt_tag['key'] for tgt_tag in tgt_tags}
     for src_tag in src_tags:
-        match_found = False
-        for tgt_tag in tgt_tags:
-            if src_tag['key'] == tgt_tag['key']:
-                match_found = True
-                continue
-        if match_found == False:
-            if (src_tag['key'].startswith('nr.')):
-                logger.debug(f'Skipping reserved key: {src_tag}')
-            else:
-                tags_arr.append(src_tag)
+        if src_tag['key'] in tgt_keys:
+            continue
+        if (src_tag['key'].startswith('nr.')):
+            logger.debug(f'Skipping reserved key: {src_tag}')
+        else:
+            tags_arr.append(src_tag)
     return tags_arr
 
 def mutate_tags_payload(entity_guid, arr_tags, mutate_action):
@@ -683,7 +810,7 @@ def replace_tags_payload(entity_guid, arr_tags):
 def gql_mutate_add_tags(per_api_key, entity_guid, arr_tags, region=DEFAULT_REGION):
     payload = apply_tags_payload(entity_guid, arr_tags)
     result = {}
-    response = requests.post(Endpoints.of(region).GRAPHQL_URL, headers=gql_headers(per_api_key), data=json.dumps(payload))
+    response = httpclient.post(Endpoints.of(region).GRAPHQL_URL, headers=gql_headers(per_api_key), data=json.dumps(payload))
     result['status'] = response.status_code
     if response.text:
         response_json = response.json()
@@ -696,10 +823,61 @@ def gql_mutate_add_tags(per_api_key, entity_guid, arr_tags, region=DEFAULT_REGIO
     return result
 
 
+def add_tags_batch_payload(guid_tags):
+    params = []
+    mutations = []
+    variables = {}
+    for idx, (entity_guid, arr_tags) in enumerate(guid_tags):
+        params.append('$guid%d: EntityGuid!, $tags%d: [TaggingTagInput!]!' % (idx, idx))
+        mutations.append('''t%d: taggingAddTagsToEntity(guid: $guid%d, tags: $tags%d) {
+                                        errors {
+                                            message
+                                            type
+                                        }
+                                    }''' % (idx, idx, idx))
+        variables['guid%d' % idx] = entity_guid
+        variables['tags%d' % idx] = arr_tags
+    apply_tags_query = 'mutation(' + ', '.join(params) + ') {\n' + '\n'.join(mutations) + '\n}'
+    return {'query': apply_tags_query, 'variables': variables}
+
+
+# Adds tags to several entities with one mutation, guid_tags is a list of (entity_guid, tags)
+# Returns a gql_mutate_add_tags style result for each entity, errors are reported against the alias they belong to
+def gql_mutate_add_tags_batch(per_api_key, guid_tags, region=DEFAULT_REGION):
+    payload = add_tags_batch_payload(guid_tags)
+    response = httpclient.post(Endpoints.of(region).GRAPHQL_URL, headers=gql_headers(per_api_key), data=json.dumps(payload))
+    results = [{'status': response.status_code} for _ in guid_tags]
+    if response.status_code != 200 or not response.text:
+        logger.error('Error adding tags to %d entities : %s' % (len(guid_tags), response.text))
+        for result in results:
+            result['error'] = response.text
+        return results
+    response_json = response.json()
+    data = response_json.get('data') or {}
+    errors_by_alias = {}
+    for error in response_json.get('errors') or []:
+        alias = (error.get('path') or [None])[0]
+        errors_by_alias.setdefault(alias, []).append(error)
+    for idx, result in enumerate(results):
+        alias = 't%d' % idx
+        # errors without a path apply to every alias
+        errors = errors_by_alias.get(alias, []) + errors_by_alias.get(None, [])
+        if data.get(alias) and data[alias].get('errors'):
+            errors.extend(data[alias]['errors'])
+        if not errors and not data.get(alias):
+            errors = [{'message': 'No result for ' + alias}]
+        if errors:
+            logger.error('Error adding tags to entity %s : %s' % (guid_tags[idx][0], json.dumps(errors)))
+            result['error'] = errors
+        else:
+            result['response'] = {'data': {'taggingAddTagsToEntity': data[alias]}}
+    return results
+
+
 def gql_mutate_replace_tags(per_api_key, entity_guid, tags, region=DEFAULT_REGION):
     payload = replace_tags_payload(entity_guid, tags)
     result = {}
-    response = requests.post(Endpoints.of(region).GRAPHQL_URL, headers=gql_headers(per_api_key), data=json.dumps(payload))
+    response = httpclient.post(Endpoints.of(region).GRAPHQL_URL, headers=gql_headers(per_api_key), data=json.dumps(payload))
     result['status'] = response.status_code
     if response.text:
         response_json = response.json()
@@ -749,7 +927,7 @@ def dashboard_query_payload(dashboard_guid):
 def get_dashboard_widgets(per_api_key, dashboard_guid, region=DEFAULT_REGION):
     result = {'entityFound': False}
     payload = dashboard_query_payload(dashboard_guid)
-    response = requests.post(Endpoints.of(region).GRAPHQL_URL, headers=gql_headers(per_api_key), data=json.dumps(payload))
+    response = httpclient.post(Endpoints.of(region).GRAPHQL_URL, headers=gql_headers(per_api_key), data=json.dumps(payload))
     result['status'] = response.status_code
     if response.status_code != 200:
         if response.text:
@@ -791,7 +969,7 @@ def create_dashboard_payload(acct_id, dashboard):
 
 def post_dashboard(per_api_key, dashboard, acct_id, region=DEFAULT_REGION):
     payload = create_dashboard_payload(acct_id, dashboard)
-    response = requests.post(Endpoints.of(region).GRAPHQL_URL, headers=gql_headers(per_api_key), data=json.dumps(payload))
+    response = httpclient.post(Endpoints.of(region).GRAPHQL_URL, headers=gql_headers(per_api_key), data=json.dumps(payload))
     result = {'status': response.status_code}
 
     if response.status_code != 200 and response.status_code != 201:
@@ -833,7 +1011,7 @@ def delete_dashboard_payload(guid):
 
 def delete_dashboard(per_api_key, guid, region=DEFAULT_REGION):
     payload = delete_dashboard_payload(guid)
-    response = requests.post(Endpoints.of(region).GRAPHQL_URL, headers=gql_headers(per_api_key), data=json.dumps(payload))
+    response = httpclient.post(Endpoints.of(region).GRAPHQL_URL, headers=gql_headers(per_api_key), data=json.dumps(payload))
     result = {'status': response.status_code}
 
     if response.status_code != 200:
@@ -881,16 +1059,72 @@ def delete_all_dashboards(per_api_key, acct_id, region):
         delete_dashboard(per_api_key, dashboard['guid'], region)
 
 
-def get_nrql_condition_ids_payload(account_id, policy_id, nextCursor = None):
+# Every field of an NRQL condition that is copied to the target account
+# Shared by the search query and the single / aliased nrqlCondition lookups so a page of conditions
+# comes back complete in one response
+NRQL_CONDITION_FIELDS = '''
+    description
+    enabled
+    expiration {
+        closeViolationsOnExpiration
+        expirationDuration
+        openViolationOnExpiration
+    }
+    id
+    name
+    nrql {
+        query
+    }
+    policyId
+    runbookUrl
+    signal {
+        aggregationDelay
+        aggregationMethod
+        aggregationTimer
+        aggregationWindow
+        evaluationDelay
+        evaluationOffset
+        fillOption
+        fillValue
+        slideBy
+    }
+    terms {
+        operator
+        priority
+        threshold
+        thresholdDuration
+        thresholdOccurrences
+    }
+    type
+    violationTimeLimitSeconds
+    ... on AlertsNrqlStaticCondition {
+        valueFunction
+    }
+    ... on AlertsNrqlOutlierCondition {
+        expectedGroups
+        openViolationOnGroupOverlap
+    }
+    ... on AlertsNrqlBaselineCondition {
+        baselineDirection
+    }
+'''
+
+# Number of aliased nrqlCondition lookups packed into a single request by get_nrql_conditions_by_ids
+NRQL_CONDITIONS_BATCH_SIZE = 50
+# Number of aliased taggingAddTagsToEntity mutations packed into a single request by gql_mutate_add_tags_batch
+TAG_MUTATIONS_BATCH_SIZE = 25
+
+
+def nrql_conditions_search_payload(account_id, policy_id, fields, nextCursor = None):
     cursor = ', cursor: "%s"' % nextCursor if nextCursor else ''
-    nrql_condition_ids_query = '''
+    nrql_conditions_query = '''
         query($accountId: Int!, $policyId: ID!) { 
             actor {
                 account(id: $accountId) {
                     alerts {
                         nrqlConditionsSearch(searchCriteria: {policyId: $policyId}%s) {
                             nrqlConditions {
-                                id
+                                %s
                             }
                             nextCursor
                         }
@@ -898,12 +1132,12 @@ def get_nrql_condition_ids_payload(account_id, policy_id, nextCursor = None):
                 }
             }
         }
-    ''' % cursor
-    
-    logger.debug(nrql_condition_ids_query)
+    ''' % (cursor, fields)
+
+    logger.debug(nrql_conditions_query)
 
     return {
-        'query': nrql_condition_ids_query,
+        'query': nrql_conditions_query,
         'variables': {
             'accountId': int(account_id),
             'policyId': policy_id
@@ -911,25 +1145,41 @@ def get_nrql_condition_ids_payload(account_id, policy_id, nextCursor = None):
     }
 
 
-def get_nrql_condition_ids(api_key, account_id, policy_id, region):
-    ids = []
+def get_nrql_condition_ids_payload(account_id, policy_id, nextCursor = None):
+    return nrql_conditions_search_payload(account_id, policy_id, 'id', nextCursor)
+
+
+def get_nrql_conditions_search_payload(account_id, policy_id, nextCursor = None):
+    return nrql_conditions_search_payload(account_id, policy_id, NRQL_CONDITION_FIELDS, nextCursor)
+
+
+def search_nrql_conditions(api_key, account_id, policy_id, payload_builder, region):
+    conditions = []
 
     def build_payload(nextCursor):
-        return get_nrql_condition_ids_payload(account_id, policy_id, nextCursor)
+        return payload_builder(account_id, policy_id, nextCursor)
 
     def process_payload(data):
         search = data['actor']['account']['alerts']['nrqlConditionsSearch']
         if not search:
             return None
         if 'nrqlConditions' in search:
-            for condition in search['nrqlConditions']:
-                ids.append(condition['id'])
+            conditions.extend(search['nrqlConditions'])
         return search['nextCursor']
     error = gql_get_paginated_results(api_key, build_payload, process_payload, region)
 
     return {
         'error': error,
-        'condition_ids': ids
+        'conditions': conditions
+    }
+
+
+def get_nrql_condition_ids(api_key, account_id, policy_id, region):
+    result = search_nrql_conditions(api_key, account_id, policy_id, get_nrql_condition_ids_payload, region)
+
+    return {
+        'error': result['error'],
+        'condition_ids': [condition['id'] for condition in result['conditions']]
     }
 
 
@@ -940,56 +1190,13 @@ def get_nrql_condition_payload(account_id, condition_id):
                 account(id: $accountId) {
                     alerts {
                         nrqlCondition(id: $conditionId) {
-                            description
-                            enabled
-                            expiration {
-                                closeViolationsOnExpiration
-                                expirationDuration
-                                openViolationOnExpiration
-                            }
-                            id
-                            name
-                            nrql {
-                                query
-                            }
-                            policyId
-                            runbookUrl
-                            signal {
-                                aggregationDelay
-                                aggregationMethod
-                                aggregationTimer
-                                aggregationWindow
-                                evaluationDelay
-                                evaluationOffset
-                                fillOption
-                                fillValue
-                                slideBy
-                            }
-                            terms {
-                                operator
-                                priority
-                                threshold
-                                thresholdDuration
-                                thresholdOccurrences
-                            }
-                            type
-                            violationTimeLimitSeconds
-                            ... on AlertsNrqlStaticCondition {
-                                valueFunction
-                            }
-                            ... on AlertsNrqlOutlierCondition {
-                                expectedGroups
-                                openViolationOnGroupOverlap
-                            }
-                            ... on AlertsNrqlBaselineCondition {
-                                baselineDirection
-                            }
+                            %s
                         }
                     }
                 }
             }
         }
-    '''
+    ''' % NRQL_CONDITION_FIELDS
 
     logger.debug(nrql_condition_query)
 
@@ -1002,30 +1209,65 @@ def get_nrql_condition_payload(account_id, condition_id):
     }
 
 
-def get_nrql_conditions(api_key, account_id, policy_id, region):
-    condition_ids = get_nrql_condition_ids(api_key, account_id, policy_id, region)
-    if condition_ids['error']:
-        return {
-            'error': condition_ids['error'],
-            'conditions': None
+# One query with an aliased nrqlCondition lookup (c0, c1, ...) per condition id
+def get_nrql_conditions_by_ids_payload(account_id, condition_ids):
+    variables = {'accountId': int(account_id)}
+    params = ['$accountId: Int!']
+    lookups = []
+    for idx, condition_id in enumerate(condition_ids):
+        variables['id%d' % idx] = condition_id
+        params.append('$id%d: ID!' % idx)
+        lookups.append('''
+                        c%d: nrqlCondition(id: $id%d) {
+                            %s
+                        }''' % (idx, idx, NRQL_CONDITION_FIELDS))
+
+    nrql_conditions_query = '''
+        query(%s) { 
+            actor {
+                account(id: $accountId) {
+                    alerts {%s
+                    }
+                }
+            }
         }
+    ''' % (', '.join(params), ''.join(lookups))
 
+    logger.debug(nrql_conditions_query)
+
+    return {
+        'query': nrql_conditions_query,
+        'variables': variables
+    }
+
+
+# The batches are fetched concurrently
+def get_nrql_conditions_by_ids(api_key, account_id, condition_ids, region, batch_size=NRQL_CONDITIONS_BATCH_SIZE):
     conditions = []
-    for condition_id in condition_ids['condition_ids']:
-        result = gql(
-            api_key,
-            get_nrql_condition_payload(account_id, condition_id),
-            region
-        )
+    batches = [condition_ids[start:start + batch_size] for start in range(0, len(condition_ids), batch_size)]
+    results = asyncgql.gql_all(
+        api_key,
+        [get_nrql_conditions_by_ids_payload(account_id, batch) for batch in batches],
+        region
+    )
+    for batch, result in zip(batches, results):
         if result['error']:
             return {
                 'error': result['error'],
                 'conditions': None
             }
 
-        nrql_condition = result['data']['actor']['account']['alerts']['nrqlCondition']
-        if nrql_condition:
-            conditions.append(nrql_condition)
+        if result['data'] is None:
+            return {
+                'error': 'No data in the response for nrql conditions ' + str(batch),
+                'conditions': None
+            }
+
+        alerts = result['data']['actor']['account']['alerts']
+        for idx in range(len(batch)):
+            nrql_condition = alerts.get('c%d' % idx)
+            if nrql_condition:
+                conditions.append(nrql_condition)
 
     return {
         'error': None,
@@ -1033,6 +1275,23 @@ def get_nrql_conditions(api_key, account_id, policy_id, region):
     }
 
 
+def get_nrql_conditions(api_key, account_id, policy_id, region):
+    result = search_nrql_conditions(api_key, account_id, policy_id, get_nrql_conditions_search_payload, region)
+    if not result['error']:
+        return result
+
+    # Fall back to searching for the ids only and fetching the conditions in aliased batches
+    logger.warning('Unable to search NRQL conditions for policy %s, fetching them by id' % str(policy_id))
+    condition_ids = get_nrql_condition_ids(api_key, account_id, policy_id, region)
+    if condition_ids['error']:
+        return {
+            'error': condition_ids['error'],
+            'conditions': None
+        }
+
+    return get_nrql_conditions_by_ids(api_key, account_id, condition_ids['condition_ids'], region)
+
+
 def create_nrql_condition(
     api_key,
     region,
@@ -1,5 +1,5 @@
 import os
-import requests
+import library.clients.httpclient as httpclient
 import json
 import library.migrationlogger as logger
 from library.clients.endpoints import Endpoints
@@ -16,7 +16,7 @@ class GraphQl:
     @staticmethod
     def post(per_api_key, payload, region=Endpoints.REGION_US):
         result = {}
-        response = requests.post(Endpoints.of(region).GRAPHQL_URL, headers=GraphQl.headers(per_api_key),
+        response = httpclient.post(Endpoints.of(region).GRAPHQL_URL, headers=GraphQl.headers(per_api_key),
                                  data=json.dumps(payload))
         result['status'] = response.status_code
         if response.text:
@@ -0,0 +1,191 @@
+import atexit
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+import requests
+from requests.adapters import HTTPAdapter
+import library.migrationlogger as m_logger
+import library.clients.ratelimiter as ratelimiter
+import library.clients.cassette as cassette
+from library.clients.endpoints import Endpoints
+
+# Shared HTTP transport for every client in library/clients
+# One keep-alive requests.Session is kept per region so repeated calls reuse their TCP+TLS connections
+# instead of paying a new handshake for every module level requests.get/post
+# Pool sizes can be set with ENV_HTTP_POOL_CONNECTIONS / ENV_HTTP_POOL_MAXSIZE or configure()
+# Requests are rate limited per API key and endpoint family (see ratelimiter.py) and throttled requests,
+# HTTP 429 or a NerdGraph TOO_MANY_REQUESTS error, are retried after Retry-After or a jittered exponential backoff
+# With ENV_HTTP_CASSETTE set the requests are recorded to, or replayed from, a cassette (see cassette.py)
+
+POOL_CONNECTIONS = int(os.environ.get('ENV_HTTP_POOL_CONNECTIONS', 10))
+POOL_MAXSIZE = int(os.environ.get('ENV_HTTP_POOL_MAXSIZE', 10))
+MAX_RETRIES = int(os.environ.get('ENV_HTTP_MAX_RETRIES', 5))
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+API_KEY_HEADERS = ['api-key', 'x-api-key', 'x-query-key']
+
+logger = m_logger.get_logger(os.path.basename(__file__))
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+_rate_limiter = ratelimiter.RateLimiter()
+_cassette = cassette.from_env()
+
+
+def configure(pool_connections=None, pool_maxsize=None):
+    global POOL_CONNECTIONS, POOL_MAXSIZE
+    if pool_connections:
+        POOL_CONNECTIONS = int(pool_connections)
+    if pool_maxsize:
+        POOL_MAXSIZE = int(pool_maxsize)
+    logger.debug('HTTP pool connections %d, pool maxsize %d' % (POOL_CONNECTIONS, POOL_MAXSIZE))
+    close()
+
+
+# Limits the requests made through this module, across all threads, to at most requests_per_second
+# for each API key and endpoint family. Families with a lower default rate keep it, so this only slows
+# requests down. Pass None to go back to the default rates
+def set_rate_limit(requests_per_second):
+    global _rate_limiter
+    if requests_per_second:
+        logger.info('Limiting API requests to %s per second for each API key and endpoint family' %
+                    str(requests_per_second))
+        _rate_limiter = ratelimiter.RateLimiter({family: min(float(requests_per_second),
+                                                             ratelimiter.default_rate(family))
+                                                 for family in ratelimiter.FAMILIES})
+    else:
+        _rate_limiter = ratelimiter.RateLimiter()
+
+
+# The TokenBucket that paces requests made with api_key to the endpoint family of url
+def bucket(url, api_key):
+    return _rate_limiter.bucket(api_key, ratelimiter.family_of(url))
+
+
+def report_throughput():
+    _rate_limiter.report()
+
+
+atexit.register(report_throughput)
+
+
+# Records requests to, or with mode cassette.REPLAY serves them from, the cassette at path. Pass None to stop
+def use_cassette(path, mode=cassette.REPLAY, latency_scale=1.0):
+    global _cassette
+    if _cassette is not None:
+        _cassette.close()
+    _cassette = cassette.open_cassette(path, mode, latency_scale) if path else None
+
+
+def has_cassette():
+    return _cassette is not None
+
+
+def create_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def session(region=Endpoints.REGION_US):
+    region = (region or Endpoints.REGION_US).lower()
+    with _sessions_lock:
+        if region not in _sessions:
+            logger.debug('Creating HTTP session for region ' + region)
+            _sessions[region] = create_session()
+        return _sessions[region]
+
+
+def close():
+    with _sessions_lock:
+        for region_session in _sessions.values():
+            region_session.close()
+        _sessions.clear()
+
+
+def api_key_of(headers):
+    for name, value in (headers or {}).items():
+        if name.lower() in API_KEY_HEADERS:
+            return value
+    return None
+
+
+def is_throttled(response, family):
+    if response.status_code == 429:
+        return True
+    # NerdGraph reports throttling as a GraphQL error in a 200 response
+    if family == ratelimiter.NERDGRAPH and response.status_code == 200 and b'TOO_MANY_REQUESTS' in response.content:
+        try:
+            errors = response.json().get('errors') or []
+        except ValueError:
+            return False
+        return any((error.get('extensions') or {}).get('errorClass') == 'TOO_MANY_REQUESTS' for error in errors)
+    return False
+
+
+def retry_after(response):
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff(attempt):
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def request(method, url, region=None, **kwargs):
+    if region is None:
+        region = Endpoints.region_of(url)
+    family = ratelimiter.family_of(url)
+    api_key = api_key_of(kwargs.get('headers'))
+    url_bucket = bucket(url, api_key)
+    attempt = 0
+    while True:
+        url_bucket.acquire()
+        if _cassette is not None:
+            response = _cassette.request(session(region), method, url, api_key, **kwargs)
+        else:
+            response = session(region).request(method, url, **kwargs)
+        if not is_throttled(response, family):
+            url_bucket.succeeded()
+            return response
+        if attempt >= MAX_RETRIES:
+            logger.error('Giving up after %d throttled attempts %s %s' % (attempt + 1, method, url))
+            return response
+        delay = retry_after(response)
+        if delay is None:
+            delay = backoff(attempt)
+        url_bucket.throttled(delay)
+        attempt += 1
+
+
+def get(url, region=None, **kwargs):
+    return request('GET', url, region, **kwargs)
+
+
+def post(url, region=None, **kwargs):
+    return request('POST', url, region, **kwargs)
+
+
+def put(url, region=None, **kwargs):
+    return request('PUT', url, region, **kwargs)
+
+
+def patch(url, region=None, **kwargs):
+    return request('PATCH', url, region, **kwargs)
+
+
+def delete(url, region=None, **kwargs):
+    return request('DELETE', url, region, **kwargs)
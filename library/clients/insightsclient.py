@@ -1,11 +1,14 @@
 import os
-import requests
+import library.clients.httpclient as httpclient
 import library.migrationlogger as m_logger
 from library.clients.endpoints import Endpoints
 
 
 PERF_STATS = 'performanceStats'
 METADATA = 'metadata'
+# values per IN list of a faceted query, bounded by the facet limit and by the length of the query sent in the URL
+FACET_LIMIT = 1000
+MAX_IN_LIST_LENGTH = 4000
 
 log = m_logger.get_logger(os.path.basename(__file__))
 
@@ -18,7 +21,7 @@ def execute(insights_query_key, account_id, insights_query, region=Endpoints.REG
     log.debug(insights_query)
     query_params = {'nrql': insights_query}
     query_url = Endpoints.of(region).INSIGHTS_URL % account_id
-    response = requests.get(query_url, headers=setup_headers(insights_query_key),
+    response = httpclient.get(query_url, headers=setup_headers(insights_query_key),
                             params=query_params)
     result = {'status': response.status_code}
     if response.status_code == 200:
@@ -31,6 +34,33 @@ def execute(insights_query_key, account_id, insights_query, region=Endpoints.REG
     return result
 
 
+# NRQL string literal list for an IN clause
+def in_list(values):
+    return ', '.join("'" + value.replace('\\', '\\\\').replace("'", "\\'") + "'" for value in values)
+
+
+# Splits values, without duplicates, into chunks small enough for one faceted IN query each
+def chunk_values(values, max_count=FACET_LIMIT, max_length=MAX_IN_LIST_LENGTH):
+    chunk = []
+    length = 0
+    for value in dict.fromkeys(values):
+        # quotes, comma and space around each value, plus room for escaping
+        value_length = 2 * len(value) + 4
+        if chunk and (len(chunk) >= max_count or length + value_length > max_length):
+            yield chunk
+            chunk = []
+            length = 0
+        chunk.append(value)
+        length += value_length
+    if chunk:
+        yield chunk
+
+
+# Results of a faceted query by facet name
+def results_by_facet(results_json):
+    return {facet['name']: facet['results'] for facet in results_json.get('facets', [])}
+
+
 def cleanup_results(results_json):
     if PERF_STATS in results_json:
         results_json.pop(PERF_STATS)
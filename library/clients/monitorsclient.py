@@ -1,5 +1,5 @@
 import json
-import requests
+import library.clients.httpclient as httpclient
 import os
 import library.utils as utils
 import library.monitortypes as monitortypes
@@ -9,7 +9,6 @@ import library.clients.entityclient as ec
 import library.clients.gql as nerdgraph
 import library.securecredentials as securecredentials
 from library.clients.endpoints import Endpoints
-import time
 
 
 # monitors provides a mix of REST and GraphQL client calls for fetching a monitor and a monitor script
@@ -32,10 +31,13 @@ class MonitorsClient:
 
 
     @staticmethod
-    def query_monitors_gql(cursor):
-        query = '''query($cursor: String) {
+    def query_monitors_gql(cursor, account_id=None):
+        search = "domain = 'SYNTH' AND type = 'MONITOR'"
+        if account_id is not None:
+            search += " AND accountId = " + str(int(account_id))
+        query = '''query($cursor: String, $search: String) {
             actor {
-                entitySearch(query: "domain = 'SYNTH' AND type = 'MONITOR'") {
+                entitySearch(query: $search) {
                     results (cursor: $cursor) {
                         entities {
                             ... on SyntheticMonitorEntityOutline {
@@ -60,45 +62,55 @@ class MonitorsClient:
                 }
             }
         }'''        
-        variables = {'cursor': cursor}
+        variables = {'cursor': cursor, 'search': search}
         return {'query': query, 'variables': variables}
 
 
+    # Yields the monitor definitions of account_id a page at a time, as each page of the search arrives
     @staticmethod
-    def fetch_all_monitors(api_key, account_id, region):
-        all_monitors_def_json = []
-        done = False
+    def iter_monitor_pages(api_key, account_id, region):
         cursor = None
-        while not done:
+        fetched_count = 0
+        while True:
             try:
                 logger.info(f'Querying monitors for account {account_id}')
-                payload = MonitorsClient.query_monitors_gql(cursor)
+                payload = MonitorsClient.query_monitors_gql(cursor, account_id)
                 logger.debug(json.dumps(payload))
                 result = nerdgraph.GraphQl.post(api_key, payload, region)
                 logger.debug(json.dumps(result))
-                if ('error' in result):
+                if 'error' in result:
                     logger.error(f'Could not fetch monitors')
                     logger.error(result['error'])
-                    break
-                else:
-                  # No error attribute for monitors
-                  if 'response' in result:
-                    cursor = result['response']['data']['actor']['entitySearch']['results']['nextCursor']
-                    all_monitors_def_json = all_monitors_def_json + result['response']['data']['actor']['entitySearch']['results']['entities']
-                    # Filter only synthetics monitors that match the account_id using list comprehension
-                    all_monitors_def_json = [monitor for monitor in all_monitors_def_json if monitor['accountId'] == int(account_id)]
-                    logger.info("Fetched monitor definitions : " + str(len(all_monitors_def_json)))
-                  else:
+                    return
+                # No error attribute for monitors
+                if 'response' not in result:
                     logger.error(f'Could not fetch monitors')
                     logger.error(result)
-                    break
-                if cursor is None:
-                    done = True
+                    return
+                results = result['response']['data']['actor']['entitySearch']['results']
+                cursor = results['nextCursor']
+                # the search is already limited to account_id, kept as a guard
+                page = [monitor for monitor in results['entities'] if monitor['accountId'] == int(account_id)]
             except Exception as e:
                 logger.error(f'Error querying monitors for account {account_id}')
                 logger.error(e)
-                done = True
-        return all_monitors_def_json
+                return
+            fetched_count += len(page)
+            logger.info("Fetched monitor definitions : " + str(fetched_count))
+            yield page
+            if cursor is None:
+                return
+
+
+    @staticmethod
+    def iter_monitors(api_key, account_id, region):
+        for page in MonitorsClient.iter_monitor_pages(api_key, account_id, region):
+            yield from page
+
+
+    @staticmethod
+    def fetch_all_monitors(api_key, account_id, region):
+        return list(MonitorsClient.iter_monitors(api_key, account_id, region))
 
 
     @staticmethod
@@ -159,7 +171,7 @@ class MonitorsClient:
     @staticmethod
     def get_monitor(api_key, monitor_id, region=Endpoints.REGION_US):
         get_monitor_url = Endpoints.of(region).MONITORS_URL + monitor_id
-        response = requests.get(get_monitor_url, headers=MonitorsClient.setup_headers(api_key))
+        response = httpclient.get(get_monitor_url, headers=MonitorsClient.setup_headers(api_key))
         result = {'status': response.status_code }
         if response.status_code == 200:
             result['monitor'] = response.json()
@@ -383,7 +395,7 @@ def put_script(api_key, monitor_json, monitor_name, monitor_status):
     script_payload = json.dumps(monitor_json['script'])
     if 'location' in monitor_status[monitor_name]:
         script_url = monitor_status[monitor_name]['location'] + "/script"
-        script_response = requests.put(script_url, headers=MonitorsClient.setup_headers(api_key), data=script_payload)
+        script_response = httpclient.put(script_url, headers=MonitorsClient.setup_headers(api_key), data=script_payload)
         monitor_status[monitor_name][monitorstatus.SCRIPT_STATUS] = script_response.status_code
         monitor_status[monitor_name][monitorstatus.SCRIPT_MESSAGE] = script_response.text
     else:
@@ -397,7 +409,7 @@ def put_steps(api_key, monitor_json, monitor_name, monitor_status):
     steps_payload = json.dumps(monitor_json['steps'])
     if 'location' in monitor_status[monitor_name]:
         steps_url = monitor_status[monitor_name]['location'] + "/steps"
-        steps_response = requests.put(steps_url, headers=MonitorsClient.setup_headers(api_key), data=steps_payload)
+        steps_response = httpclient.put(steps_url, headers=MonitorsClient.setup_headers(api_key), data=steps_payload)
         monitor_status[monitor_name][monitorstatus.STEPS_STATUS] = steps_response.status_code
         monitor_status[monitor_name][monitorstatus.STEPS_MESSAGE] = steps_response.text
     else:
@@ -423,7 +435,7 @@ def update(api_key, monitor_id, update_json, monitor_name, region=Endpoints.REGI
     logger.info(update_payload)
     put_monitor_url = Endpoints.of(region).MONITORS_URL + str(monitor_id)
     result = {'entityUpdated': False}
-    response = requests.patch(put_monitor_url, headers=MonitorsClient.setup_headers(api_key), data=update_payload)
+    response = httpclient.patch(put_monitor_url, headers=MonitorsClient.setup_headers(api_key), data=update_payload)
     result['status'] = response.status_code
     # A successful request will return a 204 No Content response, with an empty body.
     if response.status_code != 204:
@@ -440,13 +452,11 @@ def delete_monitor(monitor, target_acct, failure_status, success_status, tgt_api
     logger.info(monitor)
     monitor_id = monitor['monitorId']
     monitor_name = monitor['name']
-    response = requests.delete(Endpoints.of(region).MONITORS_URL + monitor_id,
+    response = httpclient.delete(Endpoints.of(region).MONITORS_URL + monitor_id,
                                headers=MonitorsClient.setup_headers(tgt_api_key))
     if response.status_code == 204:
         success_status[monitor_name] = {'status': response.status_code, 'responseText': response.text}
         logger.info(target_acct + ":" + monitor_name + ":" + str(success_status[monitor_name]))
     else:
         failure_status[monitor_name] = {'status': response.status_code, 'responseText': response.text}
-        logger.info(target_acct + ":" + monitor_name + ":" + str(failure_status[monitor_name]))
-    # trying to stay within 3 requests per second
-    time.sleep(0.3)
\ No newline at end of file
+        logger.info(target_acct + ":" + monitor_name + ":" + str(failure_status[monitor_name]))
\ No newline at end of file
@@ -0,0 +1,143 @@
+import os
+import threading
+import time
+import library.migrationlogger as m_logger
+
+logger = m_logger.get_logger(os.path.basename(__file__))
+
+# Endpoint families, New Relic applies a separate quota to each of them
+NERDGRAPH = 'nerdgraph'
+SYNTHETICS = 'synthetics'
+INSIGHTS = 'insights'
+REST = 'rest'
+FAMILIES = [NERDGRAPH, SYNTHETICS, INSIGHTS, REST]
+
+# Requests per second allowed for each API key and family, override with ENV_RATE_LIMIT_<FAMILY>
+# e.g. ENV_RATE_LIMIT_SYNTHETICS=5
+DEFAULT_RATES = {
+    NERDGRAPH: 25,
+    SYNTHETICS: 3,
+    INSIGHTS: 5,
+    REST: 15
+}
+
+# Multiplicative decrease when throttled, additive increase (a fraction of the max rate) on every success
+DECREASE_FACTOR = 0.5
+INCREASE_FRACTION = 0.05
+MIN_RATE = 0.2
+
+
+def family_of(url):
+    if '/graphql' in url:
+        return NERDGRAPH
+    if 'synthetics.' in url:
+        return SYNTHETICS
+    if 'insights-api.' in url:
+        return INSIGHTS
+    return REST
+
+
+def default_rate(family):
+    return float(os.environ.get('ENV_RATE_LIMIT_' + family.upper(), DEFAULT_RATES[family]))
+
+
+# Thread safe token bucket, used to keep a request rate when migrations run on several threads
+# rate is in requests per second, capacity is the burst size
+# The rate adapts between MIN_RATE and max_rate: it is halved each time the API throttles a request
+# and grows back a little with every request that goes through
+class TokenBucket:
+
+    def __init__(self, rate, capacity=None):
+        self.max_rate = float(rate)
+        self.rate = self.max_rate
+        self.capacity = float(capacity) if capacity else max(1.0, self.rate)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0
+        self.lock = threading.Lock()
+        self.started_at = None
+        self.requests = 0
+        self.throttled_requests = 0
+
+    def refill(self, now):
+        elapsed = now - self.updated_at
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+        self.updated_at = now
+
+    # Takes a token and returns 0 or, when none is available yet, returns the seconds to wait before trying again
+    def reserve(self):
+        with self.lock:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                return self.blocked_until - now
+            self.refill(now)
+            if self.tokens >= 1:
+                self.tokens -= 1
+                self.requests += 1
+                if self.started_at is None:
+                    self.started_at = now
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        wait = self.reserve()
+        while wait > 0:
+            time.sleep(wait)
+            wait = self.reserve()
+
+    def succeeded(self):
+        with self.lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate * INCREASE_FRACTION)
+
+    # Holds every caller of this bucket for delay seconds and slows the rate down
+    def throttled(self, delay):
+        with self.lock:
+            self.throttled_requests += 1
+            self.rate = max(MIN_RATE, self.rate * DECREASE_FACTOR)
+            self.tokens = min(self.tokens, 0)
+            self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+            logger.warning('Request throttled, waiting %.1f seconds and reducing rate to %.2f per second' %
+                           (delay, self.rate))
+
+    def throughput(self):
+        with self.lock:
+            if self.started_at is None:
+                return 0.0
+            elapsed = time.monotonic() - self.started_at
+            return self.requests / elapsed if elapsed > 0 else float(self.requests)
+
+
+# One TokenBucket per API key and endpoint family
+class RateLimiter:
+
+    def __init__(self, rates=None):
+        self.rates = {family: default_rate(family) for family in FAMILIES}
+        if rates:
+            self.rates.update(rates)
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def bucket(self, api_key, family):
+        key = (api_key, family)
+        with self.lock:
+            if key not in self.buckets:
+                self.buckets[key] = TokenBucket(self.rates[family])
+            return self.buckets[key]
+
+    def report(self):
+        with self.lock:
+            buckets = dict(self.buckets)
+        for (api_key, family), bucket in buckets.items():
+            if bucket.requests == 0:
+                continue
+            logger.info('API key %s %s: %d requests, %d throttled, %.2f requests per second '
+                        '(limit %.2f, current %.2f)' %
+                        (mask(api_key), family, bucket.requests, bucket.throttled_requests,
+                         bucket.throughput(), bucket.max_rate, bucket.rate))
+
+
+def mask(api_key):
+    if not api_key:
+        return 'none'
+    return len(api_key[:-4]) * '*' + api_key[-4:]
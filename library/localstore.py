@@ -7,6 +7,7 @@ import library.monitortypes as monitortypes
 import library.migrationlogger as migrationlogger
 import library.windows_names as win_names
 import library.utils as utils
+import library.sqlitestore as sqlitestore
 
 
 # the fetched monitors are stored locally at db/<source_account>/monitors/<monitor_name>/<monitor_name>.json
@@ -18,10 +19,12 @@ APM_LABELS_FILE = "apm_labels.json"
 ALERT_POLICIES_DIR = "alert_policies"
 ALERT_POLICIES_FILE = "alert_policies.json"
 ALERT_POLICY_ENTITY_MAP_FILE = "alert_policy_entity_map.json"
+ALERT_POLICY_ENTITY_MAP_CACHE_FILE = "alert_policy_entity_map_%s.cache.json"
 ALERT_VIOLATIONS_DIR = "alert_violations"
 ALERT_VIOLATIONS_FILE = "alert_violations.json"
 ALERT_VIOLATIONS_CSV = "alert_violations.csv"
 ALERT_CHANNELS_FILE = "alert_channels.json"
+ENTITIES_DIR = "entities"
 MONITOR_LABELS_CSV = "monitor_labels.csv"
 NOTIFICATION_CHANNELS_FILE = 'notification_channels.json'
 NOTIFICATION_DESTINATIONS_FILE = 'notification_destinations.json'
@@ -29,6 +32,10 @@ NOTIFICATIONS_DIR = "notifications"
 SYNTHETIC_ALERTS_FILE = "synthetics_alerts.json"
 WORKFLOWS_DIR = "workflows"
 WORKFLOWS_FILE = "workflows.json"
+# files (default) or sqlite, see sqlitestore.py for the policies, policy entity map and channels
+# and monitorstore.py for the monitors
+STORE_BACKEND = os.environ.get('ENV_STORE_BACKEND', 'files').lower()
+SQLITE = 'sqlite'
 
 
 logger = migrationlogger.get_logger(os.path.basename(__file__))
@@ -258,14 +265,50 @@ def load_synth_conditions(account_id):
 
 
 def load_alert_policies(account_id):
+    if STORE_BACKEND == SQLITE:
+        return sqlitestore.load_alert_policies(account_id)
     return load_json_file(account_id, ALERT_POLICIES_DIR, ALERT_POLICIES_FILE)
 
 
+def has_alert_policies(account_id):
+    if STORE_BACKEND == SQLITE:
+        return sqlitestore.has_alert_policies(account_id)
+    alert_policies = load_alert_policies(account_id)
+    return 'policies' in alert_policies and 'error' not in alert_policies
+
+
+def load_alert_policy(account_id, policy_name):
+    if STORE_BACKEND == SQLITE:
+        return sqlitestore.load_alert_policy(account_id, policy_name)
+    for policy in load_alert_policies(account_id).get('policies', []):
+        if policy['name'] == policy_name:
+            return policy
+    return None
+
+
 def load_alert_policy_entity_map(account_id):
+    if STORE_BACKEND == SQLITE:
+        return sqlitestore.load_alert_policy_entity_map(account_id)
     return load_json_file(account_id, ALERT_POLICIES_DIR, ALERT_POLICY_ENTITY_MAP_FILE)
 
 
+def load_policy_names_by_entity(account_id, entity_id):
+    if STORE_BACKEND == SQLITE:
+        return sqlitestore.load_policy_names_by_entity(account_id, entity_id)
+    return load_alert_policy_entity_map(account_id).get('policies_by_entity', {}).get(str(entity_id), [])
+
+
+def load_alert_policy_entity_map_cache(account_id, region):
+    return load_json_file(account_id, ALERT_POLICIES_DIR, ALERT_POLICY_ENTITY_MAP_CACHE_FILE % region.lower())
+
+
+def load_entities(account_id, entity_type):
+    return load_json_file(account_id, ENTITIES_DIR, entity_type + '.json')
+
+
 def load_alert_channels(account_id):
+    if STORE_BACKEND == SQLITE:
+        return sqlitestore.load_alert_channels(account_id)
     return load_json_file(account_id, ALERT_POLICIES_DIR, ALERT_CHANNELS_FILE)
 
 
@@ -322,17 +365,30 @@ def save_json(dir_path, file_name, dictionary):
 
 #  db/<account_id>/alert_policies/alert_policies.json
 def save_alert_policies(account_id, alert_policies):
+    if STORE_BACKEND == SQLITE:
+        sqlitestore.save_alert_policies(account_id, alert_policies)
+        return
     base_dir = Path("db")
     alert_policies_dir = base_dir / account_id / ALERT_POLICIES_DIR
     save_json(alert_policies_dir, ALERT_POLICIES_FILE, alert_policies)
 
 
 def save_alert_policy_entity_map(account_id, alert_policies_app_map):
+    if STORE_BACKEND == SQLITE:
+        sqlitestore.save_alert_policy_entity_map(account_id, alert_policies_app_map)
+        return
     base_dir = Path("db")
     alert_policies_dir = base_dir / account_id / ALERT_POLICIES_DIR
     save_json(alert_policies_dir, ALERT_POLICY_ENTITY_MAP_FILE, alert_policies_app_map)
 
 
+#  db/<account_id>/alert_policies/alert_policy_entity_map_<region>.cache.json
+def save_alert_policy_entity_map_cache(account_id, region, cache):
+    base_dir = Path("db")
+    alert_policies_dir = base_dir / str(account_id) / ALERT_POLICIES_DIR
+    save_json(alert_policies_dir, ALERT_POLICY_ENTITY_MAP_CACHE_FILE % region.lower(), cache)
+
+
 def save_alert_violations(account_id, alert_violations):
     base_dir = Path("db")
     alert_violations_dir = base_dir / account_id / ALERT_VIOLATIONS_DIR
@@ -368,6 +424,9 @@ def convert_timestamps_to_dates(violation):
 
 #  db/<account_id>/alert_policies/alerts_channels.json
 def save_alert_channels(account_id, all_alert_channels):
+    if STORE_BACKEND == SQLITE:
+        sqlitestore.save_alert_channels(account_id, all_alert_channels)
+        return
     base_dir = Path("db")
     alert_policies_dir = base_dir / account_id / ALERT_POLICIES_DIR
     save_json(alert_policies_dir, ALERT_CHANNELS_FILE, all_alert_channels)
@@ -380,6 +439,13 @@ def save_synth_conditions(account_id, synth_conditions):
     save_json(alert_policies_dir, SYNTHETIC_ALERTS_FILE, synth_conditions)
 
 
+#  db/<account_id>/entities/<entity_type>.json
+def save_entities(account_id, entity_type, entities):
+    base_dir = Path("db")
+    entities_dir = base_dir / str(account_id) / ENTITIES_DIR
+    save_json(entities_dir, entity_type + '.json', entities)
+
+
 #  db/<account_id>/notifications/notification_destinations.json
 def save_notification_destinations(account_id, destinations):
     base_dir = Path("db")
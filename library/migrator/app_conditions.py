@@ -14,6 +14,7 @@ def migrate(all_alert_status, policy_name, src_api_key, src_region, src_policy,
     all_app_conditions = ac.get_app_conditions(src_api_key, src_policy['id'], src_region)[ac.CONDITIONS]
     logger.info("Found app alert conditions " + str(len(all_app_conditions)))
     tgt_app_conds = ac.app_conditions_by_name_entity(tgt_api_key, tgt_policy['id'])
+    tgt_entities_resolver = ec.entity_resolver(tgt_api_key, tgt_acct_id, tgt_region)
     condition_num = 0
     for app_condition in all_app_conditions:
         condition_num = condition_num + 1
@@ -31,9 +32,9 @@ def migrate(all_alert_status, policy_name, src_api_key, src_region, src_policy,
             src_entity = result['entity']
             logger.info('source entity found ' + str(src_entity['id']))
             if entity_type == ec.APM_KT:
-                result = ec.get_matching_kt(tgt_api_key, src_entity['name'], tgt_region)
+                result = tgt_entities_resolver.match_kt(src_entity['name'])
             else:
-                result = ec.gql_get_matching_entity(tgt_api_key, entity_type, src_entity, tgt_acct_id, tgt_region)
+                result = tgt_entities_resolver.match(entity_type, src_entity)
             if not result['entityFound']:
                 status_tgt_not_found(all_alert_status, condition_row, src_entity, app_condition)
                 continue
@@ -33,6 +33,7 @@ def migrate(all_alert_status, policy_name, src_api_key, src_region, src_policy,
         return
     log.info("Found ext svc conditions " + str(len(extsvc_conditions)))
     tgt_extsvc_conds = extsvc_conditions_by_name_entity(tgt_api_key, tgt_policy['id'], tgt_region)
+    tgt_entities_resolver = ec.entity_resolver(tgt_api_key, tgt_acct_id, tgt_region)
     cond_num = 0
     for extsvc_condition in extsvc_conditions:
         cond_num = cond_num + 1
@@ -48,7 +49,7 @@ def migrate(all_alert_status, policy_name, src_api_key, src_region, src_policy,
                 continue
             src_entity = result['entity']
             log.info('source entity found ' + str(src_entity['id']))
-            result = ec.gql_get_matching_entity(tgt_api_key, entity_type, src_entity, tgt_acct_id, tgt_region)
+            result = tgt_entities_resolver.match(entity_type, src_entity)
             if not result['entityFound']:
                 status_tgt_not_found(all_alert_status, cond_row, src_entity, extsvc_condition)
                 continue
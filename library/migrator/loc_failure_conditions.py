@@ -2,13 +2,12 @@ import os
 import library.status.conditionstatus as cs
 import library.migrationlogger as logger
 import library.clients.alertsclient as ac
-import library.clients.monitorsclient as mc
-import library.clients.entityclient as ec
+import library.AccountMonitors as account_monitors
 
 logger = logger.get_logger(os.path.basename(__file__))
 
 
-def migrate(all_alert_status, policy_name, src_api_key, src_region, src_policy,
+def migrate(all_alert_status, policy_name, src_acct_id, src_api_key, src_region, src_policy,
             tgt_acct_id, tgt_api_key, tgt_region, tgt_policy, match_source_status):
     logger.info('Loading source location failure conditions ')
     result = ac.get_location_failure_conditions(src_api_key, src_policy['id'], src_region)
@@ -19,22 +18,25 @@ def migrate(all_alert_status, policy_name, src_api_key, src_region, src_policy,
     logger.info('Fetched conditions ' + str(len(loc_conds)))
     logger.info('Loading target loc failure conditions')
     tgt_loc_conds = ac.loc_conditions_by_name_monitor(tgt_api_key, tgt_policy['id'], tgt_region)
+    src_monitors = account_monitors.account_monitors(src_api_key, src_acct_id, src_region)
+    tgt_monitors = account_monitors.account_monitors(tgt_api_key, tgt_acct_id, tgt_region)
     condition_num = 0
     for loc_condition in loc_conds:
         condition_num = condition_num + 1
         condition_row = policy_name + '-sloccon' + str(condition_num)
         tgt_entities = []
+        all_alert_status[condition_row] = {cs.COND_NAME: loc_condition['name']}
         for entity_id in loc_condition['entities']:
-            src_monitor_name = mc.get_monitor(src_api_key, entity_id, src_region)['monitor']['name']
-            all_alert_status[condition_row] = {cs.COND_NAME: loc_condition['name']}
+            src_monitor_name = src_monitors.monitor_name(entity_id)
+            if src_monitor_name is None:
+                all_alert_status[condition_row][cs.ERROR] = 'Source monitor not found ' + str(entity_id)
+                continue
             all_alert_status[condition_row][cs.SRC_MONITOR] = src_monitor_name
-            result = ec.gql_get_matching_entity_by_name(tgt_api_key, ec.SYNTH_MONITOR, src_monitor_name,
-                                                        tgt_acct_id, tgt_region)
-            if not result['entityFound']:
+            tgt_monitor = tgt_monitors.get(src_monitor_name)
+            if tgt_monitor is None:
                 all_alert_status[condition_row][cs.TGT_MONITOR] = 'NOT_FOUND'
                 logger.warn('No matching entity found in target account ' + src_monitor_name)
             else:
-                tgt_monitor = result['entity']
                 all_alert_status[condition_row][cs.TGT_ACCOUNT] = tgt_monitor['accountId']
                 all_alert_status[condition_row][cs.TGT_MONITOR] = tgt_monitor['name']
                 logger.info('Found matching target monitor ' + tgt_monitor['name'])
@@ -44,7 +46,11 @@ def migrate(all_alert_status, policy_name, src_api_key, src_region, src_policy,
                 else:
                     logger.info('Found matching condition name-monitor.Skipping monitor ' + str(tgt_loc_conds[tgt_key]))
                     all_alert_status[condition_row][cs.COND_EXISTED_TARGET] = tgt_key
-        if len(tgt_entities) > 0:
+        # a condition missing some of its monitors is not created, the policy is tried again on resume
+        if cs.ERROR in all_alert_status[condition_row]:
+            logger.error('Skipping location failure condition %s : %s' % (loc_condition['name'],
+                                                                         all_alert_status[condition_row][cs.ERROR]))
+        elif len(tgt_entities) > 0:
             logger.info('Creating target synthetic condition ' + loc_condition['name'])
             tgt_condition = create_tgt_loc_condition(loc_condition, tgt_entities, match_source_status)
             result = ac.create_loc_failure_condition(tgt_api_key, tgt_policy, tgt_condition, tgt_region)
@@ -2,31 +2,33 @@ import os
 import library.status.conditionstatus as cs
 import library.migrationlogger as logger
 import library.clients.alertsclient as ac
-import library.clients.monitorsclient as mc
-import library.clients.entityclient as ec
+import library.AccountMonitors as account_monitors
 
 logger = logger.get_logger(os.path.basename(__file__))
 
 
-def migrate(all_alert_status, policy_name, src_api_key, src_region, src_policy,
+def migrate(all_alert_status, policy_name, src_acct_id, src_api_key, src_region, src_policy,
             tgt_acct_id, tgt_api_key, tgt_region, tgt_policy, match_source_status):
     logger.info('Loading source synthetic conditions ')
     synth_conditions = ac.get_synthetic_conditions(src_api_key, src_policy['id'], src_region)[ac.SYNTH_CONDITIONS]
     logger.info('Found synthetic conditions ' + str(len(synth_conditions)))
     logger.info('Loading target synthetic conditions ' + policy_name)
     tgt_synth_conds = ac.synth_conditions_by_name_monitor(tgt_api_key, tgt_policy['id'], tgt_region)
+    src_monitors = account_monitors.account_monitors(src_api_key, src_acct_id, src_region)
+    tgt_monitors = account_monitors.account_monitors(tgt_api_key, tgt_acct_id, tgt_region)
     condition_num = 0
     for synth_condition in synth_conditions:
         condition_num = condition_num + 1
         condition_row = policy_name + '-scon' + str(condition_num)
         src_monitor_id = synth_condition[ac.MONITOR_ID]
-        src_monitor_name = mc.MonitorsClient.get_monitor(src_api_key, src_monitor_id, src_region)['monitor']['name']
+        src_monitor_name = src_monitors.monitor_name(src_monitor_id)
         all_alert_status[condition_row] = {cs.COND_NAME: synth_condition['name']}
+        if src_monitor_name is None:
+            all_alert_status[condition_row][cs.ERROR] = 'Source monitor not found ' + str(src_monitor_id)
+            continue
         all_alert_status[condition_row][cs.SRC_MONITOR] = src_monitor_name
-        result = ec.gql_get_matching_entity_by_name(tgt_api_key, ec.SYNTH_MONITOR, src_monitor_name,
-                                                    tgt_acct_id, tgt_region)
-        if result['entityFound']:
-            tgt_monitor = result['entity']
+        tgt_monitor = tgt_monitors.get(src_monitor_name)
+        if tgt_monitor is not None:
             all_alert_status[condition_row][cs.TGT_ACCOUNT] = tgt_monitor['accountId']
             all_alert_status[condition_row][cs.TGT_MONITOR] = tgt_monitor['name']
             logger.info('Found matching target monitor ' + tgt_monitor['name'])
@@ -0,0 +1,370 @@
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+import library.localstore as store
+import library.sqlitestore as sqlitestore
+import library.migrationlogger as migrationlogger
+import library.windows_names as win_names
+
+# Backends for the monitors fetched into db/<account_id>/monitors/<timestamp>
+# files : one directory and pretty printed json file per monitor, see localstore.save_monitor_to_file
+# jsonl : compact json lines appended to monitors-<n>.jsonl segments, with an index of the offset and length
+#         of each monitor in monitors.index.json so a monitor is read without scanning the segments
+# sqlite : rows of the monitors table in db/<account_id>/store.sqlite, indexed by timestamp and name or guid
+# New fetches use ENV_STORE_BACKEND (default files), reads detect the backend a fetch was saved with
+
+FILES = 'files'
+JSONL = 'jsonl'
+SQLITE = 'sqlite'
+BACKENDS = [FILES, JSONL, SQLITE]
+BACKEND = store.STORE_BACKEND
+SEGMENT_PREFIX = 'monitors-'
+SEGMENT_SUFFIX = '.jsonl'
+SEGMENT_MAX_BYTES = 64 * 1024 * 1024
+INDEX_FILE = 'monitors.index.json'
+# guid : {name, hash of the definition} of the monitors in a fetch, used by fetchmonitors --since
+MANIFEST_FILE = 'manifest.json'
+
+logger = migrationlogger.get_logger(os.path.basename(__file__))
+
+
+class FileMonitorStore:
+
+    def __init__(self, storage_dir):
+        self.storage_dir = Path(storage_dir)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def save(self, monitor_name, monitor_json):
+        # the file may be a hard link made by copy_from, writing through it would change the earlier fetch too
+        monitor_file = self.storage_dir / monitor_name / (monitor_name + '.json')
+        if monitor_file.exists():
+            monitor_file.unlink()
+        store.save_monitor_to_file(monitor_name, self.storage_dir, monitor_json)
+
+    def load(self, monitor_name):
+        return store.load_monitor(self.storage_dir, monitor_name)
+
+    def load_many(self, monitor_names):
+        return [self.load(monitor_name) for monitor_name in monitor_names]
+
+    # hard links the unchanged monitor file of an earlier fetch instead of writing a copy
+    def copy_from(self, source, monitor_name, monitor_json):
+        if isinstance(source, FileMonitorStore) and os.name != win_names.WINDOWS:
+            source_file = source.storage_dir / monitor_name / (monitor_name + '.json')
+            monitor_dir = self.storage_dir / monitor_name
+            try:
+                monitor_dir.mkdir(mode=0o777, parents=True, exist_ok=True)
+                target_file = monitor_dir / (monitor_name + '.json')
+                if target_file.exists():
+                    target_file.unlink()
+                os.link(source_file, target_file)
+                return
+            except OSError as e:
+                logger.debug('Could not link ' + str(source_file) + ', saving a copy : ' + str(e))
+        self.save(monitor_name, monitor_json)
+
+    def names(self):
+        return sorted(monitor_dir.name for monitor_dir in self.storage_dir.iterdir() if monitor_dir.is_dir())
+
+    def monitors(self):
+        for monitor_name in self.names():
+            yield self.load(monitor_name)
+
+    def close(self):
+        pass
+
+
+class JsonlMonitorStore:
+
+    def __init__(self, storage_dir, segment_max_bytes=SEGMENT_MAX_BYTES):
+        self.storage_dir = Path(storage_dir)
+        self.segment_max_bytes = segment_max_bytes
+        self.lock = threading.Lock()
+        self.writer = None
+        self.segment = 0
+        self.changed = False
+        # monitor name : [segment, offset, length], a monitor saved twice keeps its last copy
+        self.index = {}
+        if (self.storage_dir / INDEX_FILE).exists():
+            self.index = json.loads((self.storage_dir / INDEX_FILE).read_text())['monitors']
+        elif self.segments():
+            self.rebuild_index()
+        if self.index:
+            self.segment = max(location[0] for location in self.index.values())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def segment_file(self, segment):
+        return self.storage_dir / ('%s%05d%s' % (SEGMENT_PREFIX, segment, SEGMENT_SUFFIX))
+
+    def segments(self):
+        return sorted(self.storage_dir.glob(SEGMENT_PREFIX + '*' + SEGMENT_SUFFIX))
+
+    # the index is written on close, a fetch that did not get that far is indexed from its segments
+    def rebuild_index(self):
+        logger.info('Rebuilding monitors index in ' + str(self.storage_dir))
+        for segment_file in self.segments():
+            segment = int(segment_file.name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+            offset = 0
+            with segment_file.open('rb') as segment_in:
+                for line in segment_in:
+                    try:
+                        monitor_name = json.loads(line)['name']
+                    except ValueError:
+                        logger.warning('Ignoring incomplete monitor at the end of ' + segment_file.name)
+                        break
+                    self.index[monitor_name] = [segment, offset, len(line)]
+                    offset += len(line)
+        self.changed = True
+
+    def save(self, monitor_name, monitor_json):
+        line = (json.dumps({'name': monitor_name, 'monitor': monitor_json}, separators=(',', ':')) + '\n').encode('utf-8')
+        with self.lock:
+            if self.writer is None or (self.writer.tell() > 0 and self.writer.tell() + len(line) > self.segment_max_bytes):
+                self.open_segment()
+            offset = self.writer.tell()
+            self.writer.write(line)
+            self.index[monitor_name] = [self.segment, offset, len(line)]
+            self.changed = True
+
+    def open_segment(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.segment += 1
+        elif self.segment_file(self.segment).exists():
+            self.segment += 1
+        self.storage_dir.mkdir(mode=0o777, parents=True, exist_ok=True)
+        self.writer = self.segment_file(self.segment).open('ab')
+
+    def copy_from(self, source, monitor_name, monitor_json):
+        self.save(monitor_name, monitor_json)
+
+    def location(self, monitor_name):
+        if monitor_name not in self.index:
+            raise KeyError('Monitor not found in ' + str(self.storage_dir) + ' : ' + monitor_name)
+        return self.index[monitor_name]
+
+    def flush(self):
+        with self.lock:
+            if self.writer is not None:
+                self.writer.flush()
+
+    def load(self, monitor_name):
+        segment, offset, length = self.location(monitor_name)
+        self.flush()
+        with self.segment_file(segment).open('rb') as segment_in:
+            segment_in.seek(offset)
+            return json.loads(segment_in.read(length))['monitor']
+
+    # reads the monitors through one handle per segment in offset order, returned in the order of monitor_names
+    def load_many(self, monitor_names):
+        by_segment = {}
+        for monitor_name in set(monitor_names):
+            segment, offset, length = self.location(monitor_name)
+            by_segment.setdefault(segment, []).append((offset, length, monitor_name))
+        self.flush()
+        lines = {}
+        for segment in sorted(by_segment):
+            with self.segment_file(segment).open('rb') as segment_in:
+                for offset, length, monitor_name in sorted(by_segment[segment]):
+                    segment_in.seek(offset)
+                    lines[monitor_name] = segment_in.read(length)
+        return [json.loads(lines[monitor_name])['monitor'] for monitor_name in monitor_names]
+
+    def names(self):
+        return list(self.index)
+
+    # streams the monitors in the order they were saved, reading each segment once
+    def monitors(self):
+        by_segment = {}
+        for segment, offset, length in self.index.values():
+            by_segment.setdefault(segment, []).append((offset, length))
+        for segment in sorted(by_segment):
+            with self.segment_file(segment).open('rb') as segment_in:
+                for offset, length in sorted(by_segment[segment]):
+                    segment_in.seek(offset)
+                    yield json.loads(segment_in.read(length))['monitor']
+
+    def close(self):
+        with self.lock:
+            if self.writer is not None:
+                self.writer.close()
+                self.writer = None
+            if self.changed:
+                index_file = self.storage_dir / INDEX_FILE
+                index_tmp = self.storage_dir / (INDEX_FILE + '.tmp')
+                index_tmp.write_text(json.dumps({'monitors': self.index}, separators=(',', ':')))
+                os.replace(index_tmp, index_file)
+                self.changed = False
+
+
+# Monitors saved in db/<account_id>/store.sqlite for the storage_dir db/<account_id>/monitors/<timestamp>
+class SqliteMonitorStore:
+
+    COMMIT_EVERY = 500
+
+    def __init__(self, storage_dir):
+        storage_dir = Path(storage_dir)
+        self.timestamp = storage_dir.name
+        self.path = storage_dir.parent.parent / sqlitestore.STORE_FILE
+        self.lock = threading.Lock()
+        # the store is written by the fetchmonitors writer thread, so it keeps a connection of its own
+        self.connection = None
+        self.pending = 0
+        self.seq = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def connect(self):
+        if self.connection is None:
+            self.connection = sqlitestore.open_connection(self.path)
+        return self.connection
+
+    def save(self, monitor_name, monitor_json):
+        with self.lock:
+            connection = self.connect()
+            if self.seq is None:
+                row = connection.execute('SELECT MAX(seq) FROM monitors WHERE timestamp = ?', (self.timestamp,)).fetchone()
+                self.seq = -1 if row[0] is None else row[0]
+            self.seq += 1
+            connection.execute('INSERT OR REPLACE INTO monitors (timestamp, name, guid, seq, monitor) VALUES (?, ?, ?, ?, ?)',
+                               (self.timestamp, monitor_name, monitor_json.get('definition', {}).get('guid'), self.seq,
+                                json.dumps(monitor_json, separators=(',', ':'))))
+            self.pending += 1
+            if self.pending >= self.COMMIT_EVERY:
+                connection.commit()
+                self.pending = 0
+
+    def copy_from(self, source, monitor_name, monitor_json):
+        self.save(monitor_name, monitor_json)
+
+    def load(self, monitor_name):
+        with self.lock:
+            row = self.connect().execute('SELECT monitor FROM monitors WHERE timestamp = ? AND name = ?',
+                                         (self.timestamp, monitor_name)).fetchone()
+        if row is None:
+            raise KeyError('Monitor not found in ' + str(self.path) + ' : ' + monitor_name)
+        return json.loads(row[0])
+
+    def load_many(self, monitor_names):
+        return [self.load(monitor_name) for monitor_name in monitor_names]
+
+    def load_by_guid(self, guid):
+        with self.lock:
+            row = self.connect().execute('SELECT monitor FROM monitors WHERE timestamp = ? AND guid = ?',
+                                         (self.timestamp, guid)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def names(self):
+        with self.lock:
+            return [row[0] for row in self.connect().execute(
+                'SELECT name FROM monitors WHERE timestamp = ? ORDER BY seq', (self.timestamp,))]
+
+    def monitors(self):
+        # a connection of its own so the rows are streamed without holding the lock
+        connection = sqlitestore.open_connection(self.path)
+        try:
+            for row in connection.execute('SELECT monitor FROM monitors WHERE timestamp = ? ORDER BY seq',
+                                          (self.timestamp,)):
+                yield json.loads(row[0])
+        finally:
+            connection.close()
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None:
+                self.connection.commit()
+                self.connection.close()
+                self.connection = None
+                self.pending = 0
+
+
+def definition_hash(monitor_def_json):
+    return hashlib.sha1(json.dumps(monitor_def_json, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def save_manifest(storage_dir, manifest):
+    (Path(storage_dir) / MANIFEST_FILE).write_text(json.dumps(manifest, separators=(',', ':')))
+
+
+# The manifest of the fetch saved in storage_dir, built from its monitors for fetches saved without one
+def load_manifest(storage_dir, monitors):
+    manifest_file = Path(storage_dir) / MANIFEST_FILE
+    if manifest_file.exists():
+        return json.loads(manifest_file.read_text())
+    logger.info('No manifest in ' + str(storage_dir) + ', building it from the saved monitors')
+    manifest = {}
+    for monitor_name in monitors.names():
+        monitor_def_json = monitors.load(monitor_name)['definition']
+        manifest[monitor_def_json['guid']] = {'name': monitor_name, 'hash': definition_hash(monitor_def_json)}
+    return manifest
+
+
+def detect(storage_dir):
+    storage_dir = Path(storage_dir)
+    if (storage_dir / INDEX_FILE).exists() or any(storage_dir.glob(SEGMENT_PREFIX + '*' + SEGMENT_SUFFIX)):
+        return JSONL
+    if storage_dir.exists() and any(monitor_dir.is_dir() for monitor_dir in storage_dir.iterdir()):
+        return FILES
+    store_file = storage_dir.parent.parent / sqlitestore.STORE_FILE
+    if store_file.exists():
+        connection = sqlitestore.open_connection(store_file)
+        try:
+            if connection.execute('SELECT 1 FROM monitors WHERE timestamp = ? LIMIT 1', (storage_dir.name,)).fetchone():
+                return SQLITE
+        finally:
+            connection.close()
+    return FILES
+
+
+def monitors_dir(account_id, timestamp):
+    return Path(store.DB_DIR) / str(account_id) / store.MONITORS_DIR / timestamp
+
+
+# The store new monitors are saved to
+def create(storage_dir, backend=None):
+    backend = (backend or BACKEND).lower()
+    if backend not in BACKENDS:
+        raise ValueError('Unknown store backend ' + backend + ', expected one of ' + ', '.join(BACKENDS))
+    logger.info('Saving monitors to %s using the %s store' % (str(storage_dir), backend))
+    if backend == JSONL:
+        return JsonlMonitorStore(storage_dir)
+    if backend == SQLITE:
+        return SqliteMonitorStore(storage_dir)
+    return FileMonitorStore(storage_dir)
+
+
+# The store monitors were saved to, by account and fetch timestamp
+def open_store(account_id, timestamp):
+    storage_dir = monitors_dir(account_id, timestamp)
+    backend = detect(storage_dir)
+    if backend == JSONL:
+        return JsonlMonitorStore(storage_dir)
+    if backend == SQLITE:
+        return SqliteMonitorStore(storage_dir)
+    return FileMonitorStore(storage_dir)
+
+
+def load_monitors(account_id, timestamp, monitor_names):
+    with open_store(account_id, timestamp) as monitors:
+        return monitors.load_many(monitor_names)
+
+
+def iter_monitors(account_id, timestamp):
+    with open_store(account_id, timestamp) as monitors:
+        yield from monitors.monitors()
@@ -0,0 +1,134 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import library.migrationlogger as m_logger
+
+# Runs tasks that depend on each other on a pool of workers
+# A task starts as soon as every task it depends on has finished, whether or not those succeeded, so
+# independent tasks run concurrently up to workers at a time. Tasks check for themselves that what
+# they need was created (e.g. a targetDestinationId), as the serial loops did. With skip_failed a task whose
+# dependency raised or was skipped is skipped as well. Dependencies on keys that were never added are ignored
+
+DEFAULT_WORKERS = int(os.environ.get('ENV_SCHEDULER_WORKERS', 10))
+
+logger = m_logger.get_logger(os.path.basename(__file__))
+
+
+class Scheduler:
+
+    def __init__(self, workers=DEFAULT_WORKERS, skip_failed=False):
+        self.workers = max(1, workers)
+        self.skip_failed = skip_failed
+        self.tasks = {}
+        self.depends_on = {}
+        self.results = {}
+
+    def add(self, key, task, depends_on=()):
+        if key in self.tasks:
+            raise ValueError('Task added twice ' + str(key))
+        self.tasks[key] = task
+        self.depends_on[key] = list(depends_on)
+
+    # keys in the order they would run on a single worker, ValueError if the dependencies have a cycle
+    def order(self):
+        waiting_on, dependents = self.graph()
+        ready = [key for key in self.tasks if waiting_on[key] == 0]
+        ordered = []
+        while ready:
+            key = ready.pop(0)
+            ordered.append(key)
+            for dependent in dependents[key]:
+                waiting_on[dependent] -= 1
+                if waiting_on[dependent] == 0:
+                    ready.append(dependent)
+        if len(ordered) != len(self.tasks):
+            raise ValueError('Dependency cycle between ' + str([key for key in self.tasks if key not in ordered]))
+        return ordered
+
+    def graph(self):
+        waiting_on = {}
+        dependents = {key: [] for key in self.tasks}
+        for key, depends_on in self.depends_on.items():
+            known = {dependency for dependency in depends_on if dependency in self.tasks}
+            waiting_on[key] = len(known)
+            for dependency in known:
+                dependents[dependency].append(key)
+        return waiting_on, dependents
+
+    # Returns {key: {'result' or 'error', 'started', 'finished'}}, a task raising does not stop the others
+    def run(self):
+        self.order()
+        waiting_on, dependents = self.graph()
+        self.results = {}
+        if self.workers == 1:
+            for key in self.order():
+                self.results[key] = self.run_task(key)
+            return self.results
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            running = {executor.submit(self.run_task, key): key
+                       for key in self.tasks if waiting_on[key] == 0}
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    key = running.pop(future)
+                    self.results[key] = future.result()
+                    for dependent in dependents[key]:
+                        waiting_on[dependent] -= 1
+                        if waiting_on[dependent] == 0:
+                            running[executor.submit(self.run_task, dependent)] = dependent
+        return self.results
+
+    # result of a finished task, for tasks that use what the tasks they depend on returned
+    def result(self, key):
+        return self.results[key].get('result')
+
+    def failed_dependencies(self, key):
+        return [dependency for dependency in self.depends_on[key]
+                if dependency in self.results and 'error' in self.results[dependency]]
+
+    def run_task(self, key):
+        if self.skip_failed and self.failed_dependencies(key):
+            logger.error('Skipping %s as %s failed' % (key, self.failed_dependencies(key)))
+            now = time.time()
+            return {'error': 'Skipped as ' + str(self.failed_dependencies(key)) + ' failed', 'started': now,
+                    'finished': now}
+        status = {'started': time.time()}
+        try:
+            status['result'] = self.tasks[key]()
+        except Exception as e:
+            logger.error('Error running ' + str(key))
+            logger.error(e)
+            status['error'] = str(e)
+        status['finished'] = time.time()
+        return status
+
+    # The chain of dependent tasks that took the longest, i.e. the tasks that set the run's wall clock time
+    def critical_path(self):
+        finished_at = {}
+        previous = {}
+        for key in self.order():
+            duration = self.results[key]['finished'] - self.results[key]['started']
+            dependencies = [dependency for dependency in self.depends_on[key] if dependency in self.tasks]
+            previous[key] = max(dependencies, key=lambda dependency: finished_at[dependency], default=None)
+            finished_at[key] = duration + (finished_at[previous[key]] if previous[key] is not None else 0)
+        path = []
+        key = max(finished_at, key=finished_at.get, default=None)
+        while key is not None:
+            path.insert(0, key)
+            key = previous[key]
+        return path
+
+    # Logs when each task started and how long it took, followed by the critical path
+    def log_timings(self):
+        if not self.results:
+            return
+        run_started = min(status['started'] for status in self.results.values())
+        run_finished = max(status['finished'] for status in self.results.values())
+        for key, status in sorted(self.results.items(), key=lambda item: item[1]['started']):
+            logger.info('%-20s started +%7.1fs took %7.1fs%s' % (
+                key, status['started'] - run_started, status['finished'] - status['started'],
+                ' (failed)' if 'error' in status else ''))
+        path = self.critical_path()
+        path_duration = sum(self.results[key]['finished'] - self.results[key]['started'] for key in path)
+        logger.info('Critical path %s took %.1fs of %.1fs' % (' -> '.join(str(key) for key in path), path_duration,
+                                                              run_finished - run_started))
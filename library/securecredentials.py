@@ -1,6 +1,6 @@
 import base64
 import os
-import requests
+import library.clients.httpclient as httpclient
 import json
 import library.clients.insightsclient as insightsclient
 from library.status.monitorstatus import SEC_CREDENTIALS
@@ -11,6 +11,8 @@ from library.clients.endpoints import Endpoints
 logger = migrationlogger.get_logger(os.path.basename(__file__))
 query_secure_credentials_for = "FROM SyntheticCheck SELECT uniques(secureCredentials), count(monitorName) " \
                                "SINCE 7 days ago WHERE monitorName = "
+query_secure_credentials_facet = "FROM SyntheticCheck SELECT uniques(secureCredentials), count(monitorName) " \
+                                 "SINCE 7 days ago WHERE monitorName IN (%s) FACET monitorName LIMIT %d"
 
 
 def setup_headers(api_key):
@@ -38,20 +40,46 @@ def from_insights(insights_query_key, account_id, monitor_name, region=Endpoints
     credentials_and_checks = {SEC_CREDENTIALS: secure_credentials, CHECK_COUNT: 0}
     result = insightsclient.execute(insights_query_key, account_id, query, region)
     if result['status'] == 200:
-        results_json = result['json']
-        secure_credentials = results_json['results'][0]['members']
-        while '' in secure_credentials:  # remove empties
-            secure_credentials.remove('')
-        if len(secure_credentials) > 0 and ',' in secure_credentials[0]:
-            secure_credentials = secure_credentials[0].split(',')
-        credentials_and_checks[SEC_CREDENTIALS] = secure_credentials
-        credentials_and_checks[CHECK_COUNT] = results_json['results'][1]['count']
+        set_credentials_and_checks(credentials_and_checks, result['json']['results'])
     return credentials_and_checks
 
 
+def set_credentials_and_checks(credentials_and_checks, results):
+    secure_credentials = results[0]['members']
+    while '' in secure_credentials:  # remove empties
+        secure_credentials.remove('')
+    if len(secure_credentials) > 0 and ',' in secure_credentials[0]:
+        secure_credentials = secure_credentials[0].split(',')
+    credentials_and_checks[SEC_CREDENTIALS] = secure_credentials
+    credentials_and_checks[CHECK_COUNT] = results[1]['count']
+
+
+# same as from_insights for many monitors, returns the credentials and checks by monitor name
+# one query with FACET monitorName is run for each chunk of names instead of one query per monitor
+def from_insights_bulk(insights_query_key, account_id, monitor_names, region=Endpoints.REGION_US):
+    all_credentials_and_checks = {}
+    for names in insightsclient.chunk_values(monitor_names):
+        logger.info("Fetching secure credentials for %d monitors" % len(names))
+        query = query_secure_credentials_facet % (insightsclient.in_list(names), len(names))
+        result = insightsclient.execute(insights_query_key, account_id, query, region)
+        if result['status'] != 200:
+            logger.error("Faceted secure credentials query failed, fetching them one monitor at a time")
+            for name in names:
+                all_credentials_and_checks[name] = from_insights(insights_query_key, account_id, name, region)
+            continue
+        facets = insightsclient.results_by_facet(result['json'])
+        for name in names:
+            # monitors that have not run in the past 7 days have no facet
+            credentials_and_checks = {SEC_CREDENTIALS: [], CHECK_COUNT: 0}
+            if name in facets:
+                set_credentials_and_checks(credentials_and_checks, facets[name])
+            all_credentials_and_checks[name] = credentials_and_checks
+    return all_credentials_and_checks
+
+
 def escape(monitor_name):
-    if '\\' in monitor_name:
-        escaped_monitor_name = monitor_name.replace('\\', '\\\\')
+    if '\\' in monitor_name or "'" in monitor_name:
+        escaped_monitor_name = monitor_name.replace('\\', '\\\\').replace("'", "\\'")
         logger.info('escaped name : ' + escaped_monitor_name)
         return escaped_monitor_name
     return monitor_name
@@ -64,7 +92,7 @@ def create(api_key, scripted_monitors, region=Endpoints.REGION_US):
         sec_cred_data = {'key': secure_cred, 'value': 'dummy',
                          'description': 'PLEASE UPDATE. Created by migration script.'}
         sec_cred_json_str = json.dumps(sec_cred_data)
-        response = requests.post(Endpoints.of(region).SEC_CREDENTIALS_URL, headers=setup_headers(api_key), data=sec_cred_json_str)
+        response = httpclient.post(Endpoints.of(region).SEC_CREDENTIALS_URL, headers=setup_headers(api_key), data=sec_cred_json_str)
         status = {'sec_cred_status': response.status_code}
         if response.text:
             status['body'] = response.text
@@ -85,11 +113,11 @@ def get_unique_credentials(scripted_monitors):
 
 def delete_all(api_key, account_id, region):
     logger.warn('Deleting all secure credentials for ' + account_id)
-    result = requests.get(Endpoints.of(region).SEC_CREDENTIALS_URL, headers=setup_headers(api_key))
+    result = httpclient.get(Endpoints.of(region).SEC_CREDENTIALS_URL, headers=setup_headers(api_key))
     if result.status_code == 200:
         response_json = result.json()
         sec_creds = response_json['secureCredentials']
         for sec_cred in sec_creds:
             logger.info('Deleting ' + sec_cred['key'])
-            result = requests.delete(Endpoints.of(region).SEC_CREDENTIALS_URL + '/' + sec_cred['key'], headers=setup_headers(api_key))
+            result = httpclient.delete(Endpoints.of(region).SEC_CREDENTIALS_URL + '/' + sec_cred['key'], headers=setup_headers(api_key))
             logger.info('Delete status ' + str(result.status_code))
@@ -0,0 +1,198 @@
+import json
+import os
+import sqlite3
+import threading
+from pathlib import Path
+import library.migrationlogger as migrationlogger
+
+# SQLite copy of the local store in db/<account_id>/store.sqlite, used when ENV_STORE_BACKEND=sqlite
+# Policies, the policy to entity map and channels are saved as indexed rows so a single policy, entity or
+# channel is read without loading the whole document. The load functions rebuild the same dicts the json
+# files hold, the keys besides the rows (e.g. response_count) are kept in the documents table
+
+DB_DIR = 'db'
+STORE_FILE = 'store.sqlite'
+ALERT_POLICIES = 'alert_policies'
+ALERT_POLICY_ENTITY_MAP = 'alert_policy_entity_map'
+ALERT_CHANNELS = 'alert_channels'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS documents (name TEXT PRIMARY KEY, extras TEXT);
+CREATE TABLE IF NOT EXISTS monitors (timestamp TEXT, name TEXT, guid TEXT, seq INTEGER, monitor TEXT,
+                                     PRIMARY KEY (timestamp, name));
+CREATE INDEX IF NOT EXISTS monitors_by_guid ON monitors (timestamp, guid);
+CREATE TABLE IF NOT EXISTS policies (id INTEGER PRIMARY KEY, name TEXT, seq INTEGER, policy TEXT);
+CREATE INDEX IF NOT EXISTS policies_by_name ON policies (name);
+CREATE TABLE IF NOT EXISTS map_policies (policy_name TEXT PRIMARY KEY, seq INTEGER, updated_at INTEGER);
+CREATE TABLE IF NOT EXISTS policy_entities (policy_name TEXT, entity_id TEXT, entity TEXT, seq INTEGER,
+                                            PRIMARY KEY (policy_name, entity_id));
+CREATE INDEX IF NOT EXISTS policy_entities_by_entity ON policy_entities (entity_id, policy_name);
+CREATE TABLE IF NOT EXISTS channels (id TEXT PRIMARY KEY, seq INTEGER, channel TEXT);
+CREATE TABLE IF NOT EXISTS channel_policies (policy_id TEXT, channel_id TEXT, seq INTEGER);
+'''
+
+logger = migrationlogger.get_logger(os.path.basename(__file__))
+
+_local = threading.local()
+
+
+def store_path(account_id):
+    return Path(DB_DIR) / str(account_id) / STORE_FILE
+
+
+def exists(account_id):
+    return store_path(account_id).exists()
+
+
+# A new connection with the schema created, the caller closes it and keeps it to one thread at a time
+def open_connection(path):
+    path = Path(path)
+    path.parent.mkdir(mode=0o777, parents=True, exist_ok=True)
+    connection = sqlite3.connect(str(path), timeout=30, check_same_thread=False)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.executescript(SCHEMA)
+    return connection
+
+
+# One connection per thread and database file
+def connect(path):
+    connections = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = _local.connections = {}
+    if str(path) not in connections:
+        connections[str(path)] = open_connection(path)
+    return connections[str(path)]
+
+
+def account_connection(account_id):
+    return connect(store_path(account_id))
+
+
+def save_extras(connection, name, document, row_keys):
+    extras = {key: value for key, value in document.items() if key not in row_keys}
+    connection.execute('INSERT OR REPLACE INTO documents (name, extras) VALUES (?, ?)', (name, json.dumps(extras)))
+
+
+def load_extras(connection, name):
+    row = connection.execute('SELECT extras FROM documents WHERE name = ?', (name,)).fetchone()
+    return json.loads(row[0]) if row else None
+
+
+def save_alert_policies(account_id, alert_policies):
+    connection = account_connection(account_id)
+    with connection:
+        connection.execute('DELETE FROM policies')
+        connection.executemany('INSERT OR REPLACE INTO policies (id, name, seq, policy) VALUES (?, ?, ?, ?)',
+                               ((policy['id'], policy['name'], seq, json.dumps(policy))
+                                for seq, policy in enumerate(alert_policies.get('policies', []))))
+        save_extras(connection, ALERT_POLICIES, alert_policies, ['policies'])
+
+
+def load_alert_policies(account_id):
+    if not exists(account_id):
+        return {}
+    connection = account_connection(account_id)
+    alert_policies = load_extras(connection, ALERT_POLICIES)
+    if alert_policies is None:
+        return {}
+    alert_policies['policies'] = [json.loads(row[0]) for row in
+                                  connection.execute('SELECT policy FROM policies ORDER BY seq')]
+    return alert_policies
+
+
+# True when a complete policy list was saved, so a name missing from it is not in the account
+def has_alert_policies(account_id):
+    if not exists(account_id):
+        return False
+    alert_policies = load_extras(account_connection(account_id), ALERT_POLICIES)
+    return alert_policies is not None and 'error' not in alert_policies
+
+
+def load_alert_policy(account_id, policy_name):
+    if not exists(account_id):
+        return None
+    row = account_connection(account_id).execute('SELECT policy FROM policies WHERE name = ? ORDER BY seq LIMIT 1',
+                                                  (policy_name,)).fetchone()
+    return json.loads(row[0]) if row else None
+
+
+def save_alert_policy_entity_map(account_id, alert_policy_entity_map):
+    connection = account_connection(account_id)
+    updated_at_by_policy = alert_policy_entity_map.get('updated_at_by_policy', {})
+    with connection:
+        connection.execute('DELETE FROM map_policies')
+        connection.execute('DELETE FROM policy_entities')
+        seq = 0
+        for policy_seq, (policy_name, entities) in enumerate(alert_policy_entity_map['entities_by_policy'].items()):
+            connection.execute('INSERT INTO map_policies (policy_name, seq, updated_at) VALUES (?, ?, ?)',
+                               (policy_name, policy_seq, updated_at_by_policy.get(policy_name)))
+            for entity in entities:
+                connection.execute('INSERT OR IGNORE INTO policy_entities (policy_name, entity_id, entity, seq) '
+                                   'VALUES (?, ?, ?, ?)', (policy_name, str(entity), json.dumps(entity), seq))
+                seq += 1
+        save_extras(connection, ALERT_POLICY_ENTITY_MAP, alert_policy_entity_map,
+                    ['entities_by_policy', 'policies_by_entity', 'updated_at_by_policy'])
+
+
+def load_alert_policy_entity_map(account_id):
+    if not exists(account_id):
+        return {}
+    connection = account_connection(account_id)
+    alert_policy_entity_map = load_extras(connection, ALERT_POLICY_ENTITY_MAP)
+    if alert_policy_entity_map is None:
+        return {}
+    entities_by_policy = {}
+    updated_at_by_policy = {}
+    for policy_name, updated_at in connection.execute('SELECT policy_name, updated_at FROM map_policies ORDER BY seq'):
+        entities_by_policy[policy_name] = []
+        if updated_at is not None:
+            updated_at_by_policy[policy_name] = updated_at
+    policies_by_entity = {}
+    for policy_name, entity_id, entity in connection.execute(
+            'SELECT policy_name, entity_id, entity FROM policy_entities ORDER BY seq'):
+        entities_by_policy[policy_name].append(json.loads(entity))
+        policies_by_entity.setdefault(entity_id, []).append(policy_name)
+    alert_policy_entity_map['entities_by_policy'] = entities_by_policy
+    alert_policy_entity_map['policies_by_entity'] = {entity_id: sorted(policy_names)
+                                                     for entity_id, policy_names in policies_by_entity.items()}
+    alert_policy_entity_map['updated_at_by_policy'] = updated_at_by_policy
+    return alert_policy_entity_map
+
+
+def load_policy_names_by_entity(account_id, entity_id):
+    if not exists(account_id):
+        return []
+    return [row[0] for row in account_connection(account_id).execute(
+        'SELECT policy_name FROM policy_entities WHERE entity_id = ? ORDER BY policy_name', (str(entity_id),))]
+
+
+def save_alert_channels(account_id, all_alert_channels):
+    connection = account_connection(account_id)
+    with connection:
+        connection.execute('DELETE FROM channels')
+        connection.execute('DELETE FROM channel_policies')
+        connection.executemany('INSERT OR REPLACE INTO channels (id, seq, channel) VALUES (?, ?, ?)',
+                               ((channel_id, seq, json.dumps(channel)) for seq, (channel_id, channel)
+                                in enumerate(all_alert_channels.get('channels_by_id', {}).items())))
+        connection.executemany('INSERT INTO channel_policies (policy_id, channel_id, seq) VALUES (?, ?, ?)',
+                               ((policy_id, channel_id, seq)
+                                for policy_id, channel_ids in all_alert_channels.get('channels_by_policy_id', {}).items()
+                                for seq, channel_id in enumerate(channel_ids)))
+        save_extras(connection, ALERT_CHANNELS, all_alert_channels, ['channels_by_id', 'channels_by_policy_id'])
+
+
+def load_alert_channels(account_id):
+    if not exists(account_id):
+        return {}
+    connection = account_connection(account_id)
+    all_alert_channels = load_extras(connection, ALERT_CHANNELS)
+    if all_alert_channels is None:
+        return {}
+    all_alert_channels['channels_by_id'] = {channel_id: json.loads(channel) for channel_id, channel in
+                                            connection.execute('SELECT id, channel FROM channels ORDER BY seq')}
+    channels_by_policy_id = {}
+    for policy_id, channel_id in connection.execute(
+            'SELECT policy_id, channel_id FROM channel_policies ORDER BY rowid'):
+        channels_by_policy_id.setdefault(policy_id, []).append(channel_id)
+    all_alert_channels['channels_by_policy_id'] = channels_by_policy_id
+    return all_alert_channels
@@ -0,0 +1,608 @@
+import base64
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, urlencode
+import library.migrationlogger as m_logger
+import library.clients.ratelimiter as ratelimiter
+
+# Local stand-in for the New Relic APIs used by the migration scripts, for benchmarks and offline runs
+# Speaks just enough of the REST v2 alerts, Synthetics, Insights and NerdGraph shapes used by library/clients.
+# Requests reach it through Endpoints.use_base_url / ENV_NEW_RELIC_BASE_URL, which keeps the original host as the
+# first path segment, e.g. http://127.0.0.1:8080/api.newrelic.com/v2/alerts_policies.json
+# Each API key belongs to one account. Objects created in an account are returned by later requests, so the
+# migrators can run one after the other against the same server
+# latency is added to every response and rate_limits, requests per second for each API key and endpoint family,
+# are enforced with HTTP 429 (or a TOO_MANY_REQUESTS NerdGraph error) and Retry-After
+
+REST_PAGE_SIZE = 50
+INFRA_PAGE_SIZE = 50
+ENTITY_PAGE_SIZE = 200
+NRQL_PAGE_SIZE = 50
+RETRY_AFTER = 1
+
+logger = m_logger.get_logger(os.path.basename(__file__))
+
+
+def entity_guid(account_id, domain, entity_type, entity_id):
+    return base64.b64encode(('%s|%s|%s|%s' % (account_id, domain, entity_type, entity_id)).encode('utf-8')).decode(
+        'utf-8').rstrip('=')
+
+
+def tags_of(values_by_key):
+    return [{'key': key, 'values': values} for key, values in values_by_key.items()]
+
+
+# Every object of one account, guarded by the server lock
+class Account:
+
+    def __init__(self, account_id):
+        self.id = int(account_id)
+        self.policies = []
+        self.channels = []
+        # condition lists by REST entity key and policy id
+        self.conditions = {}
+        self.nrql_conditions = {}
+        self.entities = {}
+        self.scripts = {}
+        self.steps = {}
+        self.dashboards = {}
+        self.applications = {}
+        self.secure_credentials = {}
+
+    def conditions_of(self, kind, policy_id):
+        return self.conditions.setdefault(kind, {}).setdefault(int(policy_id), [])
+
+    def add_entity(self, entity):
+        self.entities[entity['guid']] = entity
+        return entity
+
+
+class StubServer:
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, rate_limits=None):
+        self.latency = latency
+        self.rate_limits = rate_limits or {}
+        self.accounts = {}
+        self.api_keys = {}
+        self.buckets = {}
+        self.requests = {family: 0 for family in ratelimiter.FAMILIES}
+        self.throttled = {family: 0 for family in ratelimiter.FAMILIES}
+        self.unhandled = []
+        self.next_id = 1000
+        self.lock = threading.RLock()
+        self.httpd = ThreadingHTTPServer((host, port), StubHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.stub = self
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return 'http://%s:%d' % (host, port)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        logger.info('Stub server listening on ' + self.base_url)
+        return self.base_url
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def new_id(self):
+        with self.lock:
+            self.next_id += 1
+            return self.next_id
+
+    def add_account(self, account_id, api_key):
+        with self.lock:
+            account = self.accounts.setdefault(int(account_id), Account(account_id))
+            self.api_keys[api_key] = account
+            return account
+
+    def account_of(self, api_key, account_id=None):
+        if account_id is not None:
+            return self.accounts.get(int(account_id))
+        return self.api_keys.get(api_key)
+
+    # returns the seconds to wait before retrying when api_key is over the rate of family, else 0
+    def throttle(self, api_key, family):
+        with self.lock:
+            self.requests[family] += 1
+            if family not in self.rate_limits:
+                return 0
+            bucket = self.buckets.setdefault((api_key, family), ratelimiter.TokenBucket(self.rate_limits[family]))
+        if bucket.reserve() == 0:
+            return 0
+        with self.lock:
+            self.throttled[family] += 1
+        return RETRY_AFTER
+
+    def stats(self):
+        with self.lock:
+            return {'requests': dict(self.requests), 'throttled': dict(self.throttled),
+                    'unhandled': list(self.unhandled)}
+
+    # Generated source account objects
+
+    def add_application(self, account, name, language='java', tags=None):
+        app_id = self.new_id()
+        application = {'id': app_id, 'name': name, 'language': language, 'health_status': 'green',
+                       'reporting': True, 'settings': {'app_apdex_threshold': 0.5, 'end_user_apdex_threshold': 7,
+                                                       'enable_real_user_monitoring': True, 'use_server_side_config': False},
+                       'links': {'application_instances': [], 'servers': [], 'application_hosts': []}}
+        all_tags = {'accountId': [str(account.id)], 'language': [language]}
+        all_tags.update(tags or {})
+        account.applications[app_id] = application
+        account.add_entity({'guid': entity_guid(account.id, 'APM', 'APPLICATION', app_id), 'name': name,
+                            'accountId': account.id, 'domain': 'APM', 'type': 'APPLICATION',
+                            'entityType': 'APM_APPLICATION_ENTITY', 'applicationId': app_id,
+                            'language': language, 'tags': tags_of(all_tags)})
+        return application
+
+    def add_monitor(self, account, name, monitor_type='SIMPLE', tags=None):
+        monitor_id = str(uuid.uuid4())
+        guid = entity_guid(account.id, 'SYNTH', 'MONITOR', monitor_id)
+        all_tags = {'accountId': [str(account.id)], 'apdexTarget': ['7.0'], 'period': ['10'],
+                    'publicLocation': ['Portland, OR, USA'], 'monitorStatus': ['Enabled']}
+        if monitor_type == 'SCRIPT_API':
+            all_tags.update({'runtimeType': ['NODE_API'], 'runtimeTypeVersion': ['16.10'],
+                             'scriptLanguage': ['JAVASCRIPT']})
+        all_tags.update(tags or {})
+        entity = account.add_entity({'guid': guid, 'name': name, 'accountId': account.id, 'domain': 'SYNTH',
+                                     'type': 'MONITOR', 'entityType': 'SYNTHETIC_MONITOR_ENTITY',
+                                     'monitorId': monitor_id, 'monitorType': monitor_type,
+                                     'monitorSummary': {'status': 'ENABLED'}, 'period': 10,
+                                     'monitoredUrl': 'https://example.com/' + str(len(account.entities)),
+                                     'tags': tags_of(all_tags)})
+        if monitor_type == 'SCRIPT_API':
+            account.scripts[guid] = "var assert = require('assert');\n$http.get('https://example.com', " \
+                                    "function (err, response, body) { assert.equal(response.statusCode, 200); " \
+                                    "});\n"
+        return entity
+
+    def add_dashboard(self, account, name, pages=2, widgets=3):
+        dashboard_id = self.new_id()
+        guid = entity_guid(account.id, 'VIZ', 'DASHBOARD', dashboard_id)
+        account.dashboards[guid] = {
+            'guid': guid, 'name': name, 'permissions': 'PUBLIC_READ_WRITE',
+            'pages': [{'name': 'Page %d' % page,
+                       'widgets': [{'title': 'Widget %d' % widget, 'visualization': {'id': 'viz.line'},
+                                    'layout': {'row': 1 + 3 * (widget // 3), 'column': 1 + 4 * (widget % 3),
+                                               'width': 4, 'height': 3},
+                                    'rawConfiguration': {'nrqlQueries': [
+                                        {'accountId': account.id,
+                                         'query': 'SELECT count(*) FROM Transaction TIMESERIES'}]}}
+                                   for widget in range(widgets)]}
+                      for page in range(pages)]}
+        return account.add_entity({'guid': guid, 'name': name, 'accountId': account.id, 'domain': 'VIZ',
+                                   'type': 'DASHBOARD', 'entityType': 'DASHBOARD_ENTITY',
+                                   'tags': tags_of({'accountId': [str(account.id)]})})
+
+    def add_policy(self, account, name):
+        policy = {'id': self.new_id(), 'name': name, 'incident_preference': 'PER_POLICY',
+                  'created_at': int(time.time() * 1000), 'updated_at': int(time.time() * 1000)}
+        account.policies.append(policy)
+        return policy
+
+    # Source account with policies, each with conditions_per_policy conditions of every kind that
+    # migrateconditions migrates, and the monitors, applications and dashboards they refer to
+    # Target account with the same applications, as if the same agents reported to both
+    def generate(self, source_account_id, source_api_key, target_account_id, target_api_key, policies=10,
+                 conditions_per_policy=2, monitors=20, dashboards=10, applications=10):
+        with self.lock:
+            source = self.add_account(source_account_id, source_api_key)
+            target = self.add_account(target_account_id, target_api_key)
+            apps = []
+            for index in range(applications):
+                name = 'Benchmark App %d' % index
+                apps.append(self.add_application(source, name, tags={'team': ['team-%d' % (index % 5)],
+                                                                      'env': ['production']}))
+                self.add_application(target, name)
+            synth_monitors = [self.add_monitor(source, 'Benchmark Monitor %d' % index,
+                                               'SCRIPT_API' if index % 2 else 'SIMPLE')
+                              for index in range(monitors)]
+            for index in range(dashboards):
+                self.add_dashboard(source, 'Benchmark Dashboard %d' % index)
+            channel = {'id': self.new_id(), 'name': 'Benchmark Email', 'type': 'email',
+                       'configuration': {'recipients': 'alerts@example.com', 'include_json_attachment': 'false'},
+                       'links': {'policy_ids': []}}
+            source.channels.append(channel)
+            for index in range(policies):
+                policy = self.add_policy(source, 'Benchmark Policy %d' % index)
+                channel['links']['policy_ids'].append(policy['id'])
+                for number in range(conditions_per_policy):
+                    self.add_conditions(source, policy, number, apps, synth_monitors)
+            return source, target
+
+    def add_conditions(self, account, policy, number, apps, monitors):
+        name = '%s condition %d' % (policy['name'], number)
+        term = {'duration': '5', 'operator': 'above', 'priority': 'critical', 'threshold': '1',
+                'time_function': 'all'}
+        if monitors:
+            monitor = monitors[(policy['id'] + number) % len(monitors)]
+            account.conditions_of('synthetics_conditions', policy['id']).append(
+                {'id': self.new_id(), 'name': name, 'monitor_id': monitor['monitorId'], 'enabled': True})
+            account.conditions_of('location_failure_conditions', policy['id']).append(
+                {'id': self.new_id(), 'name': name, 'enabled': True, 'entities': [monitor['monitorId']],
+                 'terms': [{'priority': 'critical', 'threshold': 1}], 'violation_time_limit_seconds': 3600})
+        if apps:
+            app = apps[(policy['id'] + number) % len(apps)]
+            account.conditions_of('conditions', policy['id']).append(
+                {'id': self.new_id(), 'type': 'apm_app_metric', 'name': name, 'enabled': True,
+                 'entities': [str(app['id'])], 'metric': 'apdex', 'condition_scope': 'application',
+                 'terms': [term]})
+            account.conditions_of('external_service_conditions', policy['id']).append(
+                {'id': self.new_id(), 'type': 'apm_external_service', 'name': name, 'enabled': True,
+                 'entities': [str(app['id'])], 'external_service_url': 'example.com',
+                 'metric': 'response_time_average', 'terms': [term]})
+        account.conditions_of('data', policy['id']).append(
+            {'id': self.new_id(), 'policy_id': policy['id'], 'type': 'infra_metric', 'name': name,
+             'created_at_epoch_millis': policy['created_at'], 'updated_at_epoch_millis': policy['updated_at'],
+             'enabled': True, 'event_type': 'SystemSample', 'select_value': 'cpuPercent',
+             'comparison': 'above', 'critical_threshold': {'value': 90, 'duration_minutes': 5,
+                                                           'time_function': 'all'}})
+        self.add_nrql_condition(account, policy['id'], 'STATIC', {
+            'name': name, 'enabled': True, 'description': None, 'runbookUrl': None,
+            'nrql': {'query': "SELECT count(*) FROM Transaction WHERE appName = 'Benchmark'"},
+            'signal': {'aggregationDelay': 120, 'aggregationMethod': 'EVENT_FLOW', 'aggregationTimer': None,
+                       'aggregationWindow': 60, 'evaluationDelay': None, 'evaluationOffset': None,
+                       'fillOption': 'NONE', 'fillValue': None, 'slideBy': None},
+            'terms': [{'operator': 'ABOVE', 'priority': 'CRITICAL', 'threshold': 1.0, 'thresholdDuration': 300,
+                       'thresholdOccurrences': 'ALL'}],
+            'expiration': {'closeViolationsOnExpiration': False, 'expirationDuration': None,
+                           'openViolationOnExpiration': False},
+            'violationTimeLimitSeconds': 86400, 'valueFunction': 'SINGLE_VALUE'})
+
+    def add_nrql_condition(self, account, policy_id, condition_type, condition):
+        nrql_condition = dict(condition, id=str(self.new_id()), policyId=str(policy_id), type=condition_type)
+        account.nrql_conditions.setdefault(str(policy_id), []).append(nrql_condition)
+        return nrql_condition
+
+
+def page_of(items, cursor, page_size):
+    start = int(cursor) if cursor else 0
+    next_cursor = str(start + page_size) if start + page_size < len(items) else None
+    return items[start:start + page_size], next_cursor
+
+
+# Entity search query, conditions joined by AND such as name = 'x', type != 'HOST', tags.accountId = '1'
+SEARCH_TERM = re.compile(r"^\s*([\w.]+)\s*(!=|=)\s*'?(.*?)'?\s*$")
+
+
+def entity_value(entity, field):
+    if field.startswith('tags.'):
+        key = field[len('tags.'):]
+        return [value for tag in entity.get('tags', []) if tag['key'] == key for value in tag['values']]
+    return [str(entity.get(field))]
+
+
+def matches(entity, search):
+    for term in search.split(' AND '):
+        match = SEARCH_TERM.match(term)
+        if not match:
+            continue
+        field, operator, value = match.groups()
+        found = value in entity_value(entity, field)
+        if found != (operator == '='):
+            return False
+    return True
+
+
+# Entity search results leave out what only the entity query returns
+def outline(entity):
+    return {key: value for key, value in entity.items() if key not in ['pages', 'permissions']}
+
+
+# Mutations are matched by name, optionally aliased, with their arguments taken from the query variables
+MUTATION = re.compile(r'(?:(\w+)\s*:\s*)?\b(\w+)\s*\(([^()]*)\)\s*\{')
+ARGUMENT = re.compile(r'(\w+)\s*:\s*\$(\w+)')
+
+
+class StubHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately, without this every keep-alive response waits for a delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        logger.debug('%s %s' % (self.address_string(), format % args))
+
+    @property
+    def stub(self):
+        return self.server.stub
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def do_PUT(self):
+        self.handle_request('PUT')
+
+    def do_PATCH(self):
+        self.handle_request('PATCH')
+
+    def do_DELETE(self):
+        self.handle_request('DELETE')
+
+    def handle_request(self, method):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        url = urlsplit(self.path)
+        host, _, path = url.path.lstrip('/').partition('/')
+        path = '/' + path
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        family = ratelimiter.family_of(self.path)
+        api_key = self.headers.get('Api-Key') or self.headers.get('X-Api-Key') or self.headers.get('X-Query-Key')
+        if self.stub.latency:
+            time.sleep(self.stub.latency)
+        retry_after = self.stub.throttle(api_key, family)
+        if retry_after:
+            if family == ratelimiter.NERDGRAPH:
+                return self.send_json(200, {'data': None, 'errors': [
+                    {'message': 'Too many requests', 'extensions': {'errorClass': 'TOO_MANY_REQUESTS'}}]})
+            return self.send_json(429, {'error': {'title': 'Too many requests'}},
+                                  {'Retry-After': str(retry_after)})
+        try:
+            request_json = json.loads(body) if body else {}
+        except ValueError:
+            return self.send_json(400, {'error': {'title': 'Invalid JSON'}})
+        try:
+            with self.stub.lock:
+                if path == '/graphql':
+                    status, response_json, headers = 200, self.graphql(api_key, request_json), {}
+                else:
+                    status, response_json, headers = self.rest(method, host, path, query, api_key, request_json)
+        except Exception as e:
+            logger.error('Stub server error for %s %s' % (method, self.path))
+            logger.error(e)
+            status, response_json, headers = 500, {'error': {'title': str(e)}}, {}
+        self.send_json(status, response_json, headers)
+
+    def send_json(self, status, response_json, headers=None):
+        content = json.dumps(response_json).encode('utf-8') if response_json is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def unhandled(self, description):
+        logger.warning('Stub server does not handle ' + description)
+        self.stub.unhandled.append(description)
+
+    # REST v2, Infrastructure alerts, Synthetics and Insights
+
+    def rest(self, method, host, path, query, api_key, request_json):
+        account = self.stub.account_of(api_key)
+        if host.startswith('insights-api.'):
+            match = re.match(r'/v1/accounts/(\d+)/query', path)
+            if match and method == 'GET':
+                return 200, self.insights(query.get('nrql', '')), {}
+        if account is None:
+            return 401, {'error': {'title': 'Invalid API key'}}, {}
+        if host.startswith('infra-api.'):
+            return self.infra(method, account, query, request_json)
+        if host.startswith('synthetics.'):
+            return self.synthetics(method, account, path)
+        route = re.match(r'/v2/([a-z_]+?)(?:/policies)?(?:/(\d+))?\.json$', path)
+        if route is None:
+            self.unhandled('%s %s%s' % (method, host, path))
+            return 404, {'error': {'title': 'Not found'}}, {}
+        resource, resource_id = route.groups()
+        if resource == 'alerts_policies':
+            if method == 'POST':
+                policy = self.stub.add_policy(account, request_json['policy']['name'])
+                policy['incident_preference'] = request_json['policy'].get('incident_preference', 'PER_POLICY')
+                return 201, {'policy': policy}, {}
+            policies = account.policies
+            if 'filter[name]' in query:
+                policies = [policy for policy in policies if policy['name'] == query['filter[name]']]
+            return self.rest_page('policies', policies, query)
+        if resource == 'alerts_channels':
+            if method == 'POST':
+                channel = dict(request_json['channel'], id=self.stub.new_id(), links={'policy_ids': []})
+                account.channels.append(channel)
+                return 201, {'channels': [channel]}, {}
+            return self.rest_page('channels', account.channels, query)
+        if resource == 'alerts_policy_channels' and method == 'PUT':
+            channel_ids = [int(channel_id) for channel_id in query.get('channel_ids', '').split(',') if channel_id]
+            return 200, {'policy': {'id': int(query['policy_id']), 'channel_ids': channel_ids}}, {}
+        kinds = {'alerts_synthetics_conditions': 'synthetics_conditions',
+                 'alerts_location_failure_conditions': 'location_failure_conditions',
+                 'alerts_conditions': 'conditions',
+                 'alerts_external_service_conditions': 'external_service_conditions'}
+        if resource in kinds:
+            kind = kinds[resource]
+            policy_id = resource_id or query.get('policy_id')
+            if method == 'POST':
+                condition = dict(list(request_json.values())[0], id=self.stub.new_id())
+                account.conditions_of(kind, policy_id).append(condition)
+                return 201, {list(request_json.keys())[0]: condition}, {}
+            return self.rest_page(kind, account.conditions_of(kind, policy_id), query)
+        if resource == 'alerts_entity_conditions':
+            return 200, {'entity_conditions': []}, {}
+        if resource == 'applications':
+            if resource_id:
+                application = account.applications.get(int(resource_id))
+                if application is None:
+                    return 404, {'error': {'title': 'Application not found'}}, {}
+                return 200, {'application': application}, {}
+            applications = list(account.applications.values())
+            if 'filter[name]' in query:
+                applications = [app for app in applications if query['filter[name]'] in app['name']]
+            return self.rest_page('applications', applications, query)
+        if resource in ['key_transactions', 'browser_applications', 'mobile_applications']:
+            return 200, {resource: []}, {}
+        self.unhandled('%s %s%s' % (method, host, path))
+        return 404, {'error': {'title': 'Not found'}}, {}
+
+    # Pages of REST_PAGE_SIZE with a Link header to the next page, as utils.get_paginated_entities expects
+    def rest_page(self, entity_key, items, query):
+        page = int(query.get('page', 1))
+        start = (page - 1) * REST_PAGE_SIZE
+        headers = {}
+        if start + REST_PAGE_SIZE < len(items):
+            url = urlsplit(self.path)
+            next_query = dict(query, page=page + 1)
+            headers['Link'] = '<%s%s?%s>; rel="next"' % (self.stub.base_url, url.path, urlencode(next_query))
+        return 200, {entity_key: items[start:start + REST_PAGE_SIZE]}, headers
+
+    def infra(self, method, account, query, request_json):
+        if method == 'POST':
+            now = int(time.time() * 1000)
+            condition = dict(request_json['data'], id=self.stub.new_id(), created_at_epoch_millis=now,
+                             updated_at_epoch_millis=now)
+            account.conditions_of('data', condition['policy_id']).append(condition)
+            return 201, {'data': condition}, {}
+        conditions = account.conditions_of('data', query.get('policy_id'))
+        offset = int(query.get('offset', 0))
+        limit = int(query.get('limit', INFRA_PAGE_SIZE))
+        return 200, {'data': conditions[offset:offset + limit],
+                     'meta': {'limit': limit, 'offset': offset, 'total': len(conditions)}}, {}
+
+    def synthetics(self, method, account, path):
+        if path.startswith('/synthetics/api/v1/secure-credentials'):
+            if method == 'POST':
+                return 204, None, {}
+            return 200, {'secureCredentials': list(account.secure_credentials.values())}, {}
+        match = re.match(r'/synthetics/api/v3/monitors/([\w-]+)$', path)
+        if match and method == 'GET':
+            for entity in account.entities.values():
+                if entity.get('monitorId') == match.group(1):
+                    return 200, {'id': entity['monitorId'], 'name': entity['name'], 'type': entity['monitorType'],
+                                 'frequency': entity['period'], 'uri': entity['monitoredUrl'],
+                                 'locations': ['AWS_US_WEST_2'], 'status': 'ENABLED', 'slaThreshold': 7.0}, {}
+            return 404, {'error': 'Monitor not found'}, {}
+        self.unhandled('%s synthetics%s' % (method, path))
+        return 404, {'error': 'Not found'}, {}
+
+    # Secure credential checks for the monitors of a faceted query, the other queries have no results
+    def insights(self, nrql):
+        if 'FACET monitorName' in nrql:
+            names = re.findall(r"'((?:[^'\\]|\\.)*)'", nrql.split(' IN ', 1)[-1])
+            return {'facets': [{'name': name, 'results': [{'members': ['BENCHMARK_CREDENTIAL']}, {'count': 100}]}
+                               for name in names]}
+        if 'SyntheticCheck' in nrql:
+            return {'results': [{'members': []}, {'count': 0}]}
+        return {'results': [{'events': []}]}
+
+    # NerdGraph
+
+    def graphql(self, api_key, request_json):
+        query = request_json.get('query', '')
+        variables = request_json.get('variables') or {}
+        if query.lstrip().startswith('mutation'):
+            return self.mutations(api_key, query, variables)
+        if 'entitySearch' in query:
+            return {'data': {'actor': {'entitySearch': self.entity_search(query, variables)}}}
+        if 'nrqlConditionsSearch' in query:
+            conditions = self.stub.accounts[int(variables['accountId'])].nrql_conditions.get(
+                str(variables['policyId']), [])
+            page, next_cursor = page_of(conditions, cursor_of(query, variables), NRQL_PAGE_SIZE)
+            return alerts_data({'nrqlConditionsSearch': {'nrqlConditions': page, 'nextCursor': next_cursor}})
+        if 'nrqlCondition(' in query:
+            account = self.stub.accounts[int(variables['accountId'])]
+            by_id = {condition['id']: condition for conditions in account.nrql_conditions.values()
+                     for condition in conditions}
+            lookups = re.findall(r'(?:(\w+)\s*:\s*)?nrqlCondition\s*\(\s*id:\s*\$(\w+)', query)
+            return alerts_data({alias or 'nrqlCondition': by_id.get(str(variables[name])) for alias, name in lookups})
+        if 'script(' in query:
+            script = self.stub.accounts[int(variables['accountId'])].scripts.get(variables['entityGuid'])
+            return {'data': {'actor': {'account': {'synthetics': {'script': {'text': script}}}}}}
+        if 'steps(' in query:
+            steps = self.stub.accounts[int(variables['accountId'])].steps.get(variables['entityGuid'], [])
+            return {'data': {'actor': {'account': {'synthetics': {'steps': steps}}}}}
+        if 'entities(guids' in query:
+            guids = [variables[name] for name in re.findall(r'\$(\w+)', query.split('entities(guids', 1)[1])[:1]]
+            return {'data': {'actor': {'entities': [entity for guid in guids
+                                                    for entity in [self.find_entity(guid)] if entity]}}}
+        if 'entity(guid' in query:
+            guid = variables.get('guid')
+            entity = None
+            for account in self.stub.accounts.values():
+                if guid in account.dashboards:
+                    entity = account.dashboards[guid]
+            return {'data': {'actor': {'entity': entity or self.find_entity(guid)}}}
+        self.unhandled('NerdGraph query ' + ' '.join(query.split())[:100])
+        return {'data': None, 'errors': [{'message': 'Query not handled by the stub server'}]}
+
+    def find_entity(self, guid):
+        for account in self.stub.accounts.values():
+            if guid in account.entities:
+                return account.entities[guid]
+        return None
+
+    def entity_search(self, query, variables):
+        search = variables.get('matchingCondition') or variables.get('search') or ''
+        entities = [outline(entity) for account in self.stub.accounts.values()
+                    for entity in account.entities.values() if matches(entity, search)]
+        page, next_cursor = page_of(entities, cursor_of(query, variables), ENTITY_PAGE_SIZE)
+        return {'count': len(entities), 'results': {'entities': page, 'nextCursor': next_cursor}}
+
+    def mutations(self, api_key, query, variables):
+        data = {}
+        for alias, name, arguments in MUTATION.findall(query.split('{', 1)[1]):
+            arguments = {argument: variables.get(variable) for argument, variable in ARGUMENT.findall(arguments)}
+            data[alias or name] = self.mutation(name, arguments)
+        return {'data': data}
+
+    def mutation(self, name, arguments):
+        if name in ['taggingAddTagsToEntity', 'taggingReplaceTagsOnEntity']:
+            entity = self.find_entity(arguments['guid'])
+            if entity is None:
+                return {'errors': [{'message': 'Entity not found', 'type': 'NOT_FOUND'}]}
+            tags = {} if name == 'taggingReplaceTagsOnEntity' else {tag['key']: tag['values'] for tag in entity['tags']}
+            for tag in arguments['tags']:
+                tags[tag['key']] = list(dict.fromkeys(tags.get(tag['key'], []) + tag['values']))
+            entity['tags'] = tags_of(tags)
+            return {'errors': []}
+        if name == 'dashboardCreate':
+            account = self.stub.accounts[int(arguments['accountId'])]
+            entity = self.stub.add_dashboard(account, arguments['dashboard']['name'], 0)
+            account.dashboards[entity['guid']].update(arguments['dashboard'])
+            # NerdGraph returns null rather than an empty list when there are no errors
+            return {'entityResult': {'guid': entity['guid'], 'name': entity['name']}, 'errors': None}
+        if name == 'dashboardDelete':
+            for account in self.stub.accounts.values():
+                account.entities.pop(arguments['guid'], None)
+                account.dashboards.pop(arguments['guid'], None)
+            return {'status': 'SUCCESS', 'errors': None}
+        match = re.match(r'syntheticsCreate(\w+)Monitor$', name)
+        if match:
+            monitor_types = {'Simple': 'SIMPLE', 'SimpleBrowser': 'BROWSER', 'ScriptApi': 'SCRIPT_API',
+                             'ScriptBrowser': 'SCRIPT_BROWSER', 'CertCheck': 'CERT_CHECK',
+                             'BrokenLinks': 'BROKEN_LINKS', 'Step': 'STEP_MONITOR'}
+            account = self.stub.accounts[int(arguments['accountId'])]
+            monitor = arguments['monitor']
+            entity = self.stub.add_monitor(account, monitor['name'], monitor_types.get(match.group(1), 'SIMPLE'))
+            if 'script' in monitor:
+                account.scripts[entity['guid']] = monitor['script']
+            return {'monitor': {'guid': entity['guid'], 'name': entity['name']}, 'errors': []}
+        match = re.match(r'alertsNrqlCondition(Static|Baseline|Outlier)Create$', name)
+        if match:
+            account = self.stub.accounts[int(arguments['accountId'])]
+            condition = self.stub.add_nrql_condition(account, arguments['policyId'], match.group(1).upper(),
+                                                     arguments['condition'])
+            return {'id': condition['id']}
+        self.unhandled('NerdGraph mutation ' + name)
+        return None
+
+
+def cursor_of(query, variables):
+    match = re.search(r'cursor:\s*"([^"]*)"', query)
+    return match.group(1) if match else variables.get('cursor')
+
+
+def alerts_data(alerts):
+    return {'data': {'actor': {'account': {'alerts': alerts}}}}
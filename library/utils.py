@@ -6,7 +6,7 @@ import library.clients.entityclient as ec
 import library.localstore as store
 import logging
 import json
-import requests
+import library.clients.httpclient as httpclient
 import configparser
 import argparse
 
@@ -61,7 +61,7 @@ def get_paginated_entities(api_key, fetch_url, entity_key, params={}, pageType=N
         req_headers = setup_headers(api_key)
         if 'infra-api' in curr_fetch_url:
             req_headers = setup_infra_headers(api_key)
-        resp = requests.get(curr_fetch_url, headers=setup_headers(api_key), params=params)
+        resp = httpclient.get(curr_fetch_url, headers=setup_headers(api_key), params=params)
         if resp.status_code == 200:
             logger.info(resp.text)
             resp_json = json.loads(resp.text)
@@ -82,6 +82,7 @@ def get_paginated_entities(api_key, fetch_url, entity_key, params={}, pageType=N
         else:
             another_page = False
             error = True
+            all_entities['error'] = resp.text
             logger.error(
                 'ERROR - Get API call to retrieve ' + entity_key + ' failed!  Response code: ' + str(
                     resp.status_code))
@@ -1,6 +1,5 @@
 import argparse
 import os
-import time
 
 import deleteallmonitors as deleter
 import fetchchannels as fetchchannels
@@ -8,11 +7,13 @@ import fetchentities as fetchentities
 import fetchmonitors as fetchmonitors
 import fetchnotifications as fetchnotifications
 import fetchworkflows as fetchworkflows
+import library.checkpoint as checkpoint
 import library.clients.alertsclient as ac
 import library.clients.entityclient as ec
 import library.clients.notificationsclient as nc
 import library.clients.workflowsclient as wc
 import library.migrationlogger as m_logger
+import library.scheduler as scheduler
 import library.securecredentials as sec_credentials
 import library.utils as utils
 import migrate_apm as mapm
@@ -43,6 +44,8 @@ APP_FILE = 'output/{}_apm.csv'.format(SRC_ACCT)
 src_mon_time_stamp = ''  # will be updated by fetch step
 ACCOUNT_MAPPING_FILE = None  # Map account ids to alternatives using a dictionary in a [JSON file](account_mapping.json). Useful when moving between regions, e.g. from the us to eu region.
 COND_TYPES = mc.ALL_CONDITIONS
+STAGE_WORKERS = 6  # Number of independent migration stages run at the same time, 1 runs them one after the other
+NOTIFICATION_WORKERS = 10  # Number of notification destinations, channels and workflows created in parallel
 
 logger = m_logger.get_logger(os.path.basename(__file__))
 
@@ -51,16 +54,12 @@ def cleanup():
     logger.info('Cleaning up test target account')
     logger.info('Deleting all monitors')
     deleter.delete_all_monitors(TGT_API_KEY, TGT_ACCT, TGT_REGION)
-    time.sleep(1)
     logger.info('Deleting all secure credentials')
     sec_credentials.delete_all(TGT_API_KEY, TGT_ACCT, TGT_REGION)
-    time.sleep(1)
     logger.info('Deleting all alert policies')
     ac.delete_all_policies(TGT_API_KEY, TGT_ACCT, TGT_REGION)
-    time.sleep(1)
     logger.info('Deleting all alert channels')
     ac.delete_all_channels(TGT_API_KEY, TGT_ACCT, TGT_REGION)
-    time.sleep(1)
     # reset_app()
     logger.info('deleting all target dashboards')
     ec.delete_all_dashboards(TGT_API_KEY, TGT_ACCT, TGT_REGION)
@@ -77,46 +76,80 @@ def cleanup():
 
 def fetch():
     global src_mon_time_stamp
+    completed = checkpoint.current()
+    if completed.done(checkpoint.STEP, 'fetch'):
+        src_mon_time_stamp = completed.target(checkpoint.STEP, 'fetch')
+        logger.info(f'Fetch already completed in this run, using fetched monitors: {src_mon_time_stamp}')
+        return
     logger.info('Fetching')
-    src_mon_time_stamp = fetchmonitors.fetch_monitors(SRC_API_KEY, SRC_ACCT, SRC_MON_LIST_FILE, SRC_INSIGHTS_KEY, SRC_REGION)
-    logger.info(f'Timestamp for fetched monitors: {src_mon_time_stamp}')
-    logger.info('Fetching alert channels for policies')
-    store_policies.store_alert_policies(SRC_ACCT, SRC_API_KEY, SRC_REGION)
+    # the fetches are independent of each other
+    stages = scheduler.Scheduler(STAGE_WORKERS, skip_failed=True)
+    stages.add('monitors', lambda: fetchmonitors.fetch_monitors(SRC_API_KEY, SRC_ACCT, SRC_MON_LIST_FILE, SRC_INSIGHTS_KEY, SRC_REGION))
+    stages.add('policies', lambda: store_policies.store_alert_policies(SRC_ACCT, SRC_API_KEY, SRC_REGION))
     # Fetch legacy channels is redundant, as migrate_policies will retrieve the channels, but it does create the alert_channels.json for review
-    fetchchannels.fetch_alert_channels(SRC_API_KEY, SRC_ACCT, SRC_REGION)
-    fetchentities.fetch_entities(SRC_ACCT, SRC_API_KEY, [ec.DASHBOARD], '{}_dashboards.csv'.format(SRC_ACCT), tag_name=None, tag_value=None, src_region=SRC_REGION, assessment=None)
-    fetchentities.fetch_entities(SRC_ACCT, SRC_API_KEY, [ec.APM_APP], '{}_apm.csv'.format(SRC_ACCT), tag_name=None, tag_value=None, src_region=SRC_REGION, assessment=None)
+    stages.add('channels', lambda: fetchchannels.fetch_alert_channels(SRC_API_KEY, SRC_ACCT, SRC_REGION))
+    stages.add('dashboards', lambda: fetchentities.fetch_entities(SRC_ACCT, SRC_API_KEY, [ec.DASHBOARD], '{}_dashboards.csv'.format(SRC_ACCT), tag_name=None, tag_value=None, src_region=SRC_REGION, assessment=None))
+    stages.add('apm', lambda: fetchentities.fetch_entities(SRC_ACCT, SRC_API_KEY, [ec.APM_APP], '{}_apm.csv'.format(SRC_ACCT), tag_name=None, tag_value=None, src_region=SRC_REGION, assessment=None))
+    run_stages(stages, 'fetch')
+    src_mon_time_stamp = stages.result('monitors')
+    logger.info(f'Timestamp for fetched monitors: {src_mon_time_stamp}')
+    completed.record(checkpoint.STEP, 'fetch', src_mon_time_stamp)
 
 
 def migrate_step1():
-    logger.info('migrating monitors')
-    mm.migrate_monitors('output/' + SRC_MON_LIST_FILE, SRC_ACCT, SRC_REGION, SRC_API_KEY, src_mon_time_stamp, TGT_ACCT, TGT_REGION, TGT_API_KEY)
+    completed = checkpoint.current()
+    if not completed.done(checkpoint.STEP, 'monitors'):
+        logger.info('migrating monitors')
+        mm.migrate_monitors('output/' + SRC_MON_LIST_FILE, SRC_ACCT, SRC_REGION, SRC_API_KEY, src_mon_time_stamp, TGT_ACCT, TGT_REGION, TGT_API_KEY)
+        completed.record(checkpoint.STEP, 'monitors')
     # Migrate Synthetic monitor entity tags
     mt.migrate_tags('output/' + SRC_MON_LIST_FILE, SRC_ACCT, SRC_REGION, SRC_API_KEY, TGT_ACCT, TGT_REGION, TGT_API_KEY, [ec.SYNTH_MONITOR])
 
 
+def migrate_apm():
+    if not checkpoint.current().done(checkpoint.STEP, 'apm'):
+        mapm.migrate_apps(APP_FILE, SRC_ACCT, SRC_API_KEY, SRC_REGION, TGT_ACCT, TGT_API_KEY, TGT_REGION)
+        checkpoint.current().record(checkpoint.STEP, 'apm')
+
+
+# Each stage starts once the stages it depends on are done, the others run concurrently:
+# conditions and notifications need the target policies, workflows need the policies and channels
+# (migrate_notifications orders channels and workflows itself), APM settings, dashboards and APM tags
+# need nothing from alerts
 def migrate_step2():
+    stages = scheduler.Scheduler(STAGE_WORKERS, skip_failed=True)
     # Migrate alert policies
-    policies_by_source_id = mp.migrate(POLICY_NAME_FILE, ENTITY_NAME_FILE, SRC_ACCT, SRC_REGION, TGT_ACCT, TGT_REGION, SRC_API_KEY, TGT_API_KEY, USE_LOCAL)
+    stages.add('policies', lambda: mp.migrate(POLICY_NAME_FILE, ENTITY_NAME_FILE, SRC_ACCT, SRC_REGION, TGT_ACCT, TGT_REGION, SRC_API_KEY, TGT_API_KEY, USE_LOCAL))
     # Migrate alert conditions
-    mc.migrate(POLICY_NAME_FILE, ENTITY_NAME_FILE, SRC_ACCT, SRC_REGION, TGT_ACCT, TGT_REGION, SRC_API_KEY, TGT_API_KEY, COND_TYPES, USE_LOCAL, MATCH_SOURCE_CONDITION_STATE)
-    # Migrate notification destinations
-    destinations_by_source_id = mn.migrate_destinations(SRC_ACCT, SRC_API_KEY, SRC_REGION, TGT_ACCT, TGT_API_KEY, TGT_REGION)
-    # Migrate notification channels
-    channels_by_source_id = mn.migrate_channels(SRC_ACCT, SRC_API_KEY, SRC_REGION, TGT_ACCT, TGT_API_KEY, TGT_REGION, destinations_by_source_id)
-    # Migrate workflows 
-    workflows_by_source_id = mn.migrate_workflows(SRC_ACCT, SRC_API_KEY, SRC_REGION, TGT_ACCT, TGT_API_KEY, TGT_REGION, channels_by_source_id, policies_by_source_id)
+    stages.add('conditions', lambda: mc.migrate(POLICY_NAME_FILE, ENTITY_NAME_FILE, SRC_ACCT, SRC_REGION, TGT_ACCT, TGT_REGION, SRC_API_KEY, TGT_API_KEY, COND_TYPES, USE_LOCAL, MATCH_SOURCE_CONDITION_STATE),
+               ['policies'])
+    # Migrate notification destinations, channels and workflows
+    stages.add('notifications', lambda: mn.migrate_notifications(SRC_ACCT, SRC_API_KEY, SRC_REGION, TGT_ACCT, TGT_API_KEY, TGT_REGION, stages.result('policies'), NOTIFICATION_WORKERS),
+               ['policies'])
     # Migrate APM app_apdex_threshold, end_user_apdex_threshold, and enable_real_user_monitoring settings
-    mapm.migrate_apps(APP_FILE, SRC_ACCT, SRC_API_KEY, SRC_REGION, TGT_ACCT, TGT_API_KEY, TGT_REGION)
+    stages.add('apm', migrate_apm)
     # Migrate dashboards
-    md.migrate_dashboards(DASHBOARDS_LIST_FILE, int(SRC_ACCT), SRC_API_KEY, SRC_REGION, int(TGT_ACCT), TGT_API_KEY, TGT_REGION, ACCOUNT_MAPPING_FILE)
+    stages.add('dashboards', lambda: md.migrate_dashboards(DASHBOARDS_LIST_FILE, int(SRC_ACCT), SRC_API_KEY, SRC_REGION, int(TGT_ACCT), TGT_API_KEY, TGT_REGION, ACCOUNT_MAPPING_FILE))
     # Migrate APM entity tags
-    mt.migrate_tags(APP_FILE, SRC_ACCT, SRC_REGION, SRC_API_KEY, TGT_ACCT, TGT_REGION, TGT_API_KEY, [ec.APM_APP])
+    stages.add('apm_tags', lambda: mt.migrate_tags(APP_FILE, SRC_ACCT, SRC_REGION, SRC_API_KEY, TGT_ACCT, TGT_REGION, TGT_API_KEY, [ec.APM_APP]))
+    run_stages(stages, 'step2')
+
+
+# Runs the stages, logs their timing breakdown and critical path, and stops the migration if any failed
+def run_stages(stages, name):
+    results = stages.run()
+    stages.log_timings()
+    failed = [stage for stage, status in results.items() if 'error' in status]
+    if failed:
+        utils.error_message_and_exit(f'Stages {failed} of {name} failed, fix the errors and run again with --resume')
 
 
-def main(run_step2_only, run_cleanup):
+def main(run_step2_only, run_cleanup, resume_run_id=None):
+    if run_cleanup and resume_run_id:
+        utils.error_message_and_exit('--cleanup cannot be used with --resume, it deletes what the run has migrated')
     if run_cleanup:
         cleanup()
+    checkpoint.start(SRC_ACCT, resume_run_id)
     if run_step2_only:
         migrate_step2()
     else:
@@ -129,6 +162,7 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Migration script')
     parser.add_argument('--step2', action='store_true', help='Run only migrate_step2')
     parser.add_argument('--cleanup', action='store_true', help='Run cleanup before other steps')
+    parser.add_argument('--resume', type=str, metavar='RUN_ID', help='Resume an earlier run, skipping the objects it completed')
     args = parser.parse_args()
 
-    main(args.step2, args.cleanup)
+    main(args.step2, args.cleanup, args.resume)
@@ -3,9 +3,11 @@ import argparse
 import json
 import library.utils as utils
 import library.migrationlogger as m_logger
+import library.checkpoint as checkpoint
 import library.localstore as store
 import library.clients.entityclient as ec
 import library.status.dashboard_status as ds
+from concurrent.futures import ThreadPoolExecutor
 
 
 log = m_logger.get_logger(os.path.basename(__file__))
@@ -21,6 +23,8 @@ def print_args(args, src_api_key, src_region, tgt_api_key, tgt_region):
     log.info("targetRegion : " + tgt_region)
     if args.accountMappingFile:
         log.info("Using accountMappingFile : " + args.accountMappingFile[0])
+    if args.workers:
+        log.info("Using workers : " + str(args.workers[0]))
 
 
 def configure_parser():
@@ -36,21 +40,24 @@ def configure_parser():
                                                                     or set environment variable ENV_TARGET_API_KEY')
     parser.add_argument('--targetRegion', type=str, nargs=1, required=False, help='targetRegion us(default) or eu')
     parser.add_argument('--accountMappingFile', nargs=1, required=False, help='Map account IDs to alternatives using a dictionary in a json file')
+    parser.add_argument('--workers', nargs=1, type=int, required=False, help='Number of dashboards to migrate in parallel (default 1)')
     return parser
 
 
+# Dashboards are looked up by name in the account's DASHBOARD entities, fetched once by the EntityResolver
 def get_dashboard(per_api_key, name, all_db_status, acct_id, *, get_widgets=False, region='us'):
-    result = ec.get_dashboard_definition(per_api_key, name, acct_id, region)
-    if not result:
+    match = ec.entity_resolver(per_api_key, acct_id, region).match_by_name(ec.DASHBOARD, name)
+    if not match['entityFound']:
         all_db_status[name][ds.DASHBOARD_FOUND] = False
         return None
+    result = match['entity']
     all_db_status[name][ds.DASHBOARD_FOUND] = True
     if not get_widgets:
         return result
     widgets_result = ec.get_dashboard_widgets(per_api_key, result['guid'], region)
     if 'error' in widgets_result:
-        all_db_status[name][ds.ERROR] = result['error']
-        log.error('Error fetching dashboard widgets' + name + '  ' + result['error'])
+        all_db_status[name][ds.ERROR] = widgets_result['error']
+        log.error('Error fetching dashboard widgets ' + name + '  ' + str(widgets_result['error']))
         return None
     if not widgets_result['entityFound']:
         all_db_status[name][ds.WIDGETS_FOUND] = False
@@ -59,6 +66,18 @@ def get_dashboard(per_api_key, name, all_db_status, acct_id, *, get_widgets=Fals
     return widgets_result['entity']
 
 
+# The account mapping file maps account ids as strings, compiled once to int keys and values
+def compile_account_mappings(account_mappings):
+    return {int(src_acct_id): int(tgt_acct_id) for src_acct_id, tgt_acct_id in account_mappings.items()}
+
+
+def load_account_mappings(account_mapping_file):
+    with open(account_mapping_file, 'r') as mapping_file:
+        data = mapping_file.read()
+    return compile_account_mappings(json.loads(data))
+
+
+# account_mappings is the int to int dict returned by compile_account_mappings
 def update_nrql_account_ids(src_acct_id, tgt_acct_id, entity, account_mappings=None):
     if not 'pages' in entity:
         return
@@ -71,8 +90,8 @@ def update_nrql_account_ids(src_acct_id, tgt_acct_id, entity, account_mappings=N
             if 'accountId' in widget['rawConfiguration']:
                 if account_mappings:
                     # Use account mappings (if available), keeps existing account if the account is not in the mapping dict
-                    mapped_account = account_mappings.get(str(widget['rawConfiguration']['accountId']), widget['rawConfiguration']['accountId'])
-                    widget['rawConfiguration']['accountId'] = int(mapped_account)
+                    account_id = int(widget['rawConfiguration']['accountId'])
+                    widget['rawConfiguration']['accountId'] = account_mappings.get(account_id, account_id)
                 continue
             if not 'nrqlQueries' in widget['rawConfiguration']:
                 continue
@@ -80,52 +99,82 @@ def update_nrql_account_ids(src_acct_id, tgt_acct_id, entity, account_mappings=N
                 if 'accountId' in query:
                     if account_mappings:
                         # Use account mappings (if available), defaults to tgt_acct_id if the account is not present in the mapping dict
-                        mapped_account = account_mappings.get(str(query['accountId']), tgt_acct_id)
-                        query['accountId'] = int(mapped_account)
+                        query['accountId'] = account_mappings.get(int(query['accountId']), tgt_acct_id)
                     elif query['accountId'] == src_acct_id:
                         query['accountId'] = tgt_acct_id
                 if 'accountIds' in query:
                     for index, accountId in enumerate(query['accountIds']):
                         if account_mappings:
                             # Use account mappings (if available), defaults to tgt_acct_id if the account is not present in the mapping dict
-                            mapped_account = account_mappings.get(str(accountId), tgt_acct_id)
-                            query['accountIds'][index] = int(mapped_account)
+                            query['accountIds'][index] = account_mappings.get(int(accountId), tgt_acct_id)
                         elif accountId == src_acct_id:
                             query['accountIds'][index] = tgt_acct_id
 
 
-def migrate_dashboards(from_file, src_acct, src_api_key, src_region, tgt_acct, tgt_api_key, tgt_region, account_mapping_file=None):
+def migrate_dashboard(db_name, src_acct, src_api_key, src_region, tgt_acct, tgt_api_key, tgt_region,
+                      account_mappings=None):
+    all_db_status = {db_name: {}}
+    completed = checkpoint.current()
+    tgt_guid = completed.target(checkpoint.DASHBOARD, db_name)
+    if tgt_guid is not None:
+        log.info('Dashboard already migrated in this run : ' + db_name)
+        all_db_status[db_name][ds.TARGET_EXISTED] = True
+        all_db_status[db_name][ds.TARGET_DASHBOARD] = tgt_guid
+        return all_db_status
+    tgt_dashboard = get_dashboard(tgt_api_key, db_name, all_db_status, tgt_acct,
+                                  get_widgets=False, region=tgt_region)
+    if tgt_dashboard is not None:
+        log.warning('Dashboard already exists in target skipping : ' + db_name)
+        all_db_status[db_name][ds.TARGET_EXISTED] = True
+        completed.record(checkpoint.DASHBOARD, db_name, tgt_dashboard['guid'])
+        return all_db_status
+    all_db_status[db_name][ds.TARGET_EXISTED] = False
+    src_dashboard = get_dashboard(src_api_key, db_name, all_db_status, src_acct, get_widgets=True, region=src_region)
+    if src_dashboard is None:
+        return all_db_status
+    log.info('Found source dashboard ' + db_name)
+    tgt_dashboard = src_dashboard
+    del tgt_dashboard['guid']
+    update_nrql_account_ids(src_acct, tgt_acct, tgt_dashboard, account_mappings)
+    result = ec.post_dashboard(tgt_api_key, tgt_dashboard, tgt_acct, tgt_region)
+    all_db_status[db_name][ds.STATUS] = result['status']
+    if 'entityCreated' in result:
+        log.info('Created target dashboard ' + db_name)
+        all_db_status[db_name][ds.DASHBOARD_CREATED] = True
+        all_db_status[db_name][ds.TARGET_DASHBOARD] = result['entity']['guid']
+        completed.record(checkpoint.DASHBOARD, db_name, result['entity']['guid'])
+    return all_db_status
+
+
+# Each dashboard is migrated into its own status dict, these are merged in db_names order
+# so the status CSV is the same whether or not workers are used
+def migrate_dashboards(from_file, src_acct, src_api_key, src_region, tgt_acct, tgt_api_key, tgt_region,
+                       account_mapping_file=None, workers=1):
     log.info('Dashboard migration started.')
     account_mappings = None
     if account_mapping_file:
-        # reading the data from the file
-        with open(account_mapping_file, 'r') as mapping_file:
-            data = mapping_file.read()
-        account_mappings = json.loads(data)
+        account_mappings = load_account_mappings(account_mapping_file)
     db_names = store.load_names(from_file)
+    # one DASHBOARD entity search for each account answers every name lookup below
+    ec.prefetch_entities([ec.entity_resolver(tgt_api_key, tgt_acct, tgt_region),
+                          ec.entity_resolver(src_api_key, src_acct, src_region)], [ec.DASHBOARD])
     all_db_status = {}
-    for db_name in db_names:
-        all_db_status[db_name] = {}
-        tgt_dashboard = get_dashboard(tgt_api_key, db_name, all_db_status, tgt_acct,
-                                      get_widgets=False, region=tgt_region)
-        if tgt_dashboard is not None:
-            log.warning('Dashboard already exists in target skipping : ' + db_name)
-            all_db_status[db_name][ds.TARGET_EXISTED] = True
-            continue
-        all_db_status[db_name][ds.TARGET_EXISTED] = False
-        src_dashboard = get_dashboard(src_api_key, db_name, all_db_status, src_acct, get_widgets=True, region=src_region)
-        if src_dashboard is None:
-            continue
-        log.info('Found source dashboard ' + db_name)
-        tgt_dashboard = src_dashboard
-        del tgt_dashboard['guid']
-        update_nrql_account_ids(src_acct, tgt_acct, tgt_dashboard, account_mappings)
-        result = ec.post_dashboard(tgt_api_key, tgt_dashboard, tgt_acct, tgt_region)
-        all_db_status[db_name][ds.STATUS] = result['status']
-        if 'entityCreated' in result:
-            log.info('Created target dashboard ' + db_name)
-            all_db_status[db_name][ds.DASHBOARD_CREATED] = True
-            all_db_status[db_name][ds.TARGET_DASHBOARD] = result['entity']['guid']
+    if workers <= 1:
+        for db_name in db_names:
+            all_db_status.update(migrate_dashboard(db_name, src_acct, src_api_key, src_region, tgt_acct,
+                                                   tgt_api_key, tgt_region, account_mappings))
+    else:
+        log.info('Migrating %d dashboards using %d workers' % (len(db_names), workers))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(migrate_dashboard, db_name, src_acct, src_api_key, src_region, tgt_acct,
+                                       tgt_api_key, tgt_region, account_mappings)
+                       for db_name in db_names]
+            for db_name, future in zip(db_names, futures):
+                try:
+                    all_db_status.update(future.result())
+                except Exception as e:
+                    log.error('Error migrating dashboard ' + db_name + ' : ' + str(e))
+                    all_db_status[db_name] = {ds.ERROR: str(e)}
     db_status_file = str(src_acct) + '_' + utils.file_name_from(from_file) + '_dashboards_' + str(tgt_acct) + '.csv'
     store.save_status_csv(db_status_file, all_db_status, ds)
     log.info('Dashboard migration complete.')
@@ -144,8 +193,9 @@ def main():
     tgt_region = utils.ensure_target_region(args)
     print_args(args, src_api_key, src_region, tgt_api_key, tgt_region)
     account_mapping_file = args.accountMappingFile[0] if args.accountMappingFile else None
+    workers = args.workers[0] if args.workers else 1
     migrate_dashboards(args.fromFile[0], args.sourceAccount[0], src_api_key, src_region, args.targetAccount[0],
-                       tgt_api_key, tgt_region, account_mapping_file)
+                       tgt_api_key, tgt_region, account_mapping_file, workers)
 
 
 if __name__ == '__main__':
@@ -1,10 +1,14 @@
 import os
 import argparse
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 import fetchnotifications as fetchnotifications
 import fetchworkflows as fetchworkflows
+import library.checkpoint as checkpoint
 import library.clients.notificationsclient as notificationsclient
 import library.clients.workflowsclient as workflowsclient
 import library.localstore as store
+import library.scheduler as scheduler
 import library.migrationlogger as m_logger
 import library.utils as utils
 
@@ -12,6 +16,9 @@ import library.utils as utils
 log = m_logger.get_logger(os.path.basename(__file__))
 nc = notificationsclient.NotificationsClient()
 wc = workflowsclient.WorkflowsClient()
+DESTINATION = 'destination'
+CHANNEL = 'channel'
+WORKFLOW = 'workflow'
 
 
 def print_args(args, src_api_key, src_region, tgt_api_key, tgt_region):
@@ -21,6 +28,7 @@ def print_args(args, src_api_key, src_region, tgt_api_key, tgt_region):
     log.info("Using targetAccount : " + str(args.targetAccount[0]))
     log.info("Using targetApiKey : " + len(tgt_api_key[:-4]) * "*" + tgt_api_key[-4:])
     log.info("targetRegion : " + tgt_region)
+    log.info("Using workers : " + str(args.workers[0]))
 
 
 def configure_parser():
@@ -33,6 +41,8 @@ def configure_parser():
     parser.add_argument('--targetApiKey', nargs=1, type=str, required=True, help='Target API Key, \
                                                                     or set environment variable ENV_TARGET_API_KEY')
     parser.add_argument('--targetRegion', type=str, nargs=1, required=False, help='targetRegion us(default) or eu')
+    parser.add_argument('--workers', type=int, nargs=1, required=False, default=[scheduler.DEFAULT_WORKERS],
+                        help='Number of destinations, channels and workflows to create in parallel')
     # parser.add_argument('--destinations', dest='destinations', required=False, action='store_true', help='Migrate destinations')
     # parser.add_argument('--channels', dest='channels', required=False, action='store_true', help='Migrate channels')
     return parser
@@ -62,101 +72,178 @@ def create_workflow(workflow, tgt_acct, tgt_api_key, tgt_region):
     log.info(f"Created workflow: {workflow['name']}")
 
 
+def migrate_destination(destination, tgt_acct, tgt_api_key, tgt_region):
+    log.info(f"Destination name: {destination['name']}")
+    completed = checkpoint.current()
+    target_destination_id = completed.target(checkpoint.DESTINATION, destination['id'])
+    if target_destination_id is not None:
+        log.info(f"Destination already migrated in this run with id: {target_destination_id}")
+        destination['targetDestinationId'] = target_destination_id
+        return
+    create_destination(destination, tgt_acct, tgt_api_key, tgt_region)
+    if 'targetDestinationId' in destination:
+        completed.record(checkpoint.DESTINATION, destination['id'], destination['targetDestinationId'])
+
+
 def migrate_destinations(src_acct, src_api_key, src_region, tgt_acct, tgt_api_key, tgt_region):
     log.info('Destinations migration started.')
     destinations_by_source_id = fetchnotifications.fetch_destinations(src_api_key, src_acct, src_region)
     for destination in destinations_by_source_id.values():
-        log.info(f"Destination name: {destination['name']}")
-        create_destination(destination, tgt_acct, tgt_api_key, tgt_region)
+        migrate_destination(destination, tgt_acct, tgt_api_key, tgt_region)
     log.info('Destinations migration complete.')
     return destinations_by_source_id
 
 
+def migrate_channel(channel, tgt_acct, tgt_api_key, tgt_region, destinations_by_source_id):
+    log.info(f"Channel name: {channel['name']}")
+    completed = checkpoint.current()
+    target_channel_id = completed.target(checkpoint.CHANNEL, channel['id'])
+    if target_channel_id is not None:
+        log.info(f"Channel already migrated in this run with id: {target_channel_id}")
+        channel['targetChannelId'] = target_channel_id
+        return
+    log.info(f"Mutating destination id for target account: {tgt_acct}")
+    source_destination_id = channel['destinationId']
+    if source_destination_id in destinations_by_source_id:
+        if 'targetDestinationId' in destinations_by_source_id.get(source_destination_id):
+            # Mutate channel destinationId, replacing destinationId with targetDestinationId
+            channel['destinationId'] = destinations_by_source_id.get(source_destination_id)['targetDestinationId']
+            log.info(f"Substituting destination id: {source_destination_id} with id: {(channel['destinationId'])}")
+            create_channel(channel, tgt_acct, tgt_api_key, tgt_region)
+            if 'targetChannelId' in channel:
+                completed.record(checkpoint.CHANNEL, channel['id'], channel['targetChannelId'])
+        else:
+            log.error(f"Unable to create channel name: {channel['name']}, with source channel id: {channel['id']} and type: {channel['type']}. Target destination id unavailable for source destination: {source_destination_id}")
+
+
 def migrate_channels(src_acct, src_api_key, src_region, tgt_acct, tgt_api_key, tgt_region, destinations_by_source_id):
     log.info('Channels migration started.')
     channels_by_source_id = fetchnotifications.fetch_channels(src_api_key, src_acct, src_region)
     for channel in channels_by_source_id.values():
-        log.info(f"Channel name: {channel['name']}")
-        log.info(f"Mutating destination id for target account: {tgt_acct}")
-        source_destination_id = channel['destinationId']
-        if source_destination_id in destinations_by_source_id:
-            if 'targetDestinationId' in destinations_by_source_id.get(source_destination_id):
-                # Mutate channel destinationId, replacing destinationId with targetDestinationId
-                channel['destinationId'] = destinations_by_source_id.get(source_destination_id)['targetDestinationId']
-                log.info(f"Substituting destination id: {source_destination_id} with id: {(channel['destinationId'])}")
-                create_channel(channel, tgt_acct, tgt_api_key, tgt_region)
-            else:
-                log.error(f"Unable to create channel name: {channel['name']}, with source channel id: {channel['id']} and type: {channel['type']}. Target destination id unavailable for source destination: {source_destination_id}")                
+        migrate_channel(channel, tgt_acct, tgt_api_key, tgt_region, destinations_by_source_id)
     log.info('Channels migration complete.')
     return channels_by_source_id
 
 
-def migrate_workflows(src_acct, src_api_key, src_region, tgt_acct, tgt_api_key, tgt_region, channels_by_source_id, policies_by_source_id):
-    log.info('Workflows migration started.')
-    workflows_by_source_id = fetchworkflows.fetch_workflows(src_api_key, src_acct, src_region)
-    for workflow in workflows_by_source_id.values():
-        hasError = False
-        log.info(f"Workflow name: {workflow['name']}")
-        # Enrich destinationConfigurations with target channel ids
-        log.info(f"Enriching destination configurations for target account: {tgt_acct}")
-        if 'destinationConfigurations' in workflow:
-            # Splice workflow['destinationConfigurations'] to contain only supported destinations
-            workflow['destinationConfigurations'][:] = [destination_configuration for destination_configuration in workflow['destinationConfigurations'] if destination_configuration['type'] in notificationsclient.SUPPORTED_DESTINATIONS]
-            if len(workflow['destinationConfigurations']) < 1:
-                log.warning(f"Workflow name: {workflow['name']} does not contain a supported destination")
-                continue
-            for destination_configuration in workflow['destinationConfigurations']:
-                if 'channelId' in destination_configuration:
-                    source_channel_id = destination_configuration['channelId']
-                    if source_channel_id in channels_by_source_id:
-                        channel = channels_by_source_id.get(source_channel_id)
-                        if 'targetChannelId' in channel:
-                            destination_configuration['targetChannelId'] = channel['targetChannelId']
-                            log.info(f"Target channel id: {destination_configuration['targetChannelId']} found for source channel id: {source_channel_id}")
-                        else:
-                            hasError = True
-                            log.error(f"Unable to create workflow name: {workflow['name']}. Target channel id unavailable for source channel id: {source_channel_id} with type: {channel['type']}")
+def migrate_workflow(workflow, tgt_acct, tgt_api_key, tgt_region, channels_by_source_id, policies_by_source_id):
+    hasError = False
+    log.info(f"Workflow name: {workflow['name']}")
+    completed = checkpoint.current()
+    target_workflow_id = completed.target(checkpoint.WORKFLOW, workflow['id'])
+    if target_workflow_id is not None:
+        log.info(f"Workflow already migrated in this run with id: {target_workflow_id}")
+        workflow['targetWorkflowId'] = target_workflow_id
+        return
+    # Enrich destinationConfigurations with target channel ids
+    log.info(f"Enriching destination configurations for target account: {tgt_acct}")
+    if 'destinationConfigurations' in workflow:
+        # Splice workflow['destinationConfigurations'] to contain only supported destinations
+        workflow['destinationConfigurations'][:] = [destination_configuration for destination_configuration in workflow['destinationConfigurations'] if destination_configuration['type'] in notificationsclient.SUPPORTED_DESTINATIONS]
+        if len(workflow['destinationConfigurations']) < 1:
+            log.warning(f"Workflow name: {workflow['name']} does not contain a supported destination")
+            return
+        for destination_configuration in workflow['destinationConfigurations']:
+            if 'channelId' in destination_configuration:
+                source_channel_id = destination_configuration['channelId']
+                if source_channel_id in channels_by_source_id:
+                    channel = channels_by_source_id.get(source_channel_id)
+                    if 'targetChannelId' in channel:
+                        destination_configuration['targetChannelId'] = channel['targetChannelId']
+                        log.info(f"Target channel id: {destination_configuration['targetChannelId']} found for source channel id: {source_channel_id}")
                     else:
                         hasError = True
-                        log.error(f"Unable to create workflow name: {workflow['name']}. Source channel id: {source_channel_id} unavailable")
-        else:
-            hasError = True
-            log.info(f"Workflow name: {workflow['name']} with id: {workflow['id']} has no destinationConfigurations: {workflow}")
-        # Enrich issuesFilter with target account id and source policy ids
-        log.info(f"Enriching issues filter for target account: {tgt_acct}")
-        if "issuesFilter" in workflow:
-            workflow['issuesFilter']['targetAccountId'] = int(tgt_acct)
-            for predicate in workflow['issuesFilter']['predicates']:
-                if predicate['attribute'] == 'labels.policyIds':
-                    targetValues = []
-                    for source_policy_id in predicate['values']:
-                        if int(source_policy_id) in policies_by_source_id:
-                            policy = policies_by_source_id.get(int(source_policy_id))
-                            if 'targetPolicyId' in policy:
-                                targetValues.append(str(policy['targetPolicyId']))
-                                log.info(f"Target policy id: {str(policy['targetPolicyId'])} found for source policy id: {source_policy_id} ")
-                            else:
-                                hasError = True
-                                log.error(f"Unable to create workflow name: {workflow['name']}. Target policy id unavailable for source policy id: {source_policy_id}")
+                        log.error(f"Unable to create workflow name: {workflow['name']}. Target channel id unavailable for source channel id: {source_channel_id} with type: {channel['type']}")
+                else:
+                    hasError = True
+                    log.error(f"Unable to create workflow name: {workflow['name']}. Source channel id: {source_channel_id} unavailable")
+    else:
+        hasError = True
+        log.info(f"Workflow name: {workflow['name']} with id: {workflow['id']} has no destinationConfigurations: {workflow}")
+    # Enrich issuesFilter with target account id and source policy ids
+    log.info(f"Enriching issues filter for target account: {tgt_acct}")
+    if "issuesFilter" in workflow:
+        workflow['issuesFilter']['targetAccountId'] = int(tgt_acct)
+        for predicate in workflow['issuesFilter']['predicates']:
+            if predicate['attribute'] == 'labels.policyIds':
+                targetValues = []
+                for source_policy_id in predicate['values']:
+                    if int(source_policy_id) in policies_by_source_id:
+                        policy = policies_by_source_id.get(int(source_policy_id))
+                        if 'targetPolicyId' in policy:
+                            targetValues.append(str(policy['targetPolicyId']))
+                            log.info(f"Target policy id: {str(policy['targetPolicyId'])} found for source policy id: {source_policy_id} ")
                         else:
                             hasError = True
                             log.error(f"Unable to create workflow name: {workflow['name']}. Target policy id unavailable for source policy id: {source_policy_id}")
-                    if len(targetValues) > 0:
-                        predicate['targetValues'] = targetValues
-                else:
-                    log.debug(f"Ignoring predicate {predicate}")
-        else:
-            hasError = True
-            log.info(f"Workflow name: {workflow['name']} with id: {workflow['id']} has no issuesFilter: {workflow}")
-        # Create the workflow
-        if not hasError:
-            create_workflow(workflow, tgt_acct, tgt_api_key, tgt_region)
-        else:
-            log.error(f"Unable to create workflow name: {workflow['name']}, {workflow}")
+                    else:
+                        hasError = True
+                        log.error(f"Unable to create workflow name: {workflow['name']}. Target policy id unavailable for source policy id: {source_policy_id}")
+                if len(targetValues) > 0:
+                    predicate['targetValues'] = targetValues
+            else:
+                log.debug(f"Ignoring predicate {predicate}")
+    else:
+        hasError = True
+        log.info(f"Workflow name: {workflow['name']} with id: {workflow['id']} has no issuesFilter: {workflow}")
+    # Create the workflow
+    if not hasError:
+        create_workflow(workflow, tgt_acct, tgt_api_key, tgt_region)
+        if 'targetWorkflowId' in workflow:
+            completed.record(checkpoint.WORKFLOW, workflow['id'], workflow['targetWorkflowId'])
+    else:
+        log.error(f"Unable to create workflow name: {workflow['name']}, {workflow}")
+
+
+def migrate_workflows(src_acct, src_api_key, src_region, tgt_acct, tgt_api_key, tgt_region, channels_by_source_id, policies_by_source_id):
+    log.info('Workflows migration started.')
+    workflows_by_source_id = fetchworkflows.fetch_workflows(src_api_key, src_acct, src_region)
+    for workflow in workflows_by_source_id.values():
+        migrate_workflow(workflow, tgt_acct, tgt_api_key, tgt_region, channels_by_source_id, policies_by_source_id)
     log.info('Workflows migration complete.')
     return channels_by_source_id
 
 
+def workflow_channel_ids(workflow):
+    return [destination_configuration['channelId'] for destination_configuration
+            in workflow.get('destinationConfigurations', []) if 'channelId' in destination_configuration]
+
+
+# Destinations, channels and workflows as a single dependency graph: a channel is created as soon as its own
+# destination is, a workflow as soon as all of its channels are. Policies are mapped by migratepolicies before
+# this runs. Up to workers objects are created at a time. With workers=1 they are created one at a time in an
+# order that respects these dependencies, which is not the order of migrate_destinations, migrate_channels and
+# migrate_workflows one after the other: channels and workflows that wait on nothing can come first
+def migrate_notifications(src_acct, src_api_key, src_region, tgt_acct, tgt_api_key, tgt_region,
+                          policies_by_source_id, workers=scheduler.DEFAULT_WORKERS):
+    log.info('Notifications migration started.')
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        destinations_future = executor.submit(fetchnotifications.fetch_destinations, src_api_key, src_acct, src_region)
+        channels_future = executor.submit(fetchnotifications.fetch_channels, src_api_key, src_acct, src_region)
+        workflows_future = executor.submit(fetchworkflows.fetch_workflows, src_api_key, src_acct, src_region)
+    destinations_by_source_id = destinations_future.result()
+    channels_by_source_id = channels_future.result()
+    workflows_by_source_id = workflows_future.result()
+    tasks = scheduler.Scheduler(workers)
+    for destination_id, destination in destinations_by_source_id.items():
+        tasks.add((DESTINATION, destination_id),
+                  partial(migrate_destination, destination, tgt_acct, tgt_api_key, tgt_region))
+    for channel_id, channel in channels_by_source_id.items():
+        tasks.add((CHANNEL, channel_id),
+                  partial(migrate_channel, channel, tgt_acct, tgt_api_key, tgt_region, destinations_by_source_id),
+                  [(DESTINATION, channel['destinationId'])])
+    for workflow_id, workflow in workflows_by_source_id.items():
+        tasks.add((WORKFLOW, workflow_id),
+                  partial(migrate_workflow, workflow, tgt_acct, tgt_api_key, tgt_region, channels_by_source_id,
+                          policies_by_source_id),
+                  [(CHANNEL, channel_id) for channel_id in workflow_channel_ids(workflow)])
+    results = tasks.run()
+    failed = [key for key, status in results.items() if 'error' in status]
+    if failed:
+        log.error(f"Notifications migration failed for {failed}")
+    log.info('Notifications migration complete.')
+    return destinations_by_source_id, channels_by_source_id, workflows_by_source_id
+
+
 def get_policies_by_source_id(source_account):
     # Get policies by source id
     data = store.load_alert_policies(source_account)
@@ -182,12 +269,8 @@ def main():
     target_account = str(args.targetAccount[0])
     policies_by_source_id = get_policies_by_source_id(source_account)
     print_args(args, src_api_key, src_region, tgt_api_key, tgt_region)
-    # Migrate notification destinations
-    destinations_by_source_id = migrate_destinations(source_account, src_api_key, src_region, target_account, tgt_api_key, tgt_region)
-    # Migrate notification channels
-    channels_by_source_id = migrate_channels(source_account, src_api_key, src_region, target_account, tgt_api_key, tgt_region, destinations_by_source_id)
-    # Migrate workflows 
-    workflows_by_source_id = migrate_workflows(source_account, src_api_key, src_region, target_account, tgt_api_key, tgt_region, channels_by_source_id, policies_by_source_id)
+    # Migrate notification destinations, channels and workflows
+    migrate_notifications(source_account, src_api_key, src_region, target_account, tgt_api_key, tgt_region, policies_by_source_id, args.workers[0])
 
 
 if __name__ == '__main__':
@@ -2,8 +2,11 @@ import os
 import sys
 import argparse
 import configparser
+import library.checkpoint as checkpoint
 import library.localstore as store
+import library.AccountMonitors as account_monitors
 import library.clients.alertsclient as ac
+import library.clients.httpclient as httpclient
 import library.migrationlogger as logger
 import library.utils as utils
 import library.status.conditionstatus as cs
@@ -13,6 +16,7 @@ import library.migrator.app_conditions as ac_migrator
 import library.migrator.nrql_conditions as nrql_migrator
 import library.migrator.extsvc_conditions as extsvc_migrator
 import library.migrator.infra_conditions as infra_migrator
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
 
 logger = logger.get_logger(os.path.basename(__file__))
@@ -166,6 +170,24 @@ def configure_parser(
         action='store_true',
         help='Pass --all to migrate all conditions'
     )
+    parser.add_argument(
+        '--workers',
+        nargs=1,
+        type=int,
+        required=False,
+        help='Number of policies to migrate in parallel (default 1)',
+        dest='workers'
+    )
+    parser.add_argument(
+        '--rateLimit',
+        '--rate_limit',
+        nargs=1,
+        type=float,
+        required=False,
+        help='Maximum API requests per second for each API key and endpoint family, across all workers. '
+             'Families with a lower default rate keep it',
+        dest='rate_limit'
+    )
     return parser
 
 
@@ -196,44 +218,88 @@ def print_args(args, src_api_key, src_region, tgt_api_key, tgt_region):
         logger.info("Migrating conditions of type " + INFRA_CONDITIONS)
     if args.use_local:
         logger.info("Using local copy of alert policies and policy entity map")
+    if args.workers:
+        logger.info("Using workers : " + str(args.workers[0]))
+    if args.rate_limit:
+        logger.info("Using rateLimit : " + str(args.rate_limit[0]))
+
+
+def migrate_policy_conditions(policy_name, src_account_id, src_region, src_api_key,
+                              tgt_account_id, tgt_region, tgt_api_key, cond_types,
+                              match_source_status):
+    policy_alert_status = {policy_name: {}}
+    if checkpoint.current().done(checkpoint.CONDITIONS, policy_name):
+        logger.info('Conditions already migrated in this run for policy ' + policy_name)
+        return policy_alert_status
+    logger.info('Migrating conditions for policy ' + policy_name)
+    src_result = ac.policy_index(src_api_key, src_account_id, src_region).get(policy_name)
+    if not src_result['policyFound']:
+        logger.error("Skipping as policy not found in source account " + policy_name)
+        policy_alert_status[policy_name][cs.ERROR] = 'Policy not found in source account'
+        return policy_alert_status
+    src_policy = src_result['policy']
+    tgt_result = ac.policy_index(tgt_api_key, tgt_account_id, tgt_region).get(policy_name)
+    if not tgt_result['policyFound']:
+        logger.error("Skipping as policy not found in target account " + policy_name)
+        policy_alert_status[policy_name][cs.ERROR] = 'Policy not found in target account'
+        return policy_alert_status
+    tgt_policy = tgt_result['policy']
+    if SYNTHETICS in cond_types:
+        sc_migrator.migrate(policy_alert_status, policy_name, src_account_id, src_api_key, src_region, src_policy,
+                            tgt_account_id, tgt_api_key, tgt_region, tgt_policy, match_source_status)
+        lfc_migrator.migrate(policy_alert_status, policy_name, src_account_id, src_api_key, src_region,
+                             src_policy, tgt_account_id, tgt_api_key, tgt_region, tgt_policy, match_source_status)
+    if APP_CONDITIONS in cond_types:
+        ac_migrator.migrate(policy_alert_status, policy_name, src_api_key, src_region, src_policy,
+                            tgt_account_id, tgt_api_key, tgt_region, tgt_policy, match_source_status)
+    if NRQL_CONDITIONS in cond_types:
+        nrql_migrator.migrate(policy_alert_status, policy_name, src_account_id, src_api_key, src_region, src_policy,
+                              tgt_account_id, tgt_api_key, tgt_region, tgt_policy, match_source_status)
+    if EXT_SVC_CONDITIONS in cond_types:
+        extsvc_migrator.migrate(policy_alert_status, policy_name, src_api_key, src_region, src_policy,
+                                tgt_account_id, tgt_api_key, tgt_region, tgt_policy, match_source_status)
+    if INFRA_CONDITIONS in cond_types:
+        infra_migrator.migrate(policy_alert_status, policy_name, src_api_key, src_region, src_policy,
+                               tgt_account_id,  tgt_api_key, tgt_region, tgt_policy, match_source_status)
+    # policies with failed conditions are tried again when the run is resumed
+    if not any(cs.ERROR in condition_status for condition_status in policy_alert_status.values()):
+        checkpoint.current().record(checkpoint.CONDITIONS, policy_name, tgt_policy['id'])
+    return policy_alert_status
 
 
+# Each policy is migrated into its own status dict, these are merged in policy_names order
+# so the status CSV is the same whether or not workers are used
 def migrate_conditions(policy_names, src_account_id, src_region, src_api_key,
                        tgt_account_id, tgt_region, tgt_api_key, cond_types,
-                       match_source_status):
+                       match_source_status, workers=1, use_local=False):
     all_alert_status = {}
-    for policy_name in policy_names:
-        logger.info('Migrating conditions for policy ' + policy_name)
-        all_alert_status[policy_name] = {}
-        src_result = ac.get_policy(src_api_key, policy_name, src_region)
-        if not src_result['policyFound']:
-            logger.error("Skipping as policy not found in source account " + policy_name)
-            all_alert_status[policy_name][cs.ERROR] = 'Policy not found in source account'
-            continue
-        src_policy = src_result['policy']
-        tgt_result = ac.get_policy(tgt_api_key, policy_name, tgt_region)
-        if not tgt_result['policyFound']:
-            logger.error("Skipping as policy not found in target account " + policy_name)
-            all_alert_status[policy_name][cs.ERROR] = 'Policy not found in target account'
-            continue
-        tgt_policy = tgt_result['policy']
-        if SYNTHETICS in cond_types:
-            sc_migrator.migrate(all_alert_status, policy_name, src_api_key, src_region, src_policy,
-                                tgt_account_id, tgt_api_key, tgt_region, tgt_policy, match_source_status)
-            lfc_migrator.migrate(all_alert_status, policy_name, src_api_key, src_region, src_policy,
-                                 tgt_account_id, tgt_api_key, tgt_region, tgt_policy, match_source_status)
-        if APP_CONDITIONS in cond_types:
-            ac_migrator.migrate(all_alert_status, policy_name, src_api_key, src_region, src_policy,
-                                tgt_account_id, tgt_api_key, tgt_region, tgt_policy, match_source_status)
-        if NRQL_CONDITIONS in cond_types:
-            nrql_migrator.migrate(all_alert_status, policy_name, src_account_id, src_api_key, src_region, src_policy,
-                                  tgt_account_id, tgt_api_key, tgt_region, tgt_policy, match_source_status)
-        if EXT_SVC_CONDITIONS in cond_types:
-            extsvc_migrator.migrate(all_alert_status, policy_name, src_api_key, src_region, src_policy,
-                                    tgt_account_id, tgt_api_key, tgt_region, tgt_policy, match_source_status)
-        if INFRA_CONDITIONS in cond_types:
-            infra_migrator.migrate(all_alert_status, policy_name, src_api_key, src_region, src_policy,
-                                   tgt_account_id,  tgt_api_key, tgt_region, tgt_policy, match_source_status)
+    # load both policy indexes once, every policy below is then resolved without a REST lookup
+    ac.policy_index(src_api_key, src_account_id, src_region, use_local)
+    ac.policy_index(tgt_api_key, tgt_account_id, tgt_region, use_local)
+    if SYNTHETICS in cond_types:
+        # monitors of both accounts are listed once and shared by the synthetic and location failure conditions
+        account_monitors.account_monitors(src_api_key, src_account_id, src_region).load()
+        account_monitors.account_monitors(tgt_api_key, tgt_account_id, tgt_region).load()
+    if workers <= 1:
+        for policy_name in policy_names:
+            all_alert_status.update(
+                migrate_policy_conditions(policy_name, src_account_id, src_region, src_api_key,
+                                          tgt_account_id, tgt_region, tgt_api_key, cond_types,
+                                          match_source_status))
+        return all_alert_status
+    logger.info('Migrating conditions for %d policies using %d workers' % (len(policy_names), workers))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(migrate_policy_conditions, policy_name, src_account_id, src_region,
+                                   src_api_key, tgt_account_id, tgt_region, tgt_api_key, cond_types,
+                                   match_source_status)
+                   for policy_name in policy_names]
+        for policy_name, future in zip(policy_names, futures):
+            try:
+                all_alert_status.update(future.result())
+            except Exception as e:
+                logger.error('Error migrating conditions for policy ' + policy_name)
+                logger.error(e)
+                all_alert_status[policy_name] = {cs.ERROR: str(e)}
     return all_alert_status
 
 
@@ -313,7 +379,14 @@ def migrate(
     cond_types: List[str],
     use_local: bool = False,
     match_source_state: bool = False,
+    workers: int = 1,
+    rate_limit: float = None,
 ):
+    if workers > 1:
+        httpclient.configure(pool_maxsize=max(workers, httpclient.POOL_MAXSIZE))
+    if rate_limit:
+        httpclient.set_rate_limit(rate_limit)
+
     policy_names = utils.load_alert_policy_names(
         policy_file_path,
         entity_file_path,
@@ -332,7 +405,9 @@ def migrate(
         target_region,
         target_api_key,
         cond_types,
-        match_source_state
+        match_source_state,
+        workers,
+        use_local
     )
 
     status_file = ac.get_alert_status_file_name(
@@ -402,6 +477,17 @@ class MigrateConditionsCommand:
             fallback=args.match_source_state
         )
 
+        workers = config.getint(
+            'migrate.conditions',
+            'workers',
+            fallback=args.workers[0] if args.workers else 1
+        )
+        rate_limit = config.getfloat(
+            'migrate.conditions',
+            'rate_limit',
+            fallback=args.rate_limit[0] if args.rate_limit else None
+        )
+
         cond_types = parse_condition_types_with_config(config, args)
         if len(cond_types) == 0:
             logger.error('At least one condition type must be specified currently supported ' +
@@ -419,7 +505,9 @@ class MigrateConditionsCommand:
             base_config['target_api_key'],
             cond_types,
             use_local,
-            match_source_state
+            match_source_state,
+            workers,
+            rate_limit
         )
         
         logger.info('Completed alert condition migration.')
@@ -460,7 +548,9 @@ def main():
         tgt_api_key,
         cond_types,
         args.use_local,
-        args.match_source_state
+        args.match_source_state,
+        args.workers[0] if args.workers else 1,
+        args.rate_limit[0] if args.rate_limit else None
     )
 
 
@@ -4,6 +4,7 @@ import os
 import sys
 import time
 import library.localstore as store
+import library.monitorstore as monitorstore
 import library.migrationlogger as migrationlogger
 import library.clients.monitorsclient as mc
 import library.monitortypes as monitortypes
@@ -108,7 +109,7 @@ def migrate(all_monitors_json, src_api_key, src_region, tgt_api_key, tgt_region,
 def migrate_monitors(from_file, src_acct, src_region, src_api_key, time_stamp, tgt_acct_id, tgt_region, tgt_api_key):
     monitor_names = store.load_names(from_file)
     logger.debug(monitor_names)
-    all_monitors_json = store.load_monitors(src_acct, time_stamp, monitor_names)
+    all_monitors_json = monitorstore.load_monitors(src_acct, time_stamp, monitor_names)
     monitor_status = migrate(all_monitors_json, src_api_key, src_region, tgt_api_key, tgt_region, tgt_acct_id)
     logger.debug(monitor_status)
     file_name = utils.file_name_from(from_file)
@@ -5,6 +5,7 @@ import sys
 
 from typing import List
 
+import library.checkpoint as checkpoint
 import library.localstore as store
 import library.status.alertstatus as askeys
 import library.migrationlogger as m_logger
@@ -214,17 +215,27 @@ def migrate_alert_policies(policy_names: List[str],
         logger.info('Loading pre-fetched channel and policy assignment information')
         loaded_src_channels = store.load_alert_channels(src_account)
     tgt_channels_by_type_name = get_channels_by_type_name(tgt_api_key, tgt_region)
+    src_policies = ac.policy_index(src_api_key, src_account, src_region)
+    tgt_policies = ac.policy_index(tgt_api_key, tgt_account, tgt_region)
+    completed = checkpoint.current()
     logger.info('Migrating the following policies:')
     logger.info('%s' % policy_names)
     for policy_name in policy_names:
         all_alert_status[policy_name] = {}
-        result = ac.get_policy(src_api_key, policy_name, src_region)
+        result = src_policies.get(policy_name)
         if not result['policyFound']:
             logger.error("Skipping as policy not found in source account " + policy_name)
             all_alert_status[policy_name][askeys.ERROR] = "Policy Not found in source account"
             continue
         src_policy = result['policy']
-        result = ac.get_policy(tgt_api_key, policy_name, tgt_region)
+        tgt_policy_id = completed.target(checkpoint.POLICY, policy_name)
+        if tgt_policy_id is not None:
+            logger.info('Policy already migrated in this run : ' + policy_name)
+            all_alert_status[policy_name] = {askeys.POLICY_EXISTED: True}
+            src_policy['targetPolicyId'] = tgt_policy_id
+            policies_by_source_id.setdefault(src_policy['id'], src_policy)
+            continue
+        result = tgt_policies.get(policy_name)
         if result['status'] in [200, 304] and result['policyFound']:
             logger.info('Policy exists : ' + policy_name)
             all_alert_status[policy_name] = {askeys.POLICY_EXISTED: True}
@@ -235,10 +246,15 @@ def migrate_alert_policies(policy_names: List[str],
             result = ac.create_alert_policy(tgt_api_key, src_policy, tgt_region)
             update_create_status(all_alert_status, policy_name, result)
             tgt_policy = result['policy']
+            tgt_policies.add(tgt_policy)
         src_policy['targetPolicyId'] = tgt_policy['id']
         policies_by_source_id.setdefault(src_policy['id'], src_policy)
+        completed.record(checkpoint.POLICY, policy_name, tgt_policy['id'])
         # update_notification_channels(tgt_api_key, tgt_region, src_policy, tgt_policy, loaded_src_channels,
         #                              tgt_channels_by_type_name, all_alert_status)
+    # an index that could not list every target policy would leave a partial list that --useLocal reads as complete
+    if tgt_policies.complete:
+        tgt_policies.save()
     logger.info('Alert migration complete.')
     return_dict = dict()
     return_dict['all_alert_status'] = all_alert_status
@@ -3,6 +3,7 @@ import os
 import sys
 import time
 import library.clients.entityclient as ec
+import library.checkpoint as checkpoint
 import library.localstore as store
 import library.migrationlogger as migrationlogger
 import library.status.tagstatus as tgkeys
@@ -48,6 +49,14 @@ def configure_parser():
                         help='Pass --mobile to migrate Mobile entity tags')
     parser.add_argument('--lambda', dest='lambda_function', required=False, action='store_true',
                         help='Pass --lambda to migrate Lambda function entity tags')
+    parser.add_argument('--useLocal', '--use_local', dest='use_local', required=False, action='store_true',
+                        help='Pass --useLocal to use the source entities saved in db/<sourceAccount>/entities '
+                             'by an earlier run instead of fetching them')
+    parser.add_argument('--prefetch', dest='prefetch', required=False, action='store_true',
+                        help='Pass --prefetch to fetch all entities of every requested type from both accounts '
+                             'up front, in parallel, instead of each type on first use')
+    parser.add_argument('--batchSize', '--batch_size', nargs=1, type=int, required=False, dest='batch_size',
+                        help='Number of entities to tag with each request (default %d)' % ec.TAG_MUTATIONS_BATCH_SIZE)
     return parser
 
 
@@ -74,19 +83,48 @@ def parse_entity_types(args):
     return entity_types
 
 
+# Tags are added with one aliased mutation for every batch_size entities that need tags
+def add_tags(tgt_api_key, tgt_region, pending, tag_status, batch_size):
+    completed = checkpoint.current()
+    for start in range(0, len(pending), batch_size):
+        batch = pending[start:start + batch_size]
+        logger.info('Adding tags to %d entities' % len(batch))
+        results = ec.gql_mutate_add_tags_batch(tgt_api_key, [(guid, tags_needed) for _, _, guid, tags_needed in batch],
+                                               tgt_region)
+        for (entity_name, tags_key, guid, _), result in zip(batch, results):
+            if 'error' in result:
+                tag_status[entity_name][tgkeys.TAGS_ADDED] = False
+                tag_status[entity_name][tgkeys.ERROR] = result['error']
+                continue
+            tag_status[entity_name][tgkeys.TAGS_ADDED] = True
+            completed.record(checkpoint.TAGS, tags_key, guid)
+
+
 def migrate_tags(from_file: str, src_account_id: str, src_region: str, src_api_key: str,
-                 tgt_account_id: str, tgt_region: str, tgt_api_key: str, entity_types):
+                 tgt_account_id: str, tgt_region: str, tgt_api_key: str, entity_types, use_local=False,
+                 batch_size=ec.TAG_MUTATIONS_BATCH_SIZE, prefetch=False):
     tag_status = {}
+    pending = []
     entity_names = store.load_names(from_file)
+    src_entities = ec.entity_resolver(src_api_key, src_account_id, src_region, use_local)
+    tgt_entities = ec.entity_resolver(tgt_api_key, tgt_account_id, tgt_region)
+    if prefetch:
+        logger.info('Prefetching %s entities from accounts %s and %s' %
+                    (','.join(entity_types), src_account_id, tgt_account_id))
+        ec.prefetch_entities([src_entities, tgt_entities], entity_types)
+    completed = checkpoint.current()
     for entity_name in entity_names:
         tag_status[entity_name] = {}
         tag_status[entity_name][tgkeys.ENTITY_NAME] = entity_name
+        tags_key = ','.join(entity_types) + ':' + entity_name
+        if completed.done(checkpoint.TAGS, tags_key):
+            logger.info('Tags already migrated in this run for entity ' + entity_name)
+            continue
         logger.info('Migrating tags for entity ' + entity_name)
         src_entity = None
         for entity_type in entity_types:
             if src_entity is None:
-                src_result = ec.gql_get_matching_entity_by_name(src_api_key, entity_type, entity_name,
-                                                                src_account_id, src_region)
+                src_result = src_entities.match_by_name(entity_type, entity_name)
                 if src_result['entityFound']:
                     src_entity = src_result['entity']
                     tag_status[entity_name][tgkeys.ENTITY_TYPE] = entity_type
@@ -102,8 +140,7 @@ def migrate_tags(from_file: str, src_account_id: str, src_region: str, src_api_k
         tgt_entity = None
         for entity_type in entity_types:
             if tgt_entity is None:
-                tgt_result = ec.gql_get_matching_entity_by_name(tgt_api_key, entity_type, entity_name,
-                                                                tgt_account_id, tgt_region)
+                tgt_result = tgt_entities.match_by_name(entity_type, entity_name)
                 if tgt_result['entityFound']:
                     tgt_entity = tgt_result['entity']
                     tag_status[entity_name][tgkeys.ENTITY_TYPE] = entity_type
@@ -121,14 +158,11 @@ def migrate_tags(from_file: str, src_account_id: str, src_region: str, src_api_k
         if len(tags_needed) == 0:
             logger.info("Target entity " + tgt_entity['name'] + 'already contains all necessary tags')
             tag_status[entity_name][tgkeys.TAGS_NEEDED] = False
+            completed.record(checkpoint.TAGS, tags_key, tgt_entity['guid'])
             continue
         tag_status[entity_name][tgkeys.TAGS_NEEDED] = tags_needed
-        result = ec.gql_mutate_add_tags(tgt_api_key, tgt_entity['guid'], tags_needed, tgt_region)
-        if 'error' in result:
-            tag_status[entity_name][tgkeys.TAGS_ADDED] = False
-            tag_status[entity_name][tgkeys.ERROR] = result['error']
-            continue
-        tag_status[entity_name][tgkeys.TAGS_ADDED] = True
+        pending.append((entity_name, tags_key, tgt_entity['guid'], tags_needed))
+    add_tags(tgt_api_key, tgt_region, pending, tag_status, batch_size)
     file_name = utils.file_name_from(from_file)
     status_csv = src_account_id + "_" + file_name + "_" + tgt_account_id + ".csv"
     store.save_status_csv(status_csv, tag_status, tgkeys)
@@ -152,7 +186,8 @@ def main():
         sys.exit()
 
     migrate_tags(args.fromFile[0], args.sourceAccount[0], src_region, source_api_key,
-                 args.targetAccount[0], tgt_region, target_api_key, entity_types)
+                 args.targetAccount[0], tgt_region, target_api_key, entity_types, args.use_local,
+                 args.batch_size[0] if args.batch_size else ec.TAG_MUTATIONS_BATCH_SIZE, args.prefetch)
 
 
 if __name__ == '__main__':
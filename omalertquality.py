@@ -54,8 +54,9 @@ def add_channel_to_policies(account_id, user_api_key, channel_name, policy_file,
     if channel_id == -1:
         utils.error_message_and_exit("Notification channel not found " + channel_name)
     policy_names = store.load_names(policy_file)
+    policies = ac.policy_index(user_api_key, account_id, region)
     for policy_name in policy_names:
-        result = ac.get_policy(user_api_key, policy_name, region)
+        result = policies.get(policy_name)
         if not result['policyFound']:
             log.warn("Did not find policy skipping " + policy_name)
         log.info("Found Policy adding channel to " + policy_name)
@@ -1,8 +1,8 @@
 import argparse
 import os
 import sys
-import time
 import library.localstore as localstore
+import library.monitorstore as monitorstore
 import library.migrationlogger as migrationlogger
 import library.monitortypes as monitortypes
 import library.clients.monitorsclient as monitorsclient
@@ -70,16 +70,13 @@ def replicate(all_monitors_json, copies):
                     monitorsclient.put_script(target_api_key, monitor_json, monitor_name, monitor_status)
             monitorsclient.apply_labels(target_api_key, monitor_labels, monitor_name, monitor_status)
             logger.debug(monitor_status[monitor_name])
-            # trying to stay within 3 requests per second
-            # we are assuming it will take around 500 ms to process 3 requests
-            time.sleep(0.5)
     return monitor_status
 
 
 def replicate_monitors():
     monitor_names = localstore.load_names(args.fromFile[0])
     logger.debug(monitor_names)
-    all_monitors_json = localstore.load_monitors(args.sourceAccount[0], args.timeStamp[0], monitor_names)
+    all_monitors_json = monitorstore.load_monitors(args.sourceAccount[0], args.timeStamp[0], monitor_names)
     monitor_status = replicate(all_monitors_json, args.copies[0])
     logger.debug(monitor_status)
 
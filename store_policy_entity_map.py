@@ -19,6 +19,10 @@ def configure_parser():
     set env var ENV_SOURCE_API_KEY')
     parser.add_argument('--useLocal', dest='useLocal', required=False, action='store_true',
                         help='By default policies are fetched. Pass this to use policies pre-fetched by store_policies.')
+    parser.add_argument('--incremental', dest='incremental', required=False, action='store_true',
+                        help='Only fetch the conditions of policies updated since the stored map was built.')
+    parser.add_argument('--workers', type=int, nargs=1, required=False,
+                        help='Number of policies to fetch conditions for in parallel (default 1)')
     return parser
 
 
@@ -27,6 +31,9 @@ def print_params(args, src_api_key, src_region):
     logger.info("sourceRegion : " + src_region)
     logger.info("Using sourceApiKey : " + len(src_api_key[:-4]) * "*" + src_api_key[-4:])
     logger.info("Using useLocal : " + str(args.useLocal))
+    logger.info("Using incremental : " + str(args.incremental))
+    if args.workers:
+        logger.info("Using workers : " + str(args.workers[0]))
 
 
 def find_policy_name(policies, policy_id):
@@ -35,7 +42,7 @@ def find_policy_name(policies, policy_id):
             return policy.name
 
 
-def store_policy_entity_map(src_api_key, src_account_id, src_region, use_local):
+def store_policy_entity_map(src_api_key, src_account_id, src_region, use_local, incremental=False, workers=1):
     if use_local:
         logger.info('Loading alert policies from local...')
         all_policies = store.load_alert_policies(src_account_id)
@@ -47,8 +54,15 @@ def store_policy_entity_map(src_api_key, src_account_id, src_region, use_local):
         return
     logger.info('%d policies loaded. Mapping app entity conditions for account ID %s.' %
                 (all_policies['response_count'], src_account_id))
-    policy_entity_map = ac.get_policy_entity_map(src_api_key, all_policies['policies'], src_region)
-    store.save_alert_policy_entity_map(src_account_id, policy_entity_map)
+    previous = None
+    if incremental:
+        previous = store.load_alert_policy_entity_map(src_account_id)
+        if 'updated_at_by_policy' not in previous:
+            logger.info('No stored map with policy update times, building the full map')
+            previous = None
+    policy_entity_map = ac.get_policy_entity_map(src_api_key, all_policies['policies'], src_region,
+                                                 workers, previous)
+    store.save_alert_policy_entity_map(src_account_id, ac.policy_entity_map_json(policy_entity_map))
 
 
 def main():
@@ -61,7 +75,8 @@ def main():
         utils.error_and_exit('source_api_key', 'ENV_SOURCE_API_KEY')
     src_region = utils.ensure_source_region(args)
     print_params(args, src_api_key, src_region)
-    store_policy_entity_map(src_api_key, args.sourceAccount[0], src_region, args.useLocal)
+    workers = args.workers[0] if args.workers else 1
+    store_policy_entity_map(src_api_key, args.sourceAccount[0], src_region, args.useLocal, args.incremental, workers)
     logger.info("Time taken : " + str(time.time() - start_time) + "seconds")
 
 
@@ -2,6 +2,7 @@ import argparse
 import sys
 import os
 import library.localstore as localstore
+import library.monitorstore as monitorstore
 import library.migrationlogger as migrationlogger
 import library.clients.monitorsclient as monitorsclient
 import library.status.updatestatus as updatestatus
@@ -53,7 +54,7 @@ def print_args(args, tgt_region):
 
 def update_monitors(api_key, account_id, from_file, time_stamp, prefix, disable_flag, enable_flag, tgt_region):
     update_list = localstore.load_names(from_file)
-    all_monitors = localstore.load_monitors(account_id, time_stamp, update_list)
+    all_monitors = monitorstore.load_monitors(account_id, time_stamp, update_list)
     all_monitor_status = {}
     for monitor in all_monitors:
         monitor_id = monitor['definition']['id']